@@ -0,0 +1,115 @@
+""" Many clients in one process.
+
+Runs `--clients` Client instances, each with its own account keys and
+config, in one event loop against stand-in servers, with `--tunnels`
+echo tunnels per fetcher link. Reports the time until all of them are
+ready, the memory per client, the relayed throughput and checks that
+stop() closes every link for good.
+
+    python -m hpxclient.benchmarks.clients --clients 50 --tunnels 4
+"""
+import sys
+import time
+import asyncio
+import argparse
+import resource
+
+from hpxclient import config as hpxclient_config
+from hpxclient import client as hpxclient_client
+from hpxclient.benchmarks import standin
+
+
+def get_rss_mb():
+    """ Current resident set size, Linux only. """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return pages * resource.getpagesize() / (1024 * 1024)
+
+
+async def run(clients, tunnels, pool_size, duration):
+    upstream_server, upstream_port = await standin.start_echo_server()
+    load_server = standin.TunnelLoadServer(
+        '127.0.0.1', upstream_port, tunnels=tunnels)
+    fetcher_port = await load_server.start()
+    mng_server = standin.StandinServer()
+    mng_port = await mng_server.start()
+
+    rss_before = get_rss_mb()
+    start = time.perf_counter()
+    instances = []
+    for i in range(clients):
+        config = hpxclient_config.Config(
+            PROXY_FETCHER_SERVER_IP='127.0.0.1',
+            PROXY_FETCHER_SERVER_PORT=fetcher_port,
+            PROXY_MNG_SERVER_IP='127.0.0.1',
+            PROXY_MNG_SERVER_PORT=mng_port,
+            PROXY_SSL_ENABLED=False,
+            FETCHER_POOL_SIZE=pool_size)
+        client = hpxclient_client.Client(
+            public_key='benchmark-%s' % i, secret_key='benchmark',
+            config=config)
+        await client.start()
+        instances.append(client)
+    await asyncio.gather(*[client.wait_ready(timeout=30)
+                           for client in instances])
+    ready_time = time.perf_counter() - start
+
+    await asyncio.sleep(1)
+    received = load_server.bytes_received
+    start = time.perf_counter()
+    await asyncio.sleep(duration)
+    elapsed = time.perf_counter() - start
+    received = load_server.bytes_received - received
+    rss_after = get_rss_mb()
+    tunnel_count = sum(client.get_stats()['tunnels'] for client in instances)
+
+    await asyncio.gather(*[client.stop() for client in instances])
+    # Give reconnects a chance to show up.
+    await asyncio.sleep(1)
+    links_left = len(load_server.links) + len(mng_server.links)
+
+    load_server.close()
+    mng_server.close()
+    upstream_server.close()
+    return {
+        'clients': clients,
+        'tunnels': tunnel_count,
+        'ready_s': ready_time,
+        'rss_mb_per_client': (rss_after - rss_before) / clients,
+        'throughput_mb_s': received / elapsed / (1024 * 1024),
+        'links_left': links_left,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--tunnels", type=int, default=4,
+                        help="Tunnels per fetcher link.")
+    parser.add_argument("--pool-size", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=3)
+    args = parser.parse_args(argv)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    result = loop.run_until_complete(run(
+        args.clients, args.tunnels, args.pool_size, args.duration))
+    loop.run_until_complete(standin.cancel_pending_tasks(loop))
+    loop.close()
+
+    print('clients: %s, tunnels: %s' % (result['clients'], result['tunnels']))
+    print('all ready in %.3fs' % result['ready_s'])
+    print('RSS per client: %.2f MB' % result['rss_mb_per_client'])
+    print('relayed: %.1f MB/s' % result['throughput_mb_s'])
+    print('links left after stop: %s' % result['links_left'])
+    if result['links_left']:
+        print('FAILED')
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+""" Codec benchmark for TRANS_DATA frames, v1 (msgpack) against v2
+(binary header + raw payload).
+
+Encodes and decodes the same payloads with both formats and reports
+the CPU time spent per GB of payload.
+
+    python -m hpxclient.benchmarks.codec --size 256 --chunks 1400,16384
+"""
+import sys
+import time
+import argparse
+
+from hpxclient import protocols
+from hpxclient import producers
+
+
+def encode_v1(conn_id, data):
+    return protocols.encode_msg(
+        producers.TransferDataProducer(conn_id, data).msg2str())
+
+
+def encode_v2(conn_id, data):
+    header = protocols.encode_binary_trans_data_header(conn_id, len(data))
+    return protocols.LENGTH_STRUCT.pack(len(header) + len(data)) + header + data
+
+
+def run(encode, payload, total_size):
+    decoder = protocols.FrameDecoder()
+    iterations = max(1, total_size // len(payload))
+
+    start = time.process_time()
+    for i in range(iterations):
+        messages = decoder.feed(encode(i & 0xffff, payload))
+        assert messages[0][b'data'][b'data'] == payload
+    elapsed = time.process_time() - start
+
+    gb = iterations * len(payload) / (1024 ** 3)
+    return elapsed / gb
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=256,
+                        help="MB of payload per run.")
+    parser.add_argument("--chunks", default="512,1400,16384,65536",
+                        help="Comma separated payload sizes.")
+    args = parser.parse_args(argv)
+
+    total_size = args.size * 1024 * 1024
+    print("%10s %14s %14s %8s" % ("chunk", "v1 CPU s/GB", "v2 CPU s/GB",
+                                  "ratio"))
+    for chunk in args.chunks.split(','):
+        payload = b'x' * int(chunk)
+        v1 = run(encode_v1, payload, total_size)
+        v2 = run(encode_v2, payload, total_size)
+        print("%10s %14.2f %14.2f %7.1fx" % (chunk, v1, v2, v1 / v2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
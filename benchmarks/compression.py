@@ -0,0 +1,182 @@
+""" Tunnel data compression, bytes saved versus CPU spent.
+
+The codec part runs payloads through the tunnel compressor of the client
+in `--chunk-size` chunks: text, random bytes standing for TLS or images,
+and a mix switching between both every megabyte. It reports the
+compressed size and the CPU time per megabyte saved, for each
+`--levels`.
+
+The link part relays `--tunnels` echo tunnels through one fetcher link
+to a stand-in server compressing its side too, with and without
+compression, and reports the relayed throughput, the bytes the client
+wrote to the link and the CPU time of the client codec.
+
+    python -m hpxclient.benchmarks.compression --duration 3 --levels 1 6
+"""
+import sys
+import time
+import zlib
+import random
+import asyncio
+import argparse
+
+from hpxclient import config as hpxclient_config
+from hpxclient.benchmarks import standin
+from hpxclient.fetcher.central import compression as fetcher_central_compression
+
+
+MB = 1024 * 1024
+
+WORDS = ('the proxy tunnel data server client request response header '
+         'content length type text html json value id name status ok '
+         'error user session time date cache control accept encoding').split()
+
+
+def make_text(size, seed=0):
+    """ JSON-ish records, compressing about as well as web content. """
+    rnd = random.Random(seed)
+    parts = []
+    total = 0
+    while total < size:
+        record = '{"id": %d, "name": "%s", "status": "%s", "tags": [%s]}\n' % (
+            rnd.randrange(10 ** 6),
+            ' '.join(rnd.choice(WORDS) for _ in range(rnd.randrange(2, 6))),
+            rnd.choice(WORDS),
+            ', '.join('"%s"' % rnd.choice(WORDS)
+                      for _ in range(rnd.randrange(1, 4))))
+        parts.append(record)
+        total += len(record)
+    return ''.join(parts).encode()[:size]
+
+
+def make_random(size, seed=1):
+    return random.Random(seed).randbytes(size)
+
+
+def make_mixed(size):
+    parts = []
+    for offset in range(0, size, MB):
+        make = make_text if (offset // MB) % 2 == 0 else make_random
+        parts.append(make(min(MB, size - offset), seed=offset))
+    return b''.join(parts)
+
+
+PAYLOADS = {
+    'text': make_text,
+    'random': make_random,
+    'mixed': make_mixed,
+}
+
+
+class CodecLink(object):
+    """ Stands for the fetcher link: counts the bytes it would send and
+    checks that they decompress back to the payload.
+    """
+
+    def __init__(self, level):
+        self.config = hpxclient_config.Config(
+            COMPRESSION_LEVEL=level, COMPRESSION_THREAD_SIZE=sys.maxsize)
+        self.size_out = 0
+        self.decompressor = zlib.decompressobj()
+        self.received = []
+
+    def copy_data(self, data):
+        return bytes(data)
+
+    def send_data(self, conn_id, data, compressed=False):
+        self.size_out += len(data)
+        if compressed:
+            data = self.decompressor.decompress(data)
+        self.received.append(bytes(data))
+
+
+def run_codec(payload, chunk_size, level):
+    link = CodecLink(level)
+    compression = fetcher_central_compression.LinkCompression(link, 'zlib')
+    with memoryview(payload) as view:
+        for offset in range(0, len(payload), chunk_size):
+            compression.send_data(1, view[offset:offset + chunk_size])
+    if b''.join(link.received) != payload:
+        raise AssertionError('Payload corrupted')
+    return link.size_out, compression.compress_time
+
+
+async def run_link(payload, compression, tunnels, duration):
+    upstream_server, upstream_port = await standin.start_echo_server()
+    load_server = standin.TunnelLoadServer(
+        '127.0.0.1', upstream_port, tunnels=tunnels, payload=payload,
+        compression=compression is not None)
+    port = await load_server.start()
+    link = await standin.connect_fetcher(
+        port, config=hpxclient_config.Config(COMPRESSION=compression))
+
+    await asyncio.sleep(0.5)
+    received = load_server.bytes_received
+    wire_received = load_server.wire_bytes_received
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    await asyncio.sleep(duration)
+    elapsed = time.perf_counter() - start
+    cpu_time = time.process_time() - cpu_start
+    received = load_server.bytes_received - received
+    wire_received = load_server.wire_bytes_received - wire_received
+    stats = link.get_flow_stats()['compression']
+
+    link.close()
+    load_server.close()
+    upstream_server.close()
+    return {
+        'throughput_mb_s': received / elapsed / MB,
+        'wire_ratio': wire_received / received if received else 0,
+        'cpu_per_mb': cpu_time / (received / MB) if received else 0,
+        'codec_time': (stats['compress_time'] + stats['decompress_time']
+                       if stats else 0),
+        'threaded': stats['threaded'] if stats else 0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=8,
+                        help="Payload size (MB) of the codec part.")
+    parser.add_argument("--chunk-size", type=int, default=65536)
+    parser.add_argument("--levels", type=int, nargs='+', default=[1, 6])
+    parser.add_argument("--tunnels", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=3)
+    args = parser.parse_args(argv)
+
+    print('codec, %s byte chunks:' % args.chunk_size)
+    for name, make in PAYLOADS.items():
+        payload = make(args.size * MB)
+        for level in args.levels:
+            size_out, cpu_time = run_codec(payload, args.chunk_size, level)
+            saved = (len(payload) - size_out) / MB
+            print('  %-6s level %s: %5.1f%% of the size, %5.1f MB saved, '
+                  '%6.1fms CPU (%s ms/MB saved)' % (
+                      name, level, 100 * size_out / len(payload), saved,
+                      cpu_time * 1000,
+                      '%.1f' % (cpu_time * 1000 / saved) if saved > 0
+                      else '-'))
+
+    print('link, %s echo tunnels:' % args.tunnels)
+    for name in ('text', 'random'):
+        payload = PAYLOADS[name](4 * MB)
+        for compression in (None, 'zlib'):
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            result = loop.run_until_complete(run_link(
+                payload, compression, args.tunnels, args.duration))
+            loop.run_until_complete(standin.cancel_pending_tasks(loop))
+            loop.close()
+            print('  %-6s %-4s: %6.1f MB/s, wire %5.1f%% of the data, '
+                  'process CPU %5.1fms/MB, codec CPU %6.1fms, '
+                  '%s chunks in threads' % (
+                      name, compression or 'off',
+                      result['throughput_mb_s'],
+                      100 * result['wire_ratio'], result['cpu_per_mb'] * 1000,
+                      result['codec_time'] * 1000, result['threaded']))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
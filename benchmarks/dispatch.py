@@ -0,0 +1,123 @@
+""" Benchmark of inbound message dispatch through CentralFetcherProtocol.
+
+Queues TRANS_DATA messages for a set of registered processors and runs
+them through the protocol's message processor, once with the current
+dispatch table and once with the previous linear consumer lookup.
+
+    python -m hpxclient.benchmarks.dispatch --messages 200000
+"""
+import sys
+import time
+import asyncio
+import argparse
+
+from hpxclient import consts
+from hpxclient import protocols
+from hpxclient.fetcher.central import service as fetcher_central_service
+
+
+class FakeTransport(object):
+    def write(self, data):
+        pass
+
+    def is_closing(self):
+        return False
+
+    def close(self):
+        pass
+
+
+class CountingProcessor(object):
+    def __init__(self, conn_id, counter):
+        self.conn_id = conn_id
+        self.counter = counter
+        self.transport = None
+
+    def write_data(self, data):
+        self.counter.hit()
+
+
+class Counter(object):
+    def __init__(self, target):
+        self.count = 0
+        self.target = target
+        self.done = asyncio.Future()
+
+    def hit(self):
+        self.count += 1
+        if self.count == self.target:
+            self.done.set_result(None)
+
+
+async def legacy_message_processor(proto):
+    """ Message processor as it was before the dispatch table. """
+    consumer_list = proto.REGISTERED_CONSUMERS
+
+    while proto.transport is not None:
+        data = await proto._queue.get()
+
+        consumer_kind = data[b'kind'].decode()
+
+        consumer_cls = None
+        for cls in consumer_list:
+            if consumer_kind != cls.KIND:
+                continue
+            consumer_cls = cls
+            break
+
+        if consumer_cls is None:
+            print('Consumer not found [kind=%s]' %consumer_kind)
+            continue
+
+        consumer = consumer_cls(proto, data[b'data'])
+        if asyncio.iscoroutinefunction(getattr(consumer, 'process')):
+            await consumer.process()
+            continue
+
+        consumer.process()
+
+
+async def run(processor_func, message_count, conn_count):
+    proto = fetcher_central_service.CentralFetcherProtocol(
+        None, None, None, None)
+    proto.transport = FakeTransport()
+
+    counter = Counter(message_count)
+    for conn_id in range(conn_count):
+        proto.processors.add(conn_id, CountingProcessor(conn_id, counter))
+
+    kind = consts.TRANS_DATA_KIND.encode()
+    for i in range(message_count):
+        proto._queue.put_nowait({
+            b'kind': kind,
+            b'data': {b'conn_id': i % conn_count, b'data': b'x'}
+        })
+
+    start = time.perf_counter()
+    task = asyncio.ensure_future(processor_func(proto))
+    await counter.done
+    elapsed = time.perf_counter() - start
+
+    task.cancel()
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--conns", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for name, processor_func in (
+            ("legacy", legacy_message_processor),
+            ("table", protocols.activate_message_processor)):
+        elapsed = loop.run_until_complete(
+            run(processor_func, args.messages, args.conns))
+        print("%8s: %10.0f messages/s" % (name, args.messages / elapsed))
+    loop.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
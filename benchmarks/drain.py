@@ -0,0 +1,234 @@
+""" Shutdown drain and configuration reload.
+
+Runs a Client against a stand-in server opening `--tunnels` tunnels per
+link, each echoing a `--transfer-size` transfer before the server closes
+it and opens the next one. After `--duration` seconds the client is shut
+down, with stop() as before and with drain(), and the transfers cut
+halfway are counted, as well as the tunnels refused while draining.
+
+The reload part changes RATE_LIMIT while the transfers run and reports
+the relayed throughput before and after Client.reload(), with the
+transfers cut meanwhile. RATE_LIMIT covers both directions, the echoed
+transfers relay about half of it.
+
+    python -m hpxclient.benchmarks.drain --tunnels 8 --transfer-size 4
+"""
+import sys
+import time
+import asyncio
+import argparse
+
+from hpxclient import consts
+from hpxclient import settings
+from hpxclient import config as hpxclient_config
+from hpxclient import client as hpxclient_client
+from hpxclient.benchmarks import standin
+
+
+MB = 1024 * 1024
+
+
+class TransferServer(standin.TunnelLoadServer):
+    """ Tunnels carrying one transfer each, closed by the server once it
+    is echoed back and replaced while the link is up.
+    """
+
+    def __init__(self, *args, transfer_size=4 * MB, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.transfer_size = transfer_size
+        self.completed = 0
+        self.cut = 0
+        self.refused = 0
+        self._close_errors = {}
+
+    def fill_window(self, tunnel):
+        chunk_size = self.chunk_size
+        while (tunnel.sent < self.transfer_size
+               and tunnel.sent - tunnel.received + chunk_size <= self.window):
+            tunnel.link.send_data(tunnel.conn_id, self.next_chunk(tunnel))
+            tunnel.sent += chunk_size
+            self.bytes_sent += chunk_size
+
+    def on_data(self, link, conn_id, data):
+        tunnel = self.tunnels.get(conn_id)
+        if tunnel is None:
+            return
+        self.bytes_received += len(data)
+        tunnel.received += len(data)
+        if tunnel.received >= self.transfer_size:
+            self.completed += 1
+            self.close_tunnel(tunnel)
+            if link in self.links:
+                self.open_tunnel(link)
+            return
+        self.fill_window(tunnel)
+
+    def message_received(self, link, message):
+        if message[b'kind'].decode() == consts.CLOSE_CONN_KIND:
+            data = message[b'data']
+            self._close_errors[data[b'conn_id']] = data.get(b'error')
+        super().message_received(link, message)
+
+    def on_close(self, link, conn_id):
+        error = self._close_errors.pop(conn_id, None)
+        if self.tunnels.pop(conn_id, None) is None:
+            return
+        self.closed += 1
+        if error == b'draining':
+            self.refused += 1
+        else:
+            self.cut += 1
+
+    def on_link_lost(self, link):
+        for conn_id, tunnel in list(self.tunnels.items()):
+            if tunnel.link is link:
+                del self.tunnels[conn_id]
+                self.cut += 1
+
+
+async def start_client(server, mng_server):
+    config = hpxclient_config.Config(
+        PROXY_FETCHER_SERVER_IP='127.0.0.1',
+        PROXY_FETCHER_SERVER_PORT=server.port,
+        PROXY_MNG_SERVER_IP='127.0.0.1',
+        PROXY_MNG_SERVER_PORT=mng_server.port,
+        PROXY_SSL_ENABLED=False,
+        SESSION_RESUME=False)
+    client = hpxclient_client.Client(
+        public_key='benchmark', secret_key='benchmark', config=config)
+    await client.start()
+    await client.wait_ready(timeout=10)
+    return client
+
+
+async def run_shutdown(mode, tunnels, transfer_size, duration, timeout):
+    upstream_server, upstream_port = await standin.start_echo_server()
+    server = TransferServer('127.0.0.1', upstream_port, tunnels=tunnels,
+                            transfer_size=transfer_size)
+    await server.start()
+    mng_server = standin.StandinServer()
+    await mng_server.start()
+    client = await start_client(server, mng_server)
+
+    await asyncio.sleep(duration)
+    completed = server.completed
+    start = time.perf_counter()
+    if mode == 'drain':
+        await client.drain(timeout)
+    else:
+        await client.stop()
+    shutdown_time = time.perf_counter() - start
+    # Let the server see the links go.
+    await asyncio.sleep(0.5)
+
+    result = {
+        'mode': mode,
+        'completed': completed,
+        'completed_during_shutdown': server.completed - completed,
+        'cut': server.cut,
+        'refused': server.refused,
+        'shutdown_s': shutdown_time,
+        'links_left': len(server.links),
+    }
+    server.close()
+    mng_server.close()
+    upstream_server.close()
+    return result
+
+
+async def measure(server, duration):
+    received = server.bytes_received
+    start = time.perf_counter()
+    await asyncio.sleep(duration)
+    return ((server.bytes_received - received)
+            / (time.perf_counter() - start) / MB)
+
+
+async def run_reload(tunnels, transfer_size, duration, rates):
+    upstream_server, upstream_port = await standin.start_echo_server()
+    server = TransferServer('127.0.0.1', upstream_port, tunnels=tunnels,
+                            transfer_size=transfer_size)
+    await server.start()
+    mng_server = standin.StandinServer()
+    await mng_server.start()
+
+    rate_limit = settings.RATE_LIMIT
+    settings.RATE_LIMIT = rates[0] * MB
+    try:
+        client = await start_client(server, mng_server)
+        throughputs = []
+        for rate in rates:
+            settings.RATE_LIMIT = rate * MB
+            client.reload()
+            # Past the debt of the previous rate.
+            await asyncio.sleep(0.5)
+            throughputs.append((rate, await measure(server, duration)))
+        cut = server.cut
+        await client.drain()
+    finally:
+        settings.RATE_LIMIT = rate_limit
+
+    server.close()
+    mng_server.close()
+    upstream_server.close()
+    return {
+        'throughputs': throughputs,
+        'completed': server.completed,
+        'cut': cut,
+    }
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    result = loop.run_until_complete(coroutine)
+    loop.run_until_complete(standin.cancel_pending_tasks(loop))
+    loop.close()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tunnels", type=int, default=8)
+    parser.add_argument("--transfer-size", type=float, default=4,
+                        help="Size (MB) of the transfer of every tunnel.")
+    parser.add_argument("--duration", type=float, default=2)
+    parser.add_argument("--timeout", type=float, default=10,
+                        help="Drain timeout.")
+    parser.add_argument("--rates", type=float, nargs='+',
+                        default=[20, 80, 40],
+                        help="RATE_LIMIT values (MB/s) of the reload part.")
+    args = parser.parse_args(argv)
+    transfer_size = int(args.transfer_size * MB)
+
+    failed = False
+    for mode in ('stop', 'drain'):
+        result = run(run_shutdown(mode, args.tunnels, transfer_size,
+                                  args.duration, args.timeout))
+        print('%-5s: %s transfers done before, %s during the shutdown, '
+              '%s cut, %s refused, shut down in %.3fs, %s links left' % (
+                  mode, result['completed'],
+                  result['completed_during_shutdown'], result['cut'],
+                  result['refused'], result['shutdown_s'],
+                  result['links_left']))
+        if mode == 'drain' and (result['cut'] or result['links_left']):
+            failed = True
+
+    result = run(run_reload(args.tunnels, transfer_size, args.duration,
+                            args.rates))
+    for rate, throughput in result['throughputs']:
+        print('reload RATE_LIMIT=%s MB/s: %.1f MB/s relayed' % (
+            rate, throughput))
+    print('reload: %s transfers done, %s cut' % (
+        result['completed'], result['cut']))
+    if result['cut']:
+        failed = True
+
+    if failed:
+        print('FAILED')
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
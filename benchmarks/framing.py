@@ -0,0 +1,119 @@
+""" Micro-benchmark for the inbound frame parser.
+
+Pushes a stream of mixed-size TRANS_DATA frames through the
+FrameDecoder used by MsgpackReconnectingProtocol and through the
+previous recursive bytes-slicing parser, and reports MB/s for both.
+
+    python -m hpxclient.benchmarks.framing --size 32 --chunk 16384
+"""
+import sys
+import time
+import random
+import struct
+import argparse
+
+import msgpack
+
+from hpxclient import consts
+from hpxclient import protocols
+
+
+FRAME_SIZES = [16, 64, 512, 1400, 4096, 16384, 65536]
+
+
+class LegacyParser(object):
+    """ Parser as it was before the FrameDecoder, kept for comparison. """
+    LENGTH_SIZE = struct.calcsize("<L")
+
+    def __init__(self):
+        self._buff = b''
+        self._content_size = None
+        self.messages = 0
+
+    def process_data(self):
+        if self._content_size is None:
+            if len(self._buff) >= self.LENGTH_SIZE:
+                self._content_size = struct.unpack(
+                    "<L", self._buff[:self.LENGTH_SIZE])[0]
+                self._buff = self._buff[self.LENGTH_SIZE:]
+                return self.process_data()
+
+        if self._content_size is None:
+            return
+
+        if len(self._buff) >= self._content_size:
+            message = self._buff[:self._content_size]
+            msgpack.unpackb(message)
+            self.messages += 1
+
+            self._buff = self._buff[self._content_size:]
+            self._content_size = None
+            return self.process_data()
+
+    def feed(self, data):
+        self._buff += data
+        self.process_data()
+
+
+class DecoderParser(object):
+    def __init__(self):
+        self._decoder = protocols.FrameDecoder()
+        self.messages = 0
+
+    def feed(self, data):
+        self.messages += len(self._decoder.feed(data))
+
+
+def build_stream(total_size, seed=0):
+    rnd = random.Random(seed)
+    frames = []
+    size = 0
+    conn_id = 0
+    while size < total_size:
+        payload = b'x' * rnd.choice(FRAME_SIZES)
+        frame = protocols.encode_msg({
+            'kind': consts.TRANS_DATA_KIND,
+            'data': {'conn_id': conn_id, 'data': payload}
+        })
+        frames.append(frame)
+        size += len(frame)
+        conn_id = (conn_id + 1) % 1024
+    return b''.join(frames), len(frames)
+
+
+def run(parser, stream, chunk_size):
+    view = memoryview(stream)
+    start = time.perf_counter()
+    for pos in range(0, len(stream), chunk_size):
+        parser.feed(bytes(view[pos:pos + chunk_size]))
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=32,
+                        help="Stream size in MB.")
+    parser.add_argument("--chunk", type=int, default=16384,
+                        help="Size of the chunks fed to the parser.")
+    args = parser.parse_args(argv)
+
+    stream, frame_count = build_stream(args.size * 1024 * 1024)
+    mb = len(stream) / (1024 * 1024)
+    print("Stream: %.1f MB, %s frames, %s bytes per read"
+          % (mb, frame_count, args.chunk))
+
+    for name, parser_cls in (("legacy", LegacyParser),
+                             ("decoder", DecoderParser)):
+        parser_proto = parser_cls()
+        try:
+            elapsed = run(parser_proto, stream, args.chunk)
+        except RecursionError:
+            print("%8s: RecursionError" % name)
+            continue
+        assert parser_proto.messages == frame_count
+        print("%8s: %8.1f MB/s %10.0f frames/s"
+              % (name, mb / elapsed, frame_count / elapsed))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
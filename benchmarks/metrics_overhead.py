@@ -0,0 +1,78 @@
+""" Overhead of the metrics instrumentation on the tunnel hot path.
+
+Relays data through a real CentralFetcherProtocol between a stand-in
+fetcher server and an echo upstream, alternating runs with metrics
+enabled and disabled, and compares throughput and CPU per GB.
+
+    python -m hpxclient.benchmarks.metrics_overhead --rounds 3
+"""
+import sys
+import time
+import asyncio
+import argparse
+
+from hpxclient import metrics
+from hpxclient.benchmarks import standin
+
+
+async def run(enabled, args):
+    metrics.ENABLED = enabled
+
+    echo_server, echo_port = await standin.start_echo_server()
+    server = standin.TunnelLoadServer(
+        '127.0.0.1', echo_port, tunnels=args.tunnels,
+        chunk_size=args.chunk, window=args.window)
+    port = await server.start()
+    proto = await standin.connect_fetcher(port)
+
+    await asyncio.sleep(0.5)
+    start_bytes = server.bytes_received
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    await asyncio.sleep(args.duration)
+    relayed = server.bytes_received - start_bytes
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+
+    proto.close()
+    server.close()
+    echo_server.close()
+    await asyncio.sleep(0.1)
+
+    gb = relayed / (1024 ** 3)
+    return relayed / elapsed / (1024 * 1024), cpu / gb
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--tunnels", type=int, default=16)
+    parser.add_argument("--chunk", type=int, default=4096)
+    parser.add_argument("--window", type=int, default=65536)
+    args = parser.parse_args(argv)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    results = {True: [], False: []}
+    for _ in range(args.rounds):
+        for enabled in (False, True):
+            results[enabled].append(loop.run_until_complete(run(enabled, args)))
+    loop.run_until_complete(standin.cancel_pending_tasks(loop))
+    loop.close()
+
+    best = {}
+    for enabled, runs in results.items():
+        best[enabled] = (max(rate for rate, _ in runs),
+                         min(cpu for _, cpu in runs))
+        print("%9s: %8.1f MB/s %8.2f CPU s/GB" % (
+            "metrics" if enabled else "disabled",
+            best[enabled][0], best[enabled][1]))
+
+    overhead = (best[True][1] / best[False][1] - 1) * 100
+    print("CPU overhead: %.1f%%" % overhead)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+""" Control frame latency and tunnel fairness on a congested fetcher link.
+
+Upstreams that send as fast as they can push data through one fetcher
+link to a stand-in server that reads it at `--rate` MB/s, one heavy
+upstream writing big chunks and `--tunnels` light ones writing small
+chunks. While the link is saturated the client pings every 50ms; the
+ping round trip shows how long control frames wait behind the queued
+tunnel data. Socket buffers are kept small so the queueing happens in
+the client, as on a slow network link.
+
+The `fifo` mode approximates the previous behaviour: a 1MB transport
+buffer all frames go through in order.
+
+    python -m hpxclient.benchmarks.priority --rate 20 --duration 5
+"""
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import collections
+
+from hpxclient import consts
+from hpxclient import settings
+from hpxclient.benchmarks import standin
+
+
+SOCKET_BUFFER_SIZE = 64 * 1024
+
+MODES = {
+    'fifo': {
+        'FETCHER_WRITE_BUFFER_HIGH': 1024 * 1024,
+        'FETCHER_WRITE_BUFFER_LOW': 256 * 1024,
+        'FETCHER_BULK_QUEUE_HIGH': 1,
+        'FETCHER_BULK_QUEUE_LOW': 0,
+    },
+    'priority': {},
+}
+
+
+def set_buffer_size(sock, option):
+    sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER_SIZE)
+
+
+class SourceProtocol(asyncio.Protocol):
+    """ Upstream writing `chunk_size` chunks as fast as it can. """
+
+    def __init__(self, chunk_size):
+        self.chunk = b'x' * chunk_size
+        self.paused = False
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.fill()
+
+    def fill(self):
+        while not self.paused and not self.transport.is_closing():
+            self.transport.write(self.chunk)
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        self.fill()
+
+
+class ThrottledLinkProtocol(standin.StandinLinkProtocol):
+    """ Reads the link at the server rate. """
+
+    def data_received(self, data):
+        super().data_received(data)
+        self.transport.pause_reading()
+        asyncio.get_event_loop().call_later(
+            len(data) / self.server.rate, self.resume)
+
+    def resume(self):
+        if not self.transport.is_closing():
+            self.transport.resume_reading()
+
+
+class ThrottledServer(standin.StandinServer):
+    link_class = ThrottledLinkProtocol
+
+    def __init__(self, rate, heavy_port, light_port, tunnels, **kwargs):
+        super().__init__(**kwargs)
+        self.rate = rate
+        self.heavy_port = heavy_port
+        self.light_port = light_port
+        self.tunnels = tunnels
+        self.received = collections.Counter()
+
+    def on_auth(self, link):
+        link.send(consts.INIT_CONN_KIND, {
+            'conn_id': 0, 'url': '127.0.0.1', 'port': self.heavy_port})
+        for conn_id in range(1, self.tunnels + 1):
+            link.send(consts.INIT_CONN_KIND, {
+                'conn_id': conn_id, 'url': '127.0.0.1',
+                'port': self.light_port})
+
+    def on_data(self, link, conn_id, data):
+        self.received[conn_id] += len(data)
+
+
+class PingingFetcherProtocol(standin.BenchFetcherProtocol):
+    """ Keeps the round trip time of every ping. """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rtts = []
+
+    def connection_made(self, transport):
+        set_buffer_size(transport.get_extra_info('socket'), socket.SO_SNDBUF)
+        super().connection_made(transport)
+
+    def pong_received(self):
+        if self._pings:
+            self.rtts.append(time.monotonic() - self._pings[0])
+        super().pong_received()
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(mode, rate, tunnels, duration):
+    defaults = {}
+    for name, value in MODES[mode].items():
+        defaults[name] = getattr(settings, name)
+        setattr(settings, name, value)
+    settings.PING_INTERVAL = 0.05
+
+    loop = asyncio.get_event_loop()
+    heavy = await loop.create_server(
+        lambda: SourceProtocol(256 * 1024), '127.0.0.1', 0)
+    light = await loop.create_server(
+        lambda: SourceProtocol(4 * 1024), '127.0.0.1', 0)
+    server = ThrottledServer(
+        rate * 1024 * 1024,
+        heavy.sockets[0].getsockname()[1],
+        light.sockets[0].getsockname()[1],
+        tunnels)
+    port = await server.start()
+    # Inherited by the accepted links, changing it later can stall them.
+    set_buffer_size(server.server.sockets[0], socket.SO_RCVBUF)
+
+    link = await standin.connect_fetcher(
+        port, protocol_cls=PingingFetcherProtocol)
+    await asyncio.sleep(1)
+    link.rtts = []
+    server.received.clear()
+    await asyncio.sleep(duration)
+
+    rtts = link.rtts
+    received = dict(server.received)
+    link.close()
+    server.close()
+    heavy.close()
+    light.close()
+    for name, value in defaults.items():
+        setattr(settings, name, value)
+
+    light_received = [received.get(conn_id, 0)
+                      for conn_id in range(1, tunnels + 1)]
+    return {
+        'mode': mode,
+        'throughput_mb_s': sum(received.values()) / duration / (1024 * 1024),
+        'ping_p50_ms': percentile(rtts, 0.5) * 1000,
+        'ping_p99_ms': percentile(rtts, 0.99) * 1000,
+        'heavy_share': received.get(0, 0) / (sum(received.values()) or 1),
+        'light_min_max': (min(light_received) / (max(light_received) or 1)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=20,
+                        help="MB/s the server reads the link at.")
+    parser.add_argument("--tunnels", type=int, default=8,
+                        help="Light tunnels next to the heavy one.")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--mode", choices=sorted(MODES), action='append')
+    args = parser.parse_args(argv)
+
+    print("%9s %8s %10s %10s %12s %14s" % (
+        "mode", "MB/s", "ping p50", "ping p99", "heavy share",
+        "light min/max"))
+    for mode in args.mode or ['fifo', 'priority']:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        result = loop.run_until_complete(
+            run(mode, args.rate, args.tunnels, args.duration))
+        loop.run_until_complete(standin.cancel_pending_tasks(loop))
+        loop.close()
+        print("%9s %8.1f %8.1fms %8.1fms %12.2f %14.2f" % (
+            result['mode'], result['throughput_mb_s'],
+            result['ping_p50_ms'], result['ping_p99_ms'],
+            result['heavy_share'], result['light_min_max']))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
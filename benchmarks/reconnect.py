@@ -0,0 +1,164 @@
+""" Link drop scenario.
+
+Runs tunnels through a real, reconnecting CentralFetcherProtocol against
+a stand-in fetcher server that aborts the link every `--drop-every`
+seconds, and checks that the tunnels survive the drops through session
+resume with their echoed byte streams intact. Reports the reconnect
+downtimes and the tunnels lost. Fails when a tunnel is lost or gets
+corrupted data while resume is enabled.
+
+    python -m hpxclient.benchmarks.reconnect --drops 20
+    python -m hpxclient.benchmarks.reconnect --no-resume
+    python -m hpxclient.benchmarks.reconnect --compression
+"""
+import sys
+import time
+import asyncio
+import argparse
+
+from hpxclient import settings
+from hpxclient.benchmarks import standin
+from hpxclient.fetcher.central import service as fetcher_central_service
+
+
+PATTERN_SIZE = 251
+
+
+def pattern(offset, size, _cache={}):
+    """ Bytes [offset, offset + size) of the stream sent on every tunnel. """
+    block = _cache.get(size)
+    if block is None:
+        block = _cache[size] = bytes(
+            i % PATTERN_SIZE for i in range(size + PATTERN_SIZE))
+    start = offset % PATTERN_SIZE
+    return block[start:start + size]
+
+
+class DroppingServer(standin.TunnelLoadServer):
+    """ Checks the echoed streams and aborts the links on request. """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.corrupted = 0
+        self.lost = 0
+        self.dropped_at = None
+        self.downtimes = []
+
+    def fill_window(self, tunnel):
+        chunk_size = self.chunk_size
+        while tunnel.sent - tunnel.received + chunk_size <= self.window:
+            tunnel.link.send_data(tunnel.conn_id,
+                                  pattern(tunnel.sent, chunk_size))
+            tunnel.sent += chunk_size
+            self.bytes_sent += chunk_size
+
+    def on_data(self, link, conn_id, data):
+        tunnel = self.tunnels.get(conn_id)
+        if tunnel is None:
+            return
+        if self.dropped_at is not None:
+            self.downtimes.append(time.perf_counter() - self.dropped_at)
+            self.dropped_at = None
+
+        if data != pattern(tunnel.received, len(data)):
+            self.corrupted += 1
+        self.bytes_received += len(data)
+        tunnel.received += len(data)
+        self.fill_window(tunnel)
+
+    def on_auth(self, link):
+        # Tunnels of a session that was not resumed are gone.
+        for tunnel in list(self.tunnels.values()):
+            if tunnel.link not in self.links:
+                del self.tunnels[tunnel.conn_id]
+                self.lost += 1
+        super().on_auth(link)
+
+    def on_close(self, link, conn_id):
+        if conn_id in self.tunnels:
+            self.lost += 1
+        super().on_close(link, conn_id)
+
+    def drop(self):
+        for link in list(self.links):
+            link.transport.abort()
+        self.dropped_at = time.perf_counter()
+
+
+async def run(tunnels, chunk, window, drops, drop_every, resume,
+              stable_time, compression):
+    settings.SESSION_RESUME = resume
+    settings.COMPRESSION = 'zlib' if compression else None
+    # The links are dropped on purpose, don't let them look unstable.
+    settings.RECONNECT_STABLE_TIME = stable_time
+
+    upstream_server, upstream_port = await standin.start_echo_server()
+    server = DroppingServer('127.0.0.1', upstream_port, tunnels=tunnels,
+                            chunk_size=chunk, window=window, resume=True,
+                            compression=compression)
+    port = await server.start()
+
+    await fetcher_central_service.CentralFetcherProtocol.create_conn(
+        fetcher_central_service.get_protocol_factory(
+            public_key='benchmark', secret_key='benchmark'),
+        '127.0.0.1', port)
+
+    for i in range(drops):
+        await asyncio.sleep(drop_every)
+        server.drop()
+    await asyncio.sleep(drop_every)
+    deadline = time.perf_counter() + float(settings.RECONNECT_MAX_DELAY)
+    while server.dropped_at is not None and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+
+    server.close()
+    upstream_server.close()
+    return server
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tunnels", type=int, default=16)
+    parser.add_argument("--chunk", type=int, default=16384)
+    parser.add_argument("--window", type=int, default=131072)
+    parser.add_argument("--drops", type=int, default=10)
+    parser.add_argument("--drop-every", type=float, default=1)
+    parser.add_argument("--stable-time", type=float, default=0.5,
+                        help="RECONNECT_STABLE_TIME used by the client.")
+    parser.add_argument("--no-resume", action='store_true')
+    parser.add_argument("--compression", action='store_true',
+                        help="Compress the tunnel data on the link.")
+    args = parser.parse_args(argv)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(run(
+        args.tunnels, args.chunk, args.window, args.drops, args.drop_every,
+        not args.no_resume, args.stable_time, args.compression))
+    # Closing the server makes the client schedule one more reconnect.
+    loop.run_until_complete(asyncio.sleep(0.1))
+    loop.run_until_complete(standin.cancel_pending_tasks(loop))
+    loop.close()
+
+    print('drops: %s, resumed: %s' % (args.drops, server.resumed))
+    print('downtime p50: %.3fs, max: %.3fs' % (
+        percentile(server.downtimes, 0.5), max(server.downtimes or [0])))
+    print('relayed: %.1f MB, tunnels lost: %s, corrupted chunks: %s' % (
+        server.bytes_received / (1024 * 1024), server.lost,
+        server.corrupted))
+
+    if server.corrupted or (not args.no_resume and server.lost):
+        print('FAILED')
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+""" Bandwidth shaping accuracy and overhead.
+
+Runs echo tunnels through a fetcher link against a stand-in server
+with the given rate limits in MB/s (0 for no limit) and reports the
+echoed throughput, the time the limits throttled the traffic and the
+client CPU per GB. The stand-in server runs in the same process, its
+CPU is included. With echo tunnels the same bytes go both ways, a
+`total` limit allows half of it per direction.
+
+    python -m hpxclient.benchmarks.shaping --scope upload --limits 0,5,50
+    python -m hpxclient.benchmarks.shaping --scope tunnel --limits 1
+"""
+import sys
+import time
+import asyncio
+import argparse
+
+from hpxclient import settings
+from hpxclient import shaping
+from hpxclient.benchmarks import standin
+
+
+SCOPES = {
+    'total': 'RATE_LIMIT',
+    'upload': 'RATE_LIMIT_UPLOAD',
+    'download': 'RATE_LIMIT_DOWNLOAD',
+    'tunnel': 'RATE_LIMIT_TUNNEL',
+}
+
+
+async def run(scope, limit, tunnels, chunk, window, duration):
+    for name in SCOPES.values():
+        setattr(settings, name, None)
+    if limit:
+        setattr(settings, SCOPES[scope], limit * 1024 * 1024)
+    shaping.SHAPER = None
+
+    upstream_server, upstream_port = await standin.start_echo_server()
+    server = standin.TunnelLoadServer(
+        '127.0.0.1', upstream_port, tunnels=tunnels, chunk_size=chunk,
+        window=window)
+    port = await server.start()
+    link = await standin.connect_fetcher(port)
+
+    # Let the bursts go through first.
+    await asyncio.sleep(0.5)
+    received = server.bytes_received
+    throttled = sum(shaping.get_shaper().get_stats().get(
+        'rate_%s_throttled_seconds' % name, 0)
+        for name in ('total', 'upload', 'download'))
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    await asyncio.sleep(duration)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    received = server.bytes_received - received
+
+    stats = shaping.get_shaper().get_stats()
+    throttled = sum(stats.get('rate_%s_throttled_seconds' % name, 0)
+                    for name in ('total', 'upload', 'download')) - throttled
+    limited = link.get_flow_stats()['processors_rate_limited']
+
+    link.close()
+    server.close()
+    upstream_server.close()
+
+    return {
+        'scope': scope,
+        'limit': limit,
+        'throughput_mb_s': received / elapsed / (1024 * 1024),
+        'throttled': throttled / elapsed,
+        'tunnels_limited': limited,
+        'cpu_s_per_gb': cpu / (received or 1) * 1024 ** 3,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scope", choices=sorted(SCOPES), default='upload')
+    parser.add_argument("--limits", default='0,1,10,100',
+                        help="Comma separated limits in MB/s, 0 for none.")
+    parser.add_argument("--tunnels", type=int, default=8)
+    parser.add_argument("--chunk", type=int, default=16384)
+    parser.add_argument("--window", type=int, default=262144)
+    parser.add_argument("--duration", type=float, default=3)
+    args = parser.parse_args(argv)
+
+    print("%9s %8s %8s %10s %8s %10s" % (
+        "scope", "limit", "MB/s", "throttled", "limited", "CPU s/GB"))
+    for limit in args.limits.split(','):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        result = loop.run_until_complete(run(
+            args.scope, float(limit), args.tunnels, args.chunk, args.window,
+            args.duration))
+        loop.run_until_complete(standin.cancel_pending_tasks(loop))
+        loop.close()
+        print("%9s %8s %8.2f %9.0f%% %8s %10.2f" % (
+            result['scope'], result['limit'] or '-',
+            result['throughput_mb_s'], result['throttled'] * 100,
+            result['tunnels_limited'], result['cpu_s_per_gb']))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
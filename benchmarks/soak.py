@@ -0,0 +1,152 @@
+""" Memory soak test of the tunnel lifecycle.
+
+Opens and closes tunnels through a real CentralFetcherProtocol as fast
+as possible, half of them closed by the server (CLOSE_CONN) and half
+by the upstream, and tracks the traced Python memory with tracemalloc.
+Fails when memory keeps growing after the warmup.
+
+    python -m hpxclient.benchmarks.soak --cycles 1000000
+"""
+import sys
+import time
+import asyncio
+import argparse
+import tracemalloc
+
+from hpxclient import consts
+from hpxclient.benchmarks import standin
+
+
+class ClosingEchoProtocol(asyncio.Protocol):
+    """ Echoes the data and closes the connection when asked to. """
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.transport.write(data)
+        if data.startswith(b'close'):
+            self.transport.close()
+
+
+class SoakServer(standin.StandinServer):
+    def __init__(self, upstream_port, concurrency, cycles, **kwargs):
+        super().__init__(**kwargs)
+        self.upstream_port = upstream_port
+        self.concurrency = concurrency
+        self.cycles = cycles
+        self.completed = 0
+        self.open_tunnels = {}
+        self.done = asyncio.Future()
+        self._next_conn_id = 1
+
+    def open_tunnel(self, link):
+        if self._next_conn_id > self.cycles:
+            if not self.open_tunnels and not self.done.done():
+                self.done.set_result(None)
+            return
+
+        conn_id = self._next_conn_id
+        self._next_conn_id += 1
+        upstream_closes = conn_id % 2 == 0
+        self.open_tunnels[conn_id] = upstream_closes
+
+        link.send(consts.INIT_CONN_KIND, {
+            'conn_id': conn_id, 'url': '127.0.0.1',
+            'port': self.upstream_port})
+        link.send_data(conn_id, b'close' if upstream_closes else b'echo')
+
+    def tunnel_done(self, link, conn_id):
+        if self.open_tunnels.pop(conn_id, None) is None:
+            return
+        self.completed += 1
+        self.open_tunnel(link)
+
+    def on_auth(self, link):
+        for i in range(self.concurrency):
+            self.open_tunnel(link)
+
+    def on_data(self, link, conn_id, data):
+        upstream_closes = self.open_tunnels.get(conn_id)
+        if upstream_closes is None or upstream_closes:
+            # Wait for the CLOSE_CONN of the client.
+            return
+        link.send(consts.CLOSE_CONN_KIND, {'conn_id': conn_id})
+        self.tunnel_done(link, conn_id)
+
+    def on_close(self, link, conn_id):
+        self.tunnel_done(link, conn_id)
+
+
+async def soak(args):
+    loop = asyncio.get_event_loop()
+    upstream = await loop.create_server(ClosingEchoProtocol, '127.0.0.1', 0)
+    upstream_port = upstream.sockets[0].getsockname()[1]
+
+    server = SoakServer(upstream_port, args.concurrency, args.cycles)
+    port = await server.start()
+    proto = await standin.connect_fetcher(port)
+
+    samples = []
+    start = time.perf_counter()
+    next_sample = args.interval
+    while not server.done.done():
+        await asyncio.sleep(0.5)
+        if server.completed < next_sample:
+            continue
+        next_sample += args.interval
+
+        current, peak = tracemalloc.get_traced_memory()
+        samples.append((server.completed, current))
+        print("%10s cycles %8.0f cycles/s %10.1f KB traced %6s tunnels" % (
+            server.completed,
+            server.completed / (time.perf_counter() - start),
+            current / 1024, len(proto.processors)))
+
+    # Let the last closes propagate.
+    await asyncio.sleep(0.5)
+    leftover = len(proto.processors)
+    proto.close()
+    server.close()
+    upstream.close()
+    return samples, leftover
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cycles", type=int, default=1000000)
+    parser.add_argument("--concurrency", type=int, default=64,
+                        help="Tunnels open at the same time.")
+    parser.add_argument("--interval", type=int, default=50000,
+                        help="Cycles between memory samples.")
+    parser.add_argument("--max-growth", type=int, default=512,
+                        help="KB of growth allowed after the first sample.")
+    args = parser.parse_args(argv)
+
+    tracemalloc.start()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    samples, leftover = loop.run_until_complete(soak(args))
+    loop.run_until_complete(standin.cancel_pending_tasks(loop))
+    loop.close()
+
+    if leftover:
+        print("FAIL: %s processors left registered" % leftover)
+        return 1
+
+    if len(samples) < 2:
+        print("Not enough samples, increase --cycles")
+        return 0
+
+    # The first sample is the warmup baseline.
+    growth = (samples[-1][1] - samples[0][1]) / 1024
+    print("Memory growth after warmup: %.1f KB" % growth)
+    if growth > args.max_growth:
+        print("FAIL: memory grew more than %s KB" % args.max_growth)
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,450 @@
+""" Local stand-ins for the hprox servers, used by the benchmarks.
+
+StandinServer speaks the length-prefixed msgpack link protocol of the
+fetcher and manager servers: it answers authentication and pings and
+hands the rest of the messages to overridable hooks. With `resume` set
+it also keeps resumable sessions, and with `compression` set it accepts
+compressed tunnel data and compresses what it sends, like the fetcher
+server does.
+TunnelLoadServer drives tunnels through the connected clients against
+a local upstream.
+"""
+import time
+import zlib
+import asyncio
+import itertools
+import collections
+
+from hpxclient import consts
+from hpxclient import protocols
+from hpxclient.fetcher.central import compression as fetcher_central_compression
+from hpxclient.fetcher.central import service as fetcher_central_service
+from hpxclient.fetcher.central import session as fetcher_central_session
+
+
+class StandinLinkProtocol(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.protocol_version = 1
+        self.session_id = None
+        self.session = None
+        # Compression state of the tunnels, by conn_id.
+        self.compression = None
+        self.compressors = {}
+        self.decompressors = {}
+        self._decoder = protocols.FrameDecoder()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.links.append(self)
+
+    def connection_lost(self, exc):
+        self.server.links.remove(self)
+        self.server.on_link_lost(self)
+
+    def data_received(self, data):
+        self.server.wire_bytes_received += len(data)
+        for message in self._decoder.feed(data):
+            self.server.message_received(self, message)
+
+    def send(self, kind, data):
+        session = self.session
+        if self.transport.is_closing() and session is None:
+            return
+        frame = protocols.encode_msg({'kind': kind, 'data': data})
+        if (session is not None
+                and kind.encode() in fetcher_central_session.SESSION_KINDS):
+            # Kept for the replay while the link is down.
+            session.record((frame,))
+        if not self.transport.is_closing():
+            self.transport.write(frame)
+
+    def send_data(self, conn_id, data):
+        if self.transport.is_closing() and self.session is None:
+            return
+        if self.protocol_version < 2:
+            self.send(consts.TRANS_DATA_KIND, {'conn_id': conn_id,
+                                               'data': data})
+            return
+        kind = consts.BINARY_TRANS_DATA_KIND
+        if self.compression is not None:
+            compressor = self.compressors.get(conn_id)
+            if compressor is None:
+                compressor = self.compressors[conn_id] = (
+                    fetcher_central_compression.TunnelCompressor(
+                        self.server.compression_level, min_size=256,
+                        min_ratio=0.9, skip_size=1024 * 1024))
+            if compressor.wants(len(data)):
+                size = len(data)
+                data, _ = compressor.compress(data)
+                compressor.sampled(size, len(data))
+                kind = consts.BINARY_COMPRESSED_TRANS_DATA_KIND
+        header = protocols.encode_binary_trans_data_header(
+            conn_id, len(data), kind=kind)
+        parts = (protocols.LENGTH_STRUCT.pack(len(header) + len(data)),
+                 header, data)
+        if self.session is not None:
+            self.session.record(parts)
+        if not self.transport.is_closing():
+            self.transport.writelines(parts)
+
+
+class StandinServer(object):
+    link_class = StandinLinkProtocol
+
+    def __init__(self, protocol_version=consts.PROTOCOL_VERSION,
+                 resume=False, ack_frames=32, compression=False,
+                 compression_level=1):
+        self.protocol_version = protocol_version
+        self.resume = resume
+        self.compression = compression
+        self.compression_level = compression_level
+        self.ack_frames = ack_frames
+        self.sessions = {}
+        self.resumed = 0
+        self.wire_bytes_received = 0
+        self.links = []
+        self.server = None
+        self.port = None
+        self._session_ids = itertools.count(1)
+
+    async def start(self, host='127.0.0.1', port=0, ssl=None):
+        loop = asyncio.get_event_loop()
+        self.server = await loop.create_server(
+            lambda: self.link_class(self), host, port, ssl=ssl)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    def close(self):
+        self.server.close()
+        for link in list(self.links):
+            link.transport.close()
+
+    def message_received(self, link, message):
+        kind = message[b'kind'].decode()
+        data = message[b'data']
+
+        if kind == consts.AUTH_KIND:
+            self.on_auth_request(link, data)
+        elif kind == consts.PING_KIND:
+            link.send(consts.PONG_KIND, None)
+        elif kind == consts.ACK_KIND:
+            if link.session is not None:
+                link.session.ack(data[b'received'])
+        elif kind == consts.TRANS_DATA_KIND:
+            self.session_message_received(link)
+            conn_id = data[b'conn_id']
+            payload = data[b'data']
+            if data.get(b'compressed'):
+                decompressor = link.decompressors.get(conn_id)
+                if decompressor is None:
+                    decompressor = link.decompressors[conn_id] = (
+                        zlib.decompressobj())
+                payload = decompressor.decompress(payload)
+            self.on_data(link, conn_id, payload)
+        elif kind == consts.CLOSE_CONN_KIND:
+            self.session_message_received(link)
+            link.compressors.pop(data[b'conn_id'], None)
+            link.decompressors.pop(data[b'conn_id'], None)
+            self.on_close(link, data[b'conn_id'])
+
+    def session_message_received(self, link):
+        session = link.session
+        if session is None:
+            return
+        session.received += 1
+        if session.received - session.received_acked >= self.ack_frames:
+            session.received_acked = session.received
+            link.send(consts.ACK_KIND, {'received': session.received})
+
+    def on_auth_request(self, link, data):
+        link.protocol_version = min(data.get(b'protocol_version', 1),
+                                    self.protocol_version)
+        resume = self.resume and data.get(b'resume')
+
+        session_id = data.get(b'session_id')
+        session = None
+        if resume and session_id is not None:
+            session = self.sessions.get(session_id.decode())
+        if session is not None:
+            self.resume_session(link, session, data[b'received'])
+            return
+
+        offered = data.get(b'compression') or []
+        if (self.compression and b'zlib' in offered
+                and link.protocol_version >= 2):
+            link.compression = 'zlib'
+
+        link.session_id = 'session-%s' % next(self._session_ids)
+        if resume:
+            link.session = fetcher_central_session.Session(link.session_id,
+                                                           float('inf'))
+            link.session.link = link
+            self.sessions[link.session_id] = link.session
+        link.send(consts.AUTH_KIND, {
+            'error': None,
+            'user_id': 1,
+            'session_id': link.session_id,
+            'public_key': data.get(b'public_key'),
+            'protocol_version': link.protocol_version,
+            'resume': bool(resume),
+            'compression': link.compression,
+        })
+        self.on_auth(link)
+
+    def resume_session(self, link, session, received):
+        previous = session.link
+        if previous.transport is not None and not previous.transport.is_closing():
+            previous.transport.abort()
+        previous.session = None
+
+        link.session_id = session.session_id
+        link.session = session
+        session.link = link
+        link.compression = previous.compression
+        link.compressors = previous.compressors
+        link.decompressors = previous.decompressors
+        link.send(consts.AUTH_KIND, {
+            'error': None,
+            'user_id': 1,
+            'session_id': link.session_id,
+            'public_key': None,
+            'protocol_version': link.protocol_version,
+            'resume': True,
+            'resumed': True,
+            'received': session.received,
+        })
+        session.ack(received)
+        for parts in session.unacked_frames():
+            link.transport.writelines(parts)
+        self.resumed += 1
+        self.on_resume(link, previous)
+
+    def on_auth(self, link):
+        pass
+
+    def on_resume(self, link, previous):
+        pass
+
+    def on_data(self, link, conn_id, data):
+        pass
+
+    def on_close(self, link, conn_id):
+        pass
+
+    def on_link_lost(self, link):
+        pass
+
+
+class EchoProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.transport.write(data)
+
+
+async def start_echo_server(host='127.0.0.1', port=0):
+    loop = asyncio.get_event_loop()
+    server = await loop.create_server(EchoProtocol, host, port)
+    return server, server.sockets[0].getsockname()[1]
+
+
+class SinkProtocol(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+
+    def data_received(self, data):
+        self.server.received(len(data))
+
+
+class SinkServer(object):
+    """ Upstream that reads and discards everything. """
+
+    def __init__(self):
+        self.bytes_received = 0
+        self.on_received = None
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        loop = asyncio.get_event_loop()
+        self.server = await loop.create_server(lambda: SinkProtocol(self),
+                                               host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    def received(self, size):
+        self.bytes_received += size
+        if self.on_received:
+            self.on_received(size)
+
+    def close(self):
+        self.server.close()
+
+
+class LoadTunnel(object):
+    def __init__(self, link, conn_id):
+        self.link = link
+        self.conn_id = conn_id
+        self.sent = 0
+        self.received = 0
+        self.payload_offset = 0
+        # (end offset, send time) of the chunks not echoed back yet.
+        self.pending = collections.deque()
+
+
+class TunnelLoadServer(StandinServer):
+    """ Opens `tunnels` tunnels on every authenticated link to the given
+    upstream and keeps `window` bytes in flight on each of them.
+
+    With an echo upstream the bytes coming back are counted and the
+    round trip of every chunk is recorded in `latencies`. With a sink
+    upstream, call sink_received() with the bytes the sink consumed.
+    `churn_rate` tunnels per second are closed and replaced. The tunnels
+    send `payload` over and over in `chunk_size` chunks, or b'x' chunks.
+    """
+
+    def __init__(self, upstream_host, upstream_port, tunnels=8,
+                 chunk_size=16384, window=262144, churn_rate=0,
+                 payload=None, **kwargs):
+        super().__init__(**kwargs)
+        self.upstream_host = upstream_host
+        self.upstream_port = upstream_port
+        self.tunnels_per_link = tunnels
+        self.payload = payload if payload is not None else b'x' * chunk_size
+        self.chunk_size = min(chunk_size, len(self.payload))
+        self.window = window
+        self.churn_rate = churn_rate
+
+        self.tunnels = collections.OrderedDict()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latencies = []
+        self.opened = 0
+        self.closed = 0
+        self._conn_ids = itertools.count(1)
+        self._churn_task = None
+
+    def open_tunnel(self, link):
+        conn_id = next(self._conn_ids)
+        link.send(consts.INIT_CONN_KIND, {
+            'conn_id': conn_id,
+            'url': self.upstream_host,
+            'port': self.upstream_port,
+        })
+        tunnel = self.tunnels[conn_id] = LoadTunnel(link, conn_id)
+        self.opened += 1
+        self.fill_window(tunnel)
+        return tunnel
+
+    def close_tunnel(self, tunnel):
+        del self.tunnels[tunnel.conn_id]
+        tunnel.link.send(consts.CLOSE_CONN_KIND, {'conn_id': tunnel.conn_id})
+        self.closed += 1
+
+    def next_chunk(self, tunnel):
+        payload = self.payload
+        if len(payload) == self.chunk_size:
+            return payload
+        start = tunnel.payload_offset
+        end = start + self.chunk_size
+        if end > len(payload):
+            start, end = 0, self.chunk_size
+        tunnel.payload_offset = end
+        return payload[start:end]
+
+    def fill_window(self, tunnel):
+        chunk_size = self.chunk_size
+        now = time.perf_counter()
+        while tunnel.sent - tunnel.received + chunk_size <= self.window:
+            tunnel.link.send_data(tunnel.conn_id, self.next_chunk(tunnel))
+            tunnel.sent += chunk_size
+            tunnel.pending.append((tunnel.sent, now))
+            self.bytes_sent += chunk_size
+
+    def on_auth(self, link):
+        for i in range(self.tunnels_per_link):
+            self.open_tunnel(link)
+        if self.churn_rate and self._churn_task is None:
+            self._churn_task = asyncio.ensure_future(self.churn())
+
+    def on_resume(self, link, previous):
+        for tunnel in self.tunnels.values():
+            if tunnel.link is previous:
+                tunnel.link = link
+
+    def on_data(self, link, conn_id, data):
+        tunnel = self.tunnels.get(conn_id)
+        if tunnel is None:
+            return
+
+        self.bytes_received += len(data)
+        tunnel.received += len(data)
+        now = time.perf_counter()
+        while tunnel.pending and tunnel.pending[0][0] <= tunnel.received:
+            self.latencies.append(now - tunnel.pending.popleft()[1])
+        self.fill_window(tunnel)
+
+    def sink_received(self, size):
+        """ Sink upstreams send nothing back: acknowledge the consumed
+        bytes across all the tunnels in order.
+        """
+        self.bytes_received += size
+        for tunnel in list(self.tunnels.values()):
+            if not size:
+                break
+            acked = min(size, tunnel.sent - tunnel.received)
+            tunnel.received += acked
+            size -= acked
+            self.fill_window(tunnel)
+
+    def on_close(self, link, conn_id):
+        tunnel = self.tunnels.pop(conn_id, None)
+        if tunnel is None:
+            return
+        self.closed += 1
+        if link in self.links:
+            self.open_tunnel(link)
+
+    async def churn(self):
+        while True:
+            await asyncio.sleep(1 / self.churn_rate)
+            if not self.tunnels:
+                continue
+            tunnel = next(iter(self.tunnels.values()))
+            self.close_tunnel(tunnel)
+            if tunnel.link in self.links:
+                self.open_tunnel(tunnel.link)
+
+    def close(self):
+        if self._churn_task:
+            self._churn_task.cancel()
+        super().close()
+
+
+class BenchFetcherProtocol(fetcher_central_service.CentralFetcherProtocol):
+    """ Fetcher link that tears down its tunnels but doesn't reconnect
+    when it is lost.
+    """
+
+    def connection_lost(self, exc):
+        self.processors.close_all()
+        self.close()
+
+
+async def connect_fetcher(port, host='127.0.0.1', ssl=None,
+                          protocol_cls=BenchFetcherProtocol, config=None):
+    loop = asyncio.get_event_loop()
+    _, protocol = await loop.create_connection(
+        lambda: protocol_cls(None, None, 'benchmark', 'benchmark',
+                             config=config),
+        host, port, ssl=ssl)
+    return protocol
+
+
+async def cancel_pending_tasks(loop):
+    pending = [task for task in asyncio.all_tasks(loop)
+               if task is not asyncio.current_task(loop)]
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
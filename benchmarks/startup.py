@@ -0,0 +1,139 @@
+""" Client startup time.
+
+Reports the time to import the daemon module, and the time from
+starting the daemon to its first fetcher link authentication against
+a stand-in server. The servers are addressed by `--domain`, resolved by
+the client. The first start is cold, the next ones find the addresses
+in the last known good cache of a throwaway HPROX_DIR.
+
+    python -m hpxclient.benchmarks.startup --runs 5 --domain localhost
+"""
+import os
+import sys
+import time
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+from hpxclient.benchmarks import standin
+
+
+CONFIG_TEMPLATE = """[hprox]
+domain = %(domain)s
+proxy_fetcher_server_port = %(fetcher_port)s
+proxy_mng_server_port = %(mng_port)s
+proxy_ssl_enabled = False
+"""
+
+
+class TimingServer(standin.StandinServer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.authenticated = None
+
+    def on_auth_request(self, link, data):
+        if self.authenticated is None:
+            self.authenticated = time.perf_counter()
+        super().on_auth_request(link, data)
+
+
+def get_env(home):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    env['HOME'] = home
+    env['HPROX_SECRET_KEY'] = 'benchmark'
+    return env
+
+
+def time_import(home, runs):
+    """ Median seconds to import the daemon, interpreter start excluded. """
+    def median_run(code):
+        durations = []
+        for i in range(runs):
+            start = time.perf_counter()
+            subprocess.check_call([sys.executable, '-c', code],
+                                  env=get_env(home))
+            durations.append(time.perf_counter() - start)
+        return sorted(durations)[len(durations) // 2]
+
+    return median_run('import hpxclient.daemon') - median_run('pass')
+
+
+async def time_start(home, config_path, fetcher_server, timeout):
+    fetcher_server.authenticated = None
+    start = time.perf_counter()
+    daemon = subprocess.Popen(
+        [sys.executable, '-m', 'hpxclient.daemon', '-c', config_path,
+         '-pk', 'benchmark'],
+        env=get_env(home), stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    try:
+        deadline = start + timeout
+        while (fetcher_server.authenticated is None
+               and time.perf_counter() < deadline):
+            await asyncio.sleep(0.001)
+    finally:
+        daemon.send_signal(signal.SIGTERM)
+        while daemon.poll() is None:
+            await asyncio.sleep(0.05)
+
+    if fetcher_server.authenticated is None:
+        return None
+    return fetcher_server.authenticated - start
+
+
+async def run(domain, runs, timeout):
+    fetcher_server = TimingServer()
+    fetcher_port = await fetcher_server.start()
+    mng_server = standin.StandinServer()
+    mng_port = await mng_server.start()
+
+    results = []
+    with tempfile.TemporaryDirectory() as home:
+        config_path = os.path.join(home, 'hprox.cfg')
+        with open(config_path, 'w') as config:
+            config.write(CONFIG_TEMPLATE % {
+                'domain': domain,
+                'fetcher_port': fetcher_port,
+                'mng_port': mng_port})
+
+        import_time = time_import(home, runs)
+        for i in range(runs):
+            results.append(await time_start(
+                home, config_path, fetcher_server, timeout))
+
+    fetcher_server.close()
+    mng_server.close()
+    return import_time, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--domain", default='localhost')
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args(argv)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    import_time, results = loop.run_until_complete(
+        run(args.domain, args.runs, args.timeout))
+    loop.run_until_complete(standin.cancel_pending_tasks(loop))
+    loop.close()
+
+    print('import: %.1fms' % (import_time * 1000))
+    for i, result in enumerate(results):
+        print('start %s (%s): %s' % (
+            i + 1, 'cold' if i == 0 else 'cached',
+            '%.1fms' % (result * 1000) if result is not None
+            else 'no link in %ss' % args.timeout))
+    if None in results:
+        print('FAILED')
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+""" End-to-end benchmark of the tunnel path.
+
+Starts a stand-in fetcher/manager server speaking the link protocol
+and a local echo or sink upstream, runs the real daemon against them
+in a subprocess and reports throughput, chunk round-trip latency,
+client CPU per GB, client peak RSS and the buffers the client allocated
+for the tunnel data per MB relayed, read from its metrics. Results are
+appended to a JSON file so that runs can be compared.
+
+    python -m hpxclient.benchmarks.suite --tunnels 8,64 --chunk 16384 \\
+        --churn 10 --loop asyncio,uvloop --io default,buffered \\
+        --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import argparse
+import platform
+import itertools
+import resource
+import tempfile
+import subprocess
+
+from hpxclient.benchmarks import standin
+
+
+CONFIG_TEMPLATE = """[hprox]
+proxy_fetcher_server_ip = 127.0.0.1
+proxy_fetcher_server_port = %(fetcher_port)s
+proxy_mng_server_ip = 127.0.0.1
+proxy_mng_server_port = %(mng_port)s
+proxy_ssl_enabled = False
+worker_stats_interval = 1
+metrics_port = %(metrics_port)s
+"""
+
+IO_CONFIG = {
+    'default': '',
+    'buffered': 'buffered_io = True\n',
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def fetch_allocations(metrics_port, workers):
+    """ Buffer allocations of all the daemon workers, by kind. """
+    allocations = {}
+    for port in range(metrics_port, metrics_port + workers):
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        except OSError:
+            continue
+        writer.write(b'GET /metrics HTTP/1.0\r\n\r\n')
+        body = (await reader.read()).decode()
+        writer.close()
+        for line in body.splitlines():
+            if not line.startswith('hpx_buffer_allocations_total{'):
+                continue
+            labels, value = line.rsplit(' ', 1)
+            kind = labels.split('"')[1]
+            allocations[kind] = allocations.get(kind, 0) + float(value)
+    return allocations
+
+
+def start_daemon(config_path, workers, extra_args=()):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    env['HPROX_SECRET_KEY'] = 'benchmark'
+    return subprocess.Popen(
+        [sys.executable, '-m', 'hpxclient.daemon',
+         '-c', config_path, '-pk', 'benchmark', '-w', str(workers)]
+        + list(extra_args),
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def run_scenario(tunnels=8, chunk=16384, window=262144, churn=0,
+                       upstream='echo', workers=1, duration=10, warmup=2,
+                       event_loop='asyncio', io='default', config_extra=''):
+    if upstream == 'echo':
+        upstream_server, upstream_port = await standin.start_echo_server()
+    else:
+        upstream_server = standin.SinkServer()
+        upstream_port = await upstream_server.start()
+
+    load_server = standin.TunnelLoadServer(
+        '127.0.0.1', upstream_port, tunnels=tunnels, chunk_size=chunk,
+        window=window, churn_rate=churn)
+    if upstream != 'echo':
+        upstream_server.on_received = load_server.sink_received
+    fetcher_port = await load_server.start()
+    mng_server = standin.StandinServer()
+    mng_port = await mng_server.start()
+
+    metrics_port = get_free_port()
+    usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with tempfile.NamedTemporaryFile('w', suffix='.cfg') as config:
+        config.write(CONFIG_TEMPLATE % {'fetcher_port': fetcher_port,
+                                        'mng_port': mng_port,
+                                        'metrics_port': metrics_port})
+        config.write(IO_CONFIG[io])
+        config.write(config_extra)
+        config.flush()
+
+        daemon = start_daemon(config.name, workers,
+                              ['--loop', event_loop])
+        await asyncio.sleep(warmup)
+
+        load_server.latencies = []
+        allocations_before = await fetch_allocations(metrics_port, workers)
+        start_bytes = load_server.bytes_received
+        start_opened = load_server.opened
+        start = time.perf_counter()
+        await asyncio.sleep(duration)
+        relayed = load_server.bytes_received - start_bytes
+        opened = load_server.opened - start_opened
+        elapsed = time.perf_counter() - start
+        total_relayed = load_server.bytes_received
+        allocations = await fetch_allocations(metrics_port, workers)
+
+        daemon.send_signal(signal.SIGTERM)
+        while daemon.poll() is None:
+            await asyncio.sleep(0.05)
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    load_server.close()
+    mng_server.close()
+    upstream_server.close()
+
+    cpu = ((usage.ru_utime - usage_before.ru_utime)
+           + (usage.ru_stime - usage_before.ru_stime))
+    allocations = {kind: count - allocations_before.get(kind, 0)
+                   for kind, count in allocations.items()}
+    relayed_mb = relayed / (1024 * 1024)
+    latencies = load_server.latencies
+    p50 = percentile(latencies, 0.5)
+    p99 = percentile(latencies, 0.99)
+    return {
+        'tunnels': tunnels,
+        'chunk': chunk,
+        'window': window,
+        'churn': churn,
+        'upstream': upstream,
+        'workers': workers,
+        'event_loop': event_loop,
+        'io': io,
+        'duration': elapsed,
+        'throughput_mb_s': relayed / elapsed / (1024 * 1024),
+        'tunnels_opened_per_s': opened / elapsed,
+        'latency_p50_ms': p50 * 1000 if p50 is not None else None,
+        'latency_p99_ms': p99 * 1000 if p99 is not None else None,
+        # The daemon CPU covers the warmup too, so use all relayed bytes.
+        'cpu_s_per_gb': (cpu / (total_relayed / (1024 ** 3))
+                         if total_relayed else None),
+        'peak_rss_mb': usage.ru_maxrss / 1024,
+        'allocations_per_mb': (sum(allocations.values()) / relayed_mb
+                               if allocations and relayed else None),
+        'allocations': allocations,
+    }
+
+
+def format_result(result):
+    def fmt(value, pattern):
+        return pattern % value if value is not None else '-'
+
+    return "%8s %8s %8s %7s %6s %6s %8s %10s %9s %9s %9s %9s %9s" % (
+        result['event_loop'], result['io'], result['tunnels'],
+        result['chunk'], result['churn'], result['workers'],
+        result['upstream'],
+        fmt(result['throughput_mb_s'], '%.1f'),
+        fmt(result['latency_p50_ms'], '%.2f'),
+        fmt(result['latency_p99_ms'], '%.2f'),
+        fmt(result['cpu_s_per_gb'], '%.2f'),
+        fmt(result['peak_rss_mb'], '%.1f'),
+        fmt(result['allocations_per_mb'], '%.1f'))
+
+
+def write_results(path, results, label=None):
+    runs = []
+    if os.path.exists(path):
+        with open(path) as f:
+            runs = json.load(f)
+    runs.append({
+        'label': label,
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    })
+    with open(path, 'w') as f:
+        json.dump(runs, f, indent=2)
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',')]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tunnels", type=int_list, default=[8],
+                        help="Comma separated tunnel counts per link.")
+    parser.add_argument("--chunk", type=int_list, default=[16384],
+                        help="Comma separated chunk sizes.")
+    parser.add_argument("--churn", type=int_list, default=[0],
+                        help="Comma separated tunnels closed and reopened "
+                             "per second.")
+    parser.add_argument("--workers", type=int_list, default=[1])
+    parser.add_argument("--loop", type=lambda value: value.split(','),
+                        default=['asyncio'],
+                        help="Comma separated daemon event loops "
+                             "(asyncio, uvloop).")
+    parser.add_argument("--io", type=lambda value: value.split(','),
+                        default=['default'],
+                        help="Comma separated upstream and link I/O modes "
+                             "(default, buffered).")
+    parser.add_argument("--window", type=int, default=262144,
+                        help="Bytes in flight per tunnel.")
+    parser.add_argument("--upstream", choices=['echo', 'sink'],
+                        default='echo')
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--output", help="JSON file the results are "
+                                         "appended to.")
+    parser.add_argument("--label", help="Label of the run in the output.")
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    print("%8s %8s %8s %7s %6s %6s %8s %10s %9s %9s %9s %9s %9s" % (
+        "loop", "io", "tunnels", "chunk", "churn", "work", "upstream", "MB/s",
+        "p50 ms", "p99 ms", "CPU s/GB", "RSS MB", "allocs/MB"))
+    results = []
+    scenarios = itertools.product(args.loop, args.io, args.workers,
+                                  args.tunnels, args.chunk, args.churn)
+    for event_loop, io, workers, tunnels, chunk, churn in scenarios:
+        result = loop.run_until_complete(run_scenario(
+            tunnels=tunnels, chunk=chunk, window=args.window,
+            churn=churn, upstream=args.upstream,
+            workers=workers, duration=args.duration,
+            warmup=args.warmup, event_loop=event_loop, io=io))
+        results.append(result)
+        print(format_result(result))
+
+    loop.run_until_complete(standin.cancel_pending_tasks(loop))
+    loop.close()
+
+    if args.output:
+        write_results(args.output, results, args.label)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
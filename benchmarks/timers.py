@@ -0,0 +1,109 @@
+""" Timer scheduler cost and lateness.
+
+Schedules `--timers` timers with random delays, cancels every other one
+like the heartbeats rescheduled on traffic, and reports the CPU time
+per timer of the shared TimerScheduler and of one loop handle per timer.
+
+Then runs timers whose callbacks schedule other timers, some later and
+some earlier than the ones waiting in the heap, and checks that none of
+them fires more than the scheduler resolution late. They fire up to the
+resolution early, with the timers due around them.
+
+    python -m hpxclient.benchmarks.timers --timers 100000
+"""
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+from hpxclient import timers
+
+
+RESOLUTION = 0.1
+# Event loop and machine noise on top of the resolution.
+LATENESS_SLACK = 0.05
+
+
+async def run_cost(count, use_scheduler):
+    loop = asyncio.get_event_loop()
+    scheduler = timers.TimerScheduler(loop, RESOLUTION)
+    call_later = scheduler.call_later if use_scheduler else loop.call_later
+    rnd = random.Random(0)
+    fired = []
+    done = loop.create_future()
+
+    def callback():
+        fired.append(None)
+        if len(fired) == count // 2 and not done.done():
+            done.set_result(None)
+
+    start = time.process_time()
+    handles = [call_later(rnd.uniform(0, 1), callback)
+               for _ in range(count)]
+    for handle in handles[::2]:
+        handle.cancel()
+    await done
+    return (time.process_time() - start) / count
+
+
+async def run_lateness(count):
+    loop = asyncio.get_event_loop()
+    scheduler = timers.TimerScheduler(loop, RESOLUTION)
+    rnd = random.Random(1)
+    lateness = []
+    pending = [count]
+    done = loop.create_future()
+
+    def callback(when, children):
+        lateness.append(loop.time() - when)
+        for delay in children:
+            schedule(delay, [])
+        pending[0] -= 1
+        if not pending[0]:
+            done.set_result(None)
+
+    def schedule(delay, children):
+        when = loop.time() + delay
+        scheduler.call_at(when, callback, when, children)
+
+    for _ in range(count):
+        # Callbacks arming the scheduler for a timer later than those
+        # still waiting, as the heartbeats do.
+        children = [rnd.uniform(0.5, 1.5)] if rnd.random() < 0.3 else []
+        pending[0] += len(children)
+        schedule(rnd.uniform(0, 1), children)
+    await done
+    return lateness
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    result = loop.run_until_complete(coroutine)
+    loop.close()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--timers", type=int, default=100000)
+    parser.add_argument("--lateness-timers", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    for name, use_scheduler in (('scheduler', True), ('loop', False)):
+        cost = run(run_cost(args.timers, use_scheduler))
+        print('%-9s: %.2f us CPU per timer' % (name, cost * 1e6))
+
+    lateness = sorted(run(run_lateness(args.lateness_timers)))
+    print('lateness: p50 %.1fms, max %.1fms over %s timers' % (
+        lateness[len(lateness) // 2] * 1000, lateness[-1] * 1000,
+        len(lateness)))
+    if lateness[-1] > RESOLUTION + LATENESS_SLACK:
+        print('FAILED')
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+""" TLS session resumption check.
+
+Starts a stand-in fetcher server behind TLS with a throwaway
+self-signed certificate (made with the openssl command line tool) and
+connects a fetcher link to it `--connects` times through the shared
+client SSL context, as reconnects do. Reports how many handshakes were
+resumed and their duration, with and without session resumption.
+
+    python -m hpxclient.benchmarks.tls_resume --connects 200
+"""
+import os
+import ssl
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+from hpxclient import tls
+from hpxclient import settings
+from hpxclient import protocols
+from hpxclient.benchmarks import standin
+
+
+def make_certificate(directory, hostname):
+    cert_path = os.path.join(directory, 'cert.pem')
+    key_path = os.path.join(directory, 'key.pem')
+    subprocess.check_call(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+         '-days', '1', '-subj', '/CN=%s' % hostname,
+         '-addext', 'subjectAltName=DNS:%s' % hostname,
+         '-keyout', key_path, '-out', cert_path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert_path, key_path
+
+
+class ClosingFetcherProtocol(standin.BenchFetcherProtocol):
+    """ Closes the link once authenticated. """
+
+    def auth_succeeded(self, data):
+        super().auth_succeeded(data)
+        self.close()
+
+
+async def run(connects, resumption, tls_version):
+    with tempfile.TemporaryDirectory() as directory:
+        cert_path, key_path = make_certificate(directory, 'hprox.com')
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(cert_path, key_path)
+        if tls_version == '1.2':
+            server_context.maximum_version = ssl.TLSVersion.TLSv1_2
+
+        settings.TLS_CA_FILE = cert_path
+        settings.TLS_SESSION_RESUMPTION = resumption
+        tls.SSL_CONTEXT = None
+
+        server = standin.StandinServer()
+        port = await server.start(ssl=server_context)
+
+        durations = []
+        resumed = 0
+        cpu_start = time.process_time()
+        for i in range(connects):
+            start = time.perf_counter()
+            transport, protocol = await protocols.ReconnectingProtocol._create_conn(
+                lambda: ClosingFetcherProtocol(None, None, 'bench', 'bench'),
+                '127.0.0.1', port, ssl=True)
+            durations.append(time.perf_counter() - start)
+            if transport.get_extra_info('ssl_object').session_reused:
+                resumed += 1
+            while protocol.transport is not None:
+                await asyncio.sleep(0.001)
+        cpu = time.process_time() - cpu_start
+
+        server.close()
+
+    durations.sort()
+    return {
+        'resumption': resumption,
+        'connects': connects,
+        'resumed': resumed,
+        'p50_ms': durations[len(durations) // 2] * 1000,
+        'cpu_ms_per_connect': cpu / connects * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connects", type=int, default=100)
+    parser.add_argument("--tls-version", choices=['1.2', '1.3'],
+                        default='1.3')
+    args = parser.parse_args(argv)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    print("%10s %8s %8s %8s %12s" % (
+        "resumption", "connects", "resumed", "p50 ms", "CPU ms/conn"))
+    for resumption in (False, True):
+        result = loop.run_until_complete(
+            run(args.connects, resumption, args.tls_version))
+        print("%10s %8s %8s %8.2f %12.2f" % (
+            result['resumption'], result['connects'], result['resumed'],
+            result['p50_ms'], result['cpu_ms_per_connect']))
+
+    loop.run_until_complete(standin.cancel_pending_tasks(loop))
+    loop.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
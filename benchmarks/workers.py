@@ -0,0 +1,44 @@
+""" Load test of the multi-process daemon mode.
+
+Runs the tunnel benchmark of hpxclient.benchmarks.suite with
+`hpxclient.daemon --workers N` for each worker count and reports how
+the relayed throughput scales.
+
+    python -m hpxclient.benchmarks.workers --workers 1,2,4 --duration 10
+"""
+import sys
+import asyncio
+import argparse
+
+from hpxclient.benchmarks import suite
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=suite.int_list, default=[1, 2, 4],
+                        help="Comma separated worker counts.")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--tunnels", type=int, default=8,
+                        help="Tunnels opened on every fetcher link.")
+    parser.add_argument("--chunk", type=int, default=16384)
+    parser.add_argument("--window", type=int, default=262144,
+                        help="Bytes in flight per tunnel.")
+    args = parser.parse_args(argv)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    print("%8s %12s %12s" % ("workers", "MB/s", "speedup"))
+    baseline = None
+    for workers in args.workers:
+        result = loop.run_until_complete(suite.run_scenario(
+            tunnels=args.tunnels, chunk=args.chunk, window=args.window,
+            workers=workers, duration=args.duration, warmup=args.warmup))
+        rate = result['throughput_mb_s']
+        baseline = baseline or rate
+        print("%8s %12.1f %11.2fx" % (workers, rate, rate / baseline))
+    loop.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
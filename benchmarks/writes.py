@@ -0,0 +1,173 @@
+""" Benchmark of small-packet writes on a MsgpackReconnectingProtocol.
+
+Connects a protocol to a local sink server and writes bursts of small
+TRANS_DATA frames, as an upstream producing many small reads would,
+under several flush policies. Reports frames/s, transport write calls
+and the latency added to a single frame.
+
+    python -m hpxclient.benchmarks.writes --frames 200000 --burst 16
+"""
+import sys
+import time
+import asyncio
+import argparse
+
+from hpxclient import protocols
+from hpxclient import producers
+
+
+POLICIES = [
+    # name, coalesce, flush size, flush delay
+    ("no-coalesce", False, 64 * 1024, 0),
+    ("iteration", True, 64 * 1024, 0),
+    ("delay-1ms", True, 64 * 1024, 0.001),
+]
+
+
+class SinkProtocol(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+
+    def data_received(self, data):
+        self.server.received(len(data))
+
+
+class SinkServer(object):
+    def __init__(self):
+        self.bytes_received = 0
+        self.waiter = None
+        self.expected = 0
+
+    def wait_for(self, total):
+        self.expected = total
+        self.waiter = asyncio.Future()
+        if self.bytes_received >= total:
+            self.waiter.set_result(None)
+        return self.waiter
+
+    def received(self, size):
+        self.bytes_received += size
+        if (self.waiter and not self.waiter.done()
+                and self.bytes_received >= self.expected):
+            self.waiter.set_result(None)
+
+
+class BenchProtocol(protocols.MsgpackReconnectingProtocol):
+    def connection_lost(self, exc):
+        # Benchmark links are not reconnected.
+        self.close()
+
+
+class CountingTransport(object):
+    """ Transport proxy counting the write calls that reach it. """
+
+    def __init__(self, transport):
+        self._transport = transport
+        self.write_calls = 0
+
+    def write(self, data):
+        self.write_calls += 1
+        self._transport.write(data)
+
+    def writelines(self, list_of_data):
+        self.write_calls += 1
+        self._transport.writelines(list_of_data)
+
+    def __getattr__(self, name):
+        return getattr(self._transport, name)
+
+
+async def connect(sink, coalesce, flush_size, flush_delay):
+    loop = asyncio.get_event_loop()
+    server = await loop.create_server(lambda: SinkProtocol(sink),
+                                      '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    proto = BenchProtocol()
+    proto.coalesce_writes = coalesce
+    proto.flush_size = flush_size
+    proto.flush_delay = flush_delay
+    await loop.create_connection(lambda: proto, '127.0.0.1', port)
+    proto.transport = CountingTransport(proto.transport)
+    return server, proto
+
+
+async def run_throughput(policy, frame_count, burst, payload):
+    name, coalesce, flush_size, flush_delay = policy
+    sink = SinkServer()
+    server, proto = await connect(sink, coalesce, flush_size, flush_delay)
+
+    frame_size = len(protocols.encode_msg(
+        producers.TransferDataProducer(0, payload).msg2str()))
+
+    start = time.perf_counter()
+    for i in range(0, frame_count, burst):
+        for conn_id in range(i, min(i + burst, frame_count)):
+            proto.write_data(producers.TransferDataProducer(conn_id % 1024,
+                                                            payload))
+        # Let the loop run between bursts, as between socket reads.
+        await asyncio.sleep(0)
+    await sink.wait_for(frame_count * frame_size)
+    elapsed = time.perf_counter() - start
+
+    write_calls = proto.transport.write_calls
+    proto.close()
+    server.close()
+    return frame_count / elapsed, write_calls
+
+
+async def run_latency(policy, samples, payload):
+    name, coalesce, flush_size, flush_delay = policy
+    sink = SinkServer()
+    server, proto = await connect(sink, coalesce, flush_size, flush_delay)
+
+    frame_size = len(protocols.encode_msg(
+        producers.TransferDataProducer(0, payload).msg2str()))
+
+    latencies = []
+    for i in range(samples):
+        start = time.perf_counter()
+        proto.write_data(producers.TransferDataProducer(0, payload))
+        await sink.wait_for((i + 1) * frame_size)
+        latencies.append(time.perf_counter() - start)
+
+    proto.close()
+    server.close()
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=200000)
+    parser.add_argument("--burst", type=int, default=16,
+                        help="Frames written per loop iteration.")
+    parser.add_argument("--payload", type=int, default=64,
+                        help="Payload size of every frame in bytes.")
+    parser.add_argument("--samples", type=int, default=500,
+                        help="Single-frame round trips for the latency test.")
+    args = parser.parse_args(argv)
+
+    payload = b'x' * args.payload
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    print("%12s %12s %12s %12s %12s" % (
+        "policy", "frames/s", "writes", "p50 (us)", "p99 (us)"))
+    for policy in POLICIES:
+        rate, write_calls = loop.run_until_complete(
+            run_throughput(policy, args.frames, args.burst, payload))
+        p50, p99 = loop.run_until_complete(
+            run_latency(policy, args.samples, payload))
+        print("%12s %12.0f %12d %12.1f %12.1f" % (
+            policy[0], rate, write_calls, p50 * 1e6, p99 * 1e6))
+
+    pending = asyncio.all_tasks(loop)
+    for task in pending:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+    loop.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+from hpxclient import metrics
+from hpxclient import settings
+
+
+POOL = None
+
+
+class BufferPool(object):
+    """ Preallocated read buffers of `buffer_size` bytes, see BUFFERED_IO.
+
+    A reader takes a buffer for every read and gives it back once the
+    data is consumed, so the same few buffers serve all the upstream
+    connections. Up to `max_free` of them are kept for reuse.
+    """
+
+    def __init__(self, buffer_size, max_free):
+        self.buffer_size = buffer_size
+        self.max_free = max_free
+        self._free = []
+
+        self.allocated = 0
+        self.acquired = 0
+        self._allocations = metrics.BUFFER_ALLOCATIONS.labels('read')
+
+    def acquire(self):
+        self.acquired += 1
+        if self._free:
+            return self._free.pop()
+        self.allocated += 1
+        self._allocations.inc()
+        return bytearray(self.buffer_size)
+
+    def release(self, buff):
+        if len(self._free) < self.max_free:
+            self._free.append(buff)
+
+    def get_stats(self):
+        return {
+            'buffer_pool_allocated': self.allocated,
+            'buffer_pool_acquired': self.acquired,
+            'buffer_pool_free': len(self._free),
+        }
+
+
+def get_pool():
+    global POOL
+    if POOL is None:
+        POOL = BufferPool(int(settings.READ_BUFFER_SIZE),
+                          int(settings.READ_BUFFER_POOL_SIZE))
+    return POOL
+
+
+def reset_pool():
+    """ Gives the connections made from now on a new pool, with the current
+    READ_BUFFER_* settings. The others keep theirs.
+    """
+    global POOL
+    POOL = None
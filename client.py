@@ -0,0 +1,191 @@
+import time
+import itertools
+import asyncio
+import weakref
+
+from hpxclient import config as hpxclient_config
+from hpxclient import shaping
+
+from hpxclient.mng import service as mng_service
+from hpxclient.fetcher.central import pool as fetcher_central_pool
+from hpxclient.fetcher.central import service as fetcher_central_service
+
+
+# Seconds between the checks for open tunnels while draining.
+DRAIN_CHECK_INTERVAL = 0.1
+
+_CLIENT_IDS = itertools.count(1)
+
+class Client(object):
+    """ One account on the proxy network: its manager link and its pool
+    of fetcher links, with their tunnels.
+
+    Every client has its own Config, links, tunnels, bandwidth limits
+    and stats, so that many accounts can run in one event loop. The
+    process-wide parts are the upstream DNS cache and connect limits,
+    the TLS context, the read buffer pool, the timers and the metrics,
+    see config.PROCESS_SETTINGS. The link metrics are labelled with
+    `name`, the public key or email by default.
+
+        client = Client(public_key, secret_key,
+                        config=Config(FETCHER_POOL_SIZE=2))
+        await client.start()
+        await client.wait_ready(timeout=10)
+        ...
+        await client.drain(timeout=30)
+    """
+
+    def __init__(self, public_key=None, secret_key=None, email=None,
+                 password=None, config=None, message_handler=None,
+                 name=None):
+        self.public_key = public_key
+        self.secret_key = secret_key
+        self.email = email
+        self.password = password
+        self.config = (config if config is not None
+                       else hpxclient_config.Config())
+        self.message_handler = message_handler
+        self.name = (name or public_key or email
+                     or 'client-%s' % next(_CLIENT_IDS))
+
+        self.shaper = shaping.create_shaper(self.config)
+        self.pool = None
+
+        # Every link protocol made for the client, reconnects included.
+        self.links = weakref.WeakSet()
+        self._tasks = []
+        self.started = False
+        self.draining = False
+        self.stopped = False
+
+    def _track(self, protocol_factory):
+        def wrapper():
+            protocol = protocol_factory()
+            protocol.client_name = self.name
+            self.links.add(protocol)
+            return protocol
+        return wrapper
+
+    async def start(self):
+        """ Starts connecting the links, without waiting for them, see
+        wait_ready(). They are connected again whenever they are lost.
+        """
+        if self.started:
+            raise RuntimeError("Client already started")
+        self.started = True
+
+        config = self.config
+        ssl = str(config.PROXY_SSL_ENABLED) == "True"
+        pool_size = int(config.FETCHER_POOL_SIZE)
+        self.pool = fetcher_central_pool.FetcherPool(pool_size)
+
+        self._tasks.append(asyncio.ensure_future(
+            mng_service.ManagerProtocol.create_conn(
+                self._track(mng_service.get_client_protocol_factory(
+                    email=self.email,
+                    password=self.password,
+                    public_key=self.public_key,
+                    secret_key=self.secret_key,
+                    message_handler=self.message_handler,
+                    config=config)),
+                host=config.PROXY_MNG_SERVER_IP,
+                port=config.PROXY_MNG_SERVER_PORT,
+                ssl=ssl,
+                config=config)))
+
+        for pool_index in range(pool_size):
+            self._tasks.append(asyncio.ensure_future(
+                fetcher_central_service.CentralFetcherProtocol.create_conn(
+                    self._track(fetcher_central_service.get_protocol_factory(
+                        email=self.email,
+                        password=self.password,
+                        public_key=self.public_key,
+                        secret_key=self.secret_key,
+                        pool=self.pool,
+                        pool_index=pool_index,
+                        config=config,
+                        shaper=self.shaper)),
+                    host=config.PROXY_FETCHER_SERVER_IP,
+                    port=config.PROXY_FETCHER_SERVER_PORT,
+                    ssl=ssl,
+                    config=config)))
+
+    async def wait_ready(self, timeout=None):
+        """ Waits until all the fetcher links are authenticated. Raises
+        asyncio.TimeoutError after `timeout` seconds.
+        """
+        if not self.started:
+            raise RuntimeError("Client not started")
+        await asyncio.wait_for(self.pool.ready.wait(), timeout)
+
+    async def drain(self, timeout=None):
+        """ Stops taking new tunnels, the server gets a CLOSE_CONN for
+        them, and waits up to `timeout` seconds, SHUTDOWN_DRAIN_TIMEOUT
+        by default, for the open ones to be closed. Then stop()s.
+        """
+        if timeout is None:
+            timeout = float(self.config.SHUTDOWN_DRAIN_TIMEOUT)
+        self.draining = True
+        if self.pool is not None:
+            self.pool.draining = True
+
+        deadline = time.monotonic() + timeout
+        while self.count_tunnels() and time.monotonic() < deadline:
+            await asyncio.sleep(DRAIN_CHECK_INTERVAL)
+
+        tunnels = self.count_tunnels()
+        if tunnels:
+            print("Drain timed out, closing %s tunnels" % tunnels)
+        await self.stop()
+
+    async def stop(self):
+        """ Closes the links and their tunnels, without reconnecting. """
+        if self.stopped:
+            return
+        self.stopped = True
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        for link in list(self.links):
+            link.stop()
+
+    def reload(self):
+        """ Applies the current settings: the rate limits at once, the
+        others to the tunnels and links made from now on, which read
+        them when they are made.
+        """
+        shaping.update_shaper(self.shaper, self.config)
+
+    def count_tunnels(self):
+        """ The open tunnels, those of lost links waiting for a resume
+        included.
+        """
+        fetcher_class = fetcher_central_service.CentralFetcherProtocol
+        return sum(len(link.processors) for link in list(self.links)
+                   if isinstance(link, fetcher_class))
+
+    def get_stats(self):
+        """ Link and tunnel counts, flow control state included: the
+        fetcher links not read, those holding the reads of their tunnels
+        and the tunnels not read.
+        """
+        stats = {
+            'fetcher_links': 0,
+            'tunnels': 0,
+            'paused_links': 0,
+            'processors_paused_links': 0,
+            'paused_tunnels': 0,
+        }
+        if self.pool is not None:
+            pool_stats = self.pool.get_stats()
+            stats['fetcher_links'] = pool_stats['healthy']
+            stats['tunnels'] = pool_stats['tunnels']
+            stats['paused_links'] = pool_stats['paused']
+            stats['processors_paused_links'] = (
+                pool_stats['processors_paused'])
+            stats['paused_tunnels'] = pool_stats['paused_tunnels']
+        stats.update(self.shaper.get_stats())
+        return stats
@@ -0,0 +1,45 @@
+from hpxclient import settings
+
+
+# Settings of objects shared by every client of the process: the upstream
+# DNS cache and connector, the TLS context, the read buffer pool, the
+# timers, the event loop, the workers and the metrics endpoint. They are
+# read from the settings module only.
+PROCESS_SETTINGS = frozenset([
+    'DNS_CACHE_TTL', 'DNS_NEGATIVE_TTL', 'DNS_CACHE_SIZE',
+    'DNS_PREWARM_HOSTS',
+    'UPSTREAM_CONNECT_TIMEOUT', 'UPSTREAM_HAPPY_EYEBALLS_DELAY',
+    'UPSTREAM_MAX_CONNECTING', 'UPSTREAM_MAX_CONNECTING_PER_HOST',
+    'UPSTREAM_MAX_CONNECT_QUEUE',
+    'TLS_CA_FILE', 'TLS_CIPHERS', 'TLS_ALPN_PROTOCOLS',
+    'TLS_SESSION_RESUMPTION',
+    'READ_BUFFER_SIZE', 'READ_BUFFER_POOL_SIZE',
+    'TIMER_RESOLUTION', 'EVENT_LOOP', 'WORKERS', 'WORKER_STATS_INTERVAL',
+    'METRICS_ENABLED', 'METRICS_HOST', 'METRICS_PORT',
+])
+
+
+class Config(object):
+    """ Settings of one client.
+
+    The settings given as keyword arguments (names in any case) override
+    the values of the settings module, the others are read from it when
+    used. Raises AttributeError for unknown setting names and
+    ValueError for the PROCESS_SETTINGS, which a client can't override.
+    """
+
+    def __init__(self, **overrides):
+        for name, value in overrides.items():
+            name = name.upper()
+            if not hasattr(settings, name):
+                raise AttributeError("Unknown setting: %s" % name)
+            if name in PROCESS_SETTINGS:
+                raise ValueError(
+                    "%s is shared by every client of the process, set it "
+                    "in the settings module" % name)
+            setattr(self, name, value)
+
+    def __getattr__(self, name):
+        if not name.isupper():
+            raise AttributeError(name)
+        return getattr(settings, name)
@@ -9,3 +9,17 @@ INFO_VERSION_KIND = "info_version"
 
 PING_KIND = 'ping'
 PONG_KIND = 'pong'
+
+# Session resume acknowledgement, carries the number of tunnel messages
+# received on the session.
+ACK_KIND = 'ack'
+
+# Highest link protocol version supported by the client. Version 2 adds
+# binary TRANS_DATA frames, see hpxclient.protocols.
+PROTOCOL_VERSION = 2
+
+# First byte of a binary frame. Msgpack encoded messages are maps, so
+# they never start with it.
+BINARY_TRANS_DATA_KIND = 0x01
+# Same frame with a compressed payload, once compression is negotiated.
+BINARY_COMPRESSED_TRANS_DATA_KIND = 0x02
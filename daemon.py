@@ -1,15 +1,20 @@
 import sys
 import os
-import socket
+import signal
 import asyncio
 import argparse
 import logging
 import configparser
 
+from hpxclient import client as hpxclient_client
+from hpxclient import metrics
 from hpxclient import settings
+from hpxclient import tls
+from hpxclient import buffers
+from hpxclient import resolver
+from hpxclient import supervisor
 
-from hpxclient.mng import service as mng_service
-from hpxclient.fetcher.central import service as fetcher_central_service
+from hpxclient.processor.local import service as processor_local_service
 
 
 logging.basicConfig(
@@ -18,14 +23,16 @@ logging.basicConfig(
     stream=sys.stdout,
 )
 
-def set_ips(settings, domain):
+def reset_server_ips(settings):
+    """ Clears the server IPs, so that the servers are reached through
+    the configured domain, resolved when connecting.
+    """
     ip_consts = ['LISTENER', 'FETCHER', 'MNG', 'BRIDGE']
-    domain_ip = socket.gethostbyname(domain)
 
     for ip_const in ip_consts:
         setting_name = 'PROXY_%s_SERVER_IP' % ip_const
-        setattr(settings, setting_name, domain_ip)
-    setattr(settings, 'DOMAIN_IP', domain_ip)
+        setattr(settings, setting_name, None)
+    setattr(settings, 'DOMAIN_IP', None)
 
 
 def load_data_config_file(config_file):
@@ -50,7 +57,7 @@ def load_data_config_file(config_file):
                 print(_INVALID_PARAM_ERROR % name)
 
             if 'DOMAIN' in name.upper():
-                set_ips(settings, value)
+                reset_server_ips(settings)
 
             if name.upper() in _NOT_ALLOWED_IN_CONF:
                 raise argparse.ArgumentTypeError(_INVALID_PARAM_ERROR % name)
@@ -89,6 +96,14 @@ def load_config():
                         dest="config_file",
                         help="Define configuration file.")
 
+    parser.add_argument("-l", "--loop",
+                        dest="EVENT_LOOP", choices=["asyncio", "uvloop"],
+                        help="Event loop implementation.")
+
+    parser.add_argument("-w", "--workers",
+                        dest="WORKERS", type=int,
+                        help="Number of worker processes.")
+
     args = parser.parse_args()
     config_file = args.config_file
     load_data_config_file(config_file)
@@ -109,23 +124,117 @@ def load_config():
         settings.SECRET_KEY = os.environ["HPROX_SECRET_KEY"]
 
 
-def run_daemon():
-    load_config()
-    loop = asyncio.get_event_loop()
-    proxy_enabled = str(settings.PROXY_SSL_ENABLED) == "True"
-
-    loop.run_until_complete(asyncio.gather(
-        mng_service.start_client(
-            public_key=settings.PUBLIC_KEY,
-            secret_key=settings.SECRET_KEY,
-            ssl=proxy_enabled
-        ),
-        fetcher_central_service.start_client(
-            public_key=settings.PUBLIC_KEY,
-            secret_key=settings.SECRET_KEY,
-            ssl=proxy_enabled
-        )
-    ))
+async def report_worker_stats(worker_index, stats_queue, client):
+    while True:
+        stats = {
+            'worker': worker_index,
+            'pid': os.getpid(),
+        }
+        stats.update(client.get_stats())
+        stats.update(processor_local_service.get_resolver().get_stats())
+        stats.update(processor_local_service.get_connector().get_stats())
+        stats_queue.put(stats)
+        await asyncio.sleep(float(settings.WORKER_STATS_INTERVAL))
+
+
+def new_event_loop(backend):
+    """ Creates the event loop of the given backend, `asyncio` or
+    `uvloop`. Falls back to asyncio when uvloop is not installed.
+    """
+    if backend == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            print("uvloop is not installed, using the asyncio event loop.")
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    elif backend != 'asyncio':
+        raise argparse.ArgumentTypeError("Unknown event loop: %s" % backend)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+def shutdown_event_loop(loop):
+    pending = asyncio.all_tasks(loop)
+    for task in pending:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    loop.close()
+
+
+def handle_signals(loop, client, stop_signals):
+    """ `stop_signals` drain the client and then stop the loop, a second
+    one stops it right away. SIGHUP reloads the configuration: the rate
+    limits change at once, the other settings apply to the tunnels and
+    links made from then on. The TLS context and the read buffer pool are
+    made again for the TLS_* and READ_BUFFER_* settings, so the next
+    connects don't resume the TLS sessions. Settings the command line
+    can't change, like WORKERS or EVENT_LOOP, and settings removed from
+    the file keep their value until a restart.
+    """
+    def stop():
+        if client.draining:
+            print("Stopping without waiting for the tunnels")
+            loop.stop()
+            return
+        print("Draining the tunnels, for up to %s seconds"
+              % client.config.SHUTDOWN_DRAIN_TIMEOUT)
+        task = loop.create_task(client.drain())
+        task.add_done_callback(lambda future: loop.stop())
+
+    def reload():
+        print("Reloading the configuration")
+        try:
+            load_config()
+        except Exception as e:
+            print("Configuration not reloaded: %s" % e)
+            return
+        processor_local_service.reload_settings()
+        tls.reset_ssl_context()
+        buffers.reset_pool()
+        client.reload()
+
+    try:
+        for signum in stop_signals:
+            loop.add_signal_handler(signum, stop)
+        loop.add_signal_handler(signal.SIGHUP, reload)
+    except (NotImplementedError, AttributeError):
+        # No signal handlers in the loop on Windows, Ctrl-C raises
+        # KeyboardInterrupt there.
+        pass
+
+
+def run_worker(worker_index=None, stats_queue=None):
+    loop = new_event_loop(settings.EVENT_LOOP)
+
+    metrics.ENABLED = str(settings.METRICS_ENABLED) == "True"
+    if metrics.ENABLED and settings.METRICS_PORT:
+        loop.run_until_complete(metrics.start_http_server(
+            settings.METRICS_HOST,
+            int(settings.METRICS_PORT) + (worker_index or 0)))
+
+    client = hpxclient_client.Client(
+        public_key=settings.PUBLIC_KEY,
+        secret_key=settings.SECRET_KEY)
+    loop.run_until_complete(client.start())
+
+    prewarm_hosts = resolver.parse_hosts(settings.DNS_PREWARM_HOSTS)
+    if prewarm_hosts:
+        loop.create_task(
+            processor_local_service.get_resolver().prewarm(prewarm_hosts))
+
+    if stats_queue is not None:
+        loop.create_task(
+            report_worker_stats(worker_index, stats_queue, client))
+
+    # Workers get SIGINT forwarded by the supervisor as SIGTERM.
+    stop_signals = [signal.SIGTERM]
+    if worker_index is None:
+        stop_signals.append(signal.SIGINT)
+    handle_signals(loop, client, stop_signals)
 
     try:
         loop.run_forever()
@@ -134,10 +243,19 @@ def run_daemon():
         print('\nClient stopped\n')
 
     finally:
-        pending = asyncio.Task.all_tasks()
-        for p in pending:
-            p.cancel()
-        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.run_until_complete(client.stop())
+        shutdown_event_loop(loop)
+
+
+def run_daemon():
+    load_config()
+
+    workers = int(settings.WORKERS)
+    if workers > 1:
+        supervisor.Supervisor(workers, run_worker).run()
+        return
+
+    run_worker()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,255 @@
+""" Compression of the tunnel data of a fetcher link.
+
+The client offers the codec set in COMPRESSION when it authenticates and
+the server picks it or none. Each tunnel then compresses its data as one
+stream, so that content repeated across its chunks compresses too, and
+every chunk is flushed to a byte boundary so that it can be decompressed
+as soon as it arrives. Compressed chunks are sent in
+BINARY_COMPRESSED_TRANS_DATA_KIND frames, the others in plain ones.
+
+Data that doesn't compress, e.g. TLS or images, is found out by sampling:
+a chunk that doesn't shrink below COMPRESSION_MIN_RATIO of its size makes
+its tunnel send the next COMPRESSION_SKIP_SIZE bytes as is. Then only the
+first SAMPLE_SIZE bytes of the next chunk are compressed to try again,
+the rest of it is compressed only if they shrank.
+
+Large chunks are compressed in a worker thread, zlib releases the GIL
+while it works. The frames of a tunnel wait behind its chunk being
+compressed to keep their order, its upstream stops being read while
+more than PROCESSOR_WRITE_BUFFER_HIGH bytes wait.
+"""
+import time
+import zlib
+import asyncio
+import functools
+import collections
+
+
+CODECS = frozenset(['zlib'])
+
+# Bytes of a chunk compressed to sample whether the data compresses.
+SAMPLE_SIZE = 16 * 1024
+
+# Most bytes a received chunk may decompress to. The server doesn't send
+# chunks nearly as large, more is taken as invalid data.
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def get_offered_codec(config):
+    """ The codec to offer the server, None to not compress. """
+    codec = str(config.COMPRESSION)
+    if codec in CODECS:
+        return codec
+    return None
+
+
+class TunnelCompressor(object):
+    """ Compression state of one tunnel. """
+
+    def __init__(self, level, min_size, min_ratio, skip_size):
+        self._compressobj = zlib.compressobj(level)
+        self.min_size = min_size
+        self.min_ratio = min_ratio
+        self.skip_size = skip_size
+
+        # Bytes left to send as is before trying to compress again, with
+        # a sample first.
+        self.skip = 0
+        self.sampling = True
+        # Set while a chunk is compressed in a worker thread. The data
+        # and the close of the tunnel wait in `pending` meanwhile, the
+        # upstream is held while too much of it does.
+        self.busy = False
+        self.pending = collections.deque()
+        self.pending_size = 0
+        self.held = False
+
+    def wants(self, size):
+        """ Whether a chunk of `size` bytes should be compressed. """
+        if size < self.min_size:
+            return False
+        if self.skip > 0:
+            self.skip -= size
+            return False
+        return True
+
+    def compress(self, data):
+        """ Returns the compressed chunk and the CPU time it took. Safe to
+        run in a worker thread, one call at a time.
+        """
+        start = time.thread_time()
+        compressobj = self._compressobj
+        payload = (compressobj.compress(data)
+                   + compressobj.flush(zlib.Z_SYNC_FLUSH))
+        return payload, time.thread_time() - start
+
+    def sampled(self, size, compressed_size):
+        self.sampling = compressed_size > size * self.min_ratio
+        if self.sampling:
+            self.skip = self.skip_size
+
+
+class LinkCompression(object):
+    """ Compression of the tunnels of a fetcher link, moved to the new
+    link with the session when it is resumed.
+    """
+
+    def __init__(self, link, codec):
+        self.link = link
+        self.codec = codec
+
+        config = link.config
+        self.level = int(config.COMPRESSION_LEVEL)
+        self.min_size = int(config.COMPRESSION_MIN_SIZE)
+        self.min_ratio = float(config.COMPRESSION_MIN_RATIO)
+        self.skip_size = int(config.COMPRESSION_SKIP_SIZE)
+        self.thread_size = int(config.COMPRESSION_THREAD_SIZE)
+        self.pending_high = int(config.PROCESSOR_WRITE_BUFFER_HIGH)
+        self.pending_low = int(config.PROCESSOR_WRITE_BUFFER_LOW)
+
+        self._compressors = {}
+        self._decompressors = {}
+
+        # Sent data, compressed (in -> out) or as is.
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.bytes_raw = 0
+        self.compress_time = 0
+        self.threaded = 0
+        # Received data, compressed (in -> out).
+        self.decompressed_in = 0
+        self.decompressed_out = 0
+        self.decompress_time = 0
+
+    def send_data(self, conn_id, data):
+        compressor = self._compressors.get(conn_id)
+        if compressor is None:
+            compressor = self._compressors[conn_id] = TunnelCompressor(
+                self.level, self.min_size, self.min_ratio, self.skip_size)
+        if compressor.busy:
+            if type(data) is memoryview:
+                data = self.link.copy_data(data)
+            compressor.pending.append((data, None))
+            compressor.pending_size += len(data)
+            if (not compressor.held
+                    and compressor.pending_size > self.pending_high):
+                compressor.held = True
+                processor = self.link.processors.get(conn_id)
+                if processor is not None:
+                    processor.pause_reading()
+            return
+        self._send(conn_id, compressor, data)
+
+    def _send(self, conn_id, compressor, data):
+        size = len(data)
+        if (compressor.sampling and compressor.skip <= 0
+                and size > SAMPLE_SIZE):
+            data = memoryview(data)
+            payload, cpu_time = compressor.compress(data[:SAMPLE_SIZE])
+            self._send_compressed(conn_id, compressor, SAMPLE_SIZE,
+                                  payload, cpu_time)
+            data = data[SAMPLE_SIZE:]
+            size = len(data)
+
+        if not compressor.wants(size):
+            self.bytes_raw += size
+            self.link.send_data(conn_id, data)
+            return
+
+        if size >= self.thread_size:
+            if type(data) is memoryview:
+                data = self.link.copy_data(data)
+            compressor.busy = True
+            self.threaded += 1
+            future = asyncio.get_event_loop().run_in_executor(
+                None, compressor.compress, data)
+            future.add_done_callback(functools.partial(
+                self._compressed, conn_id, compressor, size))
+            return
+
+        payload, cpu_time = compressor.compress(data)
+        self._send_compressed(conn_id, compressor, size, payload, cpu_time)
+
+    def _send_compressed(self, conn_id, compressor, size, payload, cpu_time):
+        self.bytes_in += size
+        self.bytes_out += len(payload)
+        self.compress_time += cpu_time
+        compressor.sampled(size, len(payload))
+        self.link.send_data(conn_id, payload, compressed=True)
+
+    def _compressed(self, conn_id, compressor, size, future):
+        compressor.busy = False
+        if (future.cancelled()
+                or self._compressors.get(conn_id) is not compressor):
+            # Closed by the server meanwhile.
+            return
+        payload, cpu_time = future.result()
+        self._send_compressed(conn_id, compressor, size, payload, cpu_time)
+
+        pending = compressor.pending
+        while pending and not compressor.busy:
+            data, error = pending.popleft()
+            if data is None:
+                self.forget(conn_id)
+                self.link.send_close(conn_id, error)
+                return
+            compressor.pending_size -= len(data)
+            self._send(conn_id, compressor, data)
+
+        if compressor.held and compressor.pending_size <= self.pending_low:
+            compressor.held = False
+            self.link.resume_conn(conn_id)
+
+    def defer_close(self, conn_id, error=None):
+        """ Returns whether the close of the tunnel has to wait for its
+        data being compressed, it is sent after it then.
+        """
+        compressor = self._compressors.get(conn_id)
+        if compressor is not None and compressor.busy:
+            compressor.pending.append((None, error))
+            return True
+        self.forget(conn_id)
+        return False
+
+    def is_held(self, conn_id):
+        """ Whether the upstream of the tunnel waits for its data being
+        compressed.
+        """
+        compressor = self._compressors.get(conn_id)
+        return compressor is not None and compressor.held
+
+    def decompress(self, conn_id, payload):
+        """ Raises zlib.error on invalid data. """
+        decompressobj = self._decompressors.get(conn_id)
+        if decompressobj is None:
+            decompressobj = self._decompressors[conn_id] = (
+                zlib.decompressobj())
+        start = time.thread_time()
+        data = decompressobj.decompress(payload, MAX_CHUNK_SIZE)
+        if decompressobj.unconsumed_tail:
+            raise zlib.error('chunk decompresses to more than %s bytes'
+                             % MAX_CHUNK_SIZE)
+        self.decompress_time += time.thread_time() - start
+        self.decompressed_in += len(payload)
+        self.decompressed_out += len(data)
+        return data
+
+    def forget(self, conn_id):
+        """ Drops the state of a closed tunnel. """
+        self._compressors.pop(conn_id, None)
+        self._decompressors.pop(conn_id, None)
+
+    def get_stats(self):
+        return {
+            'codec': self.codec,
+            'tunnels': len(self._compressors),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_raw': self.bytes_raw,
+            'bytes_saved': self.bytes_in - self.bytes_out,
+            'compress_time': self.compress_time,
+            'threaded': self.threaded,
+            'decompressed_in': self.decompressed_in,
+            'decompressed_out': self.decompressed_out,
+            'decompress_time': self.decompress_time,
+        }
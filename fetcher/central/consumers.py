@@ -1,69 +1,98 @@
-import asyncio
+import zlib
 
 from hpxclient import protocols
 
 from hpxclient import consts
-from hpxclient import producers
-from hpxclient.fetcher.central import utils as fetcher_central_utils
 from hpxclient.processor.local import service as processor_local_service
 
 
 class AuthResponseConsumer(protocols.MessageConsumer):
+    __slots__ = ()
     KIND = consts.AUTH_KIND
 
     def process(self):
-        error = self.data[b'error']
+        data = self.data
+        if (not isinstance(data, dict)
+                or not isinstance(data.get(b'protocol_version', 1), int)):
+            print("Malformed auth response: %r" % (data,))
+            self.protocol.close()
+            return
+
+        error = data.get(b'error')
         if error:
-            print("Unexpected error: %s", error.decode())
+            if isinstance(error, bytes):
+                error = error.decode(errors='replace')
+            print("Authentication failed: %s" % error)
             self.protocol.close()
             return
 
-        user_id = self.data[b'user_id']
-        session_id = self.data[b'session_id']
-        public_key = self.data[b'public_key']
+        # Servers not aware of the protocol versions keep on v1.
+        self.protocol.protocol_version = min(
+            data.get(b'protocol_version', 1), consts.PROTOCOL_VERSION)
+        self.protocol.auth_succeeded(data)
 
 
 class InitConnConsumer(protocols.MessageConsumer):
+    __slots__ = ()
     KIND = consts.INIT_CONN_KIND
     
-    async def process(self):
+    def process(self):
         conn_id = self.data[b'conn_id']
         url = self.data[b'url'].decode()
         port = int(self.data[b'port'])
 
-        lpt, lpp = await processor_local_service.start_client(
-            conn_id, url, port, self.protocol
-        )
-        if lpt is None:
-            self.protocol.write_data(producers.CloseConnProducer(conn_id))
+        pool = self.protocol.pool
+        if pool is not None and pool.draining:
+            self.protocol.send_close(conn_id, 'draining')
             return
 
-        fetcher_central_utils.add_processor(conn_id, lpp)
+        processor_local_service.start_client(
+            conn_id, url, port, self.protocol
+        )
 
 
 class TransferDataConsumer(protocols.MessageConsumer):
+    __slots__ = ()
     KIND = consts.TRANS_DATA_KIND
     
     def process(self):
         conn_id = self.data[b'conn_id']
 
-        processor_proto = fetcher_central_utils.get_processor(conn_id)
+        processor_proto = self.protocol.processors.get(conn_id)
         if processor_proto is None:
             return
 
-        processor_proto.write_data(self.data[b'data'])
+        data = self.data[b'data']
+        if self.data.get(b'compressed'):
+            compression = self.protocol.compression
+            try:
+                if compression is None:
+                    raise zlib.error('compression not negotiated')
+                data = compression.decompress(conn_id, data)
+            except zlib.error as e:
+                print('Invalid compressed data [conn_id=%s]: %s'
+                      % (conn_id, e))
+                processor_proto.reset('invalid compressed data')
+                return
+
+        processor_proto.write_data(data)
 
 
 class CloseConnConsumer(protocols.MessageConsumer):
+    __slots__ = ()
     KIND = consts.CLOSE_CONN_KIND
     
     def process(self):
         conn_id = self.data[b'conn_id']
 
-        processor_proto = fetcher_central_utils.get_processor(conn_id)
-        if processor_proto is None:
-            return
+        if self.protocol.compression is not None:
+            self.protocol.compression.forget(conn_id)
+        self.protocol.processors.close(conn_id)
 
-        if processor_proto.transport:
-            processor_proto.transport.close()
-        fetcher_central_utils.remove_processor(conn_id)
+
+class AckConsumer(protocols.MessageConsumer):
+    __slots__ = ()
+    KIND = consts.ACK_KIND
+
+    def process(self):
+        self.protocol.ack_received(self.data[b'received'])
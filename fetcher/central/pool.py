@@ -0,0 +1,76 @@
+import time
+import asyncio
+
+
+class FetcherPool(object):
+    """ Keeps `size` parallel fetcher links.
+
+    Each member reconnects on its own. The server picks the link that
+    carries each INIT_CONN and all the traffic of that conn_id stays on
+    it, since its processor writes back through the link that created
+    it. Losing a member only tears down the tunnels it owns. The pool
+    is ready while all its members are authenticated.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.links = {}
+        self.members = {
+            index: {
+                'connected': False,
+                'authenticated': False,
+                'connected_since': None,
+                'connects': 0,
+                'losses': 0,
+            } for index in range(size)
+        }
+        self.ready = asyncio.Event()
+        # Set while the client shuts down, the links refuse new tunnels.
+        self.draining = False
+
+    def link_made(self, link):
+        self.links[link.pool_index] = link
+
+        member = self.members[link.pool_index]
+        member['connected'] = True
+        member['connected_since'] = time.time()
+        member['connects'] += 1
+
+    def link_lost(self, link):
+        if self.links.get(link.pool_index) is not link:
+            return
+        del self.links[link.pool_index]
+
+        member = self.members[link.pool_index]
+        member['connected'] = False
+        member['authenticated'] = False
+        member['connected_since'] = None
+        member['losses'] += 1
+        self.ready.clear()
+
+    def link_authenticated(self, link):
+        if self.links.get(link.pool_index) is not link:
+            return
+        self.members[link.pool_index]['authenticated'] = True
+        if all(member['authenticated']
+               for member in self.members.values()):
+            self.ready.set()
+
+    def healthy_links(self):
+        return [link for link in self.links.values()
+                if link.transport is not None]
+
+    def get_stats(self):
+        return {
+            'size': self.size,
+            'healthy': len(self.healthy_links()),
+            'tunnels': sum(len(link.processors)
+                           for link in self.links.values()),
+            'paused': sum(1 for link in self.healthy_links()
+                          if link.reading_paused),
+            'processors_paused': sum(1 for link in self.links.values()
+                                     if link.processors_paused),
+            'paused_tunnels': sum(link.processors.paused_count()
+                                  for link in self.links.values()),
+            'members': self.members,
+        }
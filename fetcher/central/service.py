@@ -1,51 +1,460 @@
+import time
+import asyncio
+import msgpack
+
+from hpxclient import consts
+from hpxclient import metrics
 from hpxclient import protocols
 from hpxclient import settings
+from hpxclient import shaping
 
 from hpxclient import producers
+from hpxclient.fetcher.central import compression as fetcher_central_compression
 from hpxclient.fetcher.central import consumers
+from hpxclient.fetcher.central import pool as fetcher_central_pool
+from hpxclient.fetcher.central import session as fetcher_central_session
+from hpxclient.fetcher.central import utils as fetcher_central_utils
 
 
 class CentralFetcherProtocol(protocols.MsgpackReconnectingProtocol):
+    LINK_NAME = 'fetcher'
     REGISTERED_CONSUMERS = [
+        consumers.AuthResponseConsumer,
         consumers.InitConnConsumer,
         consumers.TransferDataConsumer,
-        consumers.CloseConnConsumer
+        consumers.CloseConnConsumer,
+        consumers.AckConsumer
     ]
 
-    def __init__(self, email, password, public_key, secret_key):
-        super().__init__()
+    def __init__(self, email, password, public_key, secret_key,
+                 config=None, shaper=None):
+        super().__init__(config=config)
         self.email = email
         self.password = password
         self.public_key = public_key
         self.secret_key = secret_key
 
+        self.pool = None
+        self.pool_index = None
+
+        self.processors = fetcher_central_utils.ProcessorRegistry()
+        self._reaper_timer = None
+
+        # Processors stop reading while any reason is set.
+        self._processor_pause_reasons = set()
+
+        # Set when the server supports session resume, see
+        # fetcher.central.session.
+        self.session = None
+        self._resume_timer = None
+        # Tunnel messages received before the authentication response
+        # is processed, they belong to the session it starts or resumes.
+        self.auth_pending = True
+        self._early_received = 0
+        self.resume_ack_frames = int(self.config.RESUME_ACK_FRAMES)
+
+        # Bandwidth limits of the client, see shaping. The link stops
+        # reading while the global download ones are in debt.
+        self.shaper = shaper if shaper is not None else shaping.get_shaper()
+        self.download_buckets = self.shaper.download_buckets
+        self.download_limited = False
+
+        self._payload_allocations = metrics.BUFFER_ALLOCATIONS.labels(
+            'payload')
+
+        # Set when the server picked a codec to compress the tunnel
+        # data with, see fetcher.central.compression.
+        self.compression = None
+
+    def get_link_name(self):
+        if self.pool_index is None:
+            return self.LINK_NAME
+        return '%s-%s' % (self.LINK_NAME, self.pool_index)
+
     def connection_made(self, transport):
+        transport.set_write_buffer_limits(
+            high=int(self.config.FETCHER_WRITE_BUFFER_HIGH),
+            low=int(self.config.FETCHER_WRITE_BUFFER_LOW))
+        self.queue_high = int(self.config.FETCHER_QUEUE_HIGH)
+        self.queue_low = int(self.config.FETCHER_QUEUE_LOW)
+        self.bulk_high = int(self.config.FETCHER_BULK_QUEUE_HIGH)
+        self.bulk_low = int(self.config.FETCHER_BULK_QUEUE_LOW)
         super().connection_made(transport)
 
+        if self.pool:
+            self.pool.link_made(self)
+
+        self.schedule_idle_reaper()
+
+        previous, self.previous = self.previous, None
+        if previous is not None and previous.session is not None:
+            self.take_over(previous)
+
+        session = self.session
         self.write_data(
             producers.AuthRequestProducer(
                 email=self.email,
                 password=self.password,
                 public_key=self.public_key,
-                secret_key=self.secret_key
+                secret_key=self.secret_key,
+                protocol_version=consts.PROTOCOL_VERSION,
+                resume=str(self.config.SESSION_RESUME) == "True" or None,
+                session_id=session.session_id if session else None,
+                received=session.received if session else None,
+                compression=self.get_offered_codecs()
             )
         )
 
-    def processor_closed(self, conn_id):
-        self.write_data(producers.CloseConnProducer(conn_id))
+    def connection_lost(self, exc):
+        if self._reaper_timer is not None:
+            self._reaper_timer.cancel()
+            self._reaper_timer = None
+
+        if self.session is not None and not self.stopped:
+            # Keep the tunnels for the next link to resume them. What
+            # was received is processed and what is queued to be sent
+            # is kept in the session, to stay in line with the counts.
+            self.process_queued_messages()
+            self.pause_processors('link')
+            if self.session.lost_at is None:
+                self.session.lost_at = time.monotonic()
+            while self._bulk:
+                _, parts, _ = self._bulk.pop()
+                self.send_conn_frame(parts)
+            remaining = (self.session.lost_at
+                         + float(self.config.RESUME_TIMEOUT)
+                         - time.monotonic())
+            self._resume_timer = protocols.get_scheduler().call_later(
+                max(remaining, 0), self.resume_expired)
+        else:
+            self.processors.close_all()
+
+        if self.pool:
+            self.pool.link_lost(self)
+        super().connection_lost(exc)
+
+    def take_over(self, previous):
+        """ Takes the session and the tunnels of the lost link `previous`
+        until the server answers whether the session is resumed.
+        """
+        if previous._resume_timer is not None:
+            previous._resume_timer.cancel()
+            previous._resume_timer = None
+
+        self.session, previous.session = previous.session, None
+        self.compression, previous.compression = previous.compression, None
+        if self.compression is not None:
+            self.compression.link = self
+        self.processors, previous.processors = (previous.processors,
+                                                self.processors)
+        self._processor_pause_reasons.add('link')
+        for processor in self.get_processors():
+            processor.attach(self)
+
+    def stop(self):
+        super().stop()
+        if self._resume_timer is not None:
+            # Lost, with the tunnels waiting for a resume.
+            self._resume_timer.cancel()
+            self._resume_timer = None
+            self.session = None
+            self.processors.close_all()
+
+    def resume_expired(self):
+        self._resume_timer = None
+        if self.session is None:
+            return
+        print('Session not resumed in time, closing %s tunnels'
+              % len(self.processors))
+        self.session = None
+        self.processors.close_all()
+
+    def auth_succeeded(self, data):
+        self.auth_pending = False
+        early_received, self._early_received = self._early_received, 0
+        if self.pool:
+            self.pool.link_authenticated(self)
+
+        session = self.session
+        if session is not None:
+            self.session = None
+            if data.get(b'resumed'):
+                print('Session resumed [session_id=%s]' % session.session_id)
+                session.received += early_received
+                self.resume_session(session, data.get(b'received', 0))
+                return
+            print('Session not resumed, closing %s tunnels'
+                  % len(self.processors))
+            self.processors.close_all()
+            self.resume_processors('link')
+
+        self.compression = None
+        codec = data.get(b'compression')
+        if (codec is not None and self.protocol_version >= 2
+                and codec.decode() in fetcher_central_compression.CODECS):
+            self.compression = fetcher_central_compression.LinkCompression(
+                self, codec.decode())
+
+        session_id = data.get(b'session_id')
+        if (data.get(b'resume') and session_id is not None
+                and str(self.config.SESSION_RESUME) == "True"):
+            self.session = fetcher_central_session.Session(
+                session_id, int(self.config.RESUME_BUFFER_SIZE))
+            self.session.received = early_received
+
+    def resume_session(self, session, received):
+        """ Sends again what the server didn't get before the drop. """
+        self.session = session
+        session.lost_at = None
+        session.ack(received)
+        for parts in session.unacked_frames():
+            self.write_frame(*parts)
+
+        if session.is_full():
+            self.pause_processors('resume')
+        self.resume_processors('link')
+
+    def ack_received(self, received):
+        session = self.session
+        if session is None:
+            return
+        session.ack(received)
+        if not session.is_full():
+            self.resume_processors('resume')
+
+    def send_ack(self):
+        session = self.session
+        if session is None or session.received == session.received_acked:
+            return
+        session.received_acked = session.received
+        self.write_data(producers.AckProducer(session.received))
+
+    def messages_received(self, messages, size):
+        super().messages_received(messages, size)
+        if self.download_buckets:
+            bucket = shaping.consume(self.download_buckets, size)
+            if bucket is not None and not self.download_limited:
+                self.download_limited = True
+                self.pause_reading('rate')
+                bucket.wait(self.download_allowed)
+
+    def download_allowed(self):
+        self.download_limited = False
+        self.resume_reading('rate')
+
+    def process_msg(self, message):
+        # Counted in arrival order, the order the server sent them in.
+        if message[b'kind'] in fetcher_central_session.SESSION_KINDS:
+            self.session_message_received()
+        super().process_msg(message)
+
+    def session_message_received(self):
+        if self.auth_pending:
+            self._early_received += 1
+            return
+
+        session = self.session
+        if session is None:
+            return
+        session.received += 1
+        if session.received - session.received_acked >= self.resume_ack_frames:
+            self.send_ack()
+
+    def heartbeat(self):
+        super().heartbeat()
+        self.send_ack()
+
+    def schedule_idle_reaper(self):
+        idle_timeout = float(self.config.PROCESSOR_IDLE_TIMEOUT)
+        if idle_timeout:
+            self._reaper_timer = protocols.get_scheduler().call_later(
+                idle_timeout / 2, self.reap_idle_processors)
+
+    def reap_idle_processors(self):
+        self._reaper_timer = None
+        if self.transport is None:
+            return
+        self.processors.reap_idle(float(self.config.PROCESSOR_IDLE_TIMEOUT))
+        self.schedule_idle_reaper()
+
+    def get_processors(self):
+        return self.processors.values()
+
+    @property
+    def processors_paused(self):
+        return bool(self._processor_pause_reasons)
+
+    def pause_processors(self, reason):
+        if reason in self._processor_pause_reasons:
+            return
+        self._processor_pause_reasons.add(reason)
+        if len(self._processor_pause_reasons) == 1:
+            for processor in self.get_processors():
+                processor.pause_reading()
+
+    def resume_processors(self, reason):
+        if reason not in self._processor_pause_reasons:
+            return
+        self._processor_pause_reasons.discard(reason)
+        if not self._processor_pause_reasons:
+            # The least recently active tunnels read first, and the ones
+            # with data still queued wait for it to be sent, so that all
+            # of them get their turn to fill the queue.
+            processors = sorted(self.get_processors(),
+                                key=lambda processor: processor.last_activity)
+            for processor in processors:
+                if not self.conn_held(processor.conn_id):
+                    processor.resume_reading()
+
+    def pause_bulk_writers(self):
+        self.pause_processors('write')
+
+    def resume_bulk_writers(self):
+        self.resume_processors('write')
+
+    def bulk_conn_drained(self, conn_id):
+        self.resume_conn(conn_id)
+
+    def conn_held(self, conn_id):
+        """ Whether the upstream of the tunnel waits for its data queued
+        on the link, or being compressed, to be sent.
+        """
+        return (conn_id in self._bulk
+                or (self.compression is not None
+                    and self.compression.is_held(conn_id)))
+
+    def resume_conn(self, conn_id):
+        """ Resumes reading the upstream of the tunnel, unless the link
+        or the data of the tunnel hold it back.
+        """
+        if self.processors_paused or self.conn_held(conn_id):
+            return
+        processor = self.processors.get(conn_id)
+        if processor is not None:
+            processor.resume_reading()
+
+    def get_flow_stats(self):
+        stats = super().get_flow_stats()
+        processors = self.get_processors()
+        stats['processors'] = len(processors)
+        stats['processors_reading_paused'] = sum(
+            1 for processor in processors if processor.reading_paused)
+        stats['processors_writing_paused'] = sum(
+            1 for processor in processors if processor.writing_paused)
+        stats['processors_rate_limited'] = sum(
+            1 for processor in processors
+            if processor.upload_limited or processor.download_limited)
+        stats['rate_limited'] = self.download_limited
+        stats['preconnect_buffer_size'] = (
+            self.processors.preconnect_buffer_size())
+        stats['session'] = self.session.get_stats() if self.session else None
+        stats['compression'] = (self.compression.get_stats()
+                                if self.compression else None)
+        return stats
+
+    def send_conn_frame(self, parts):
+        """ Writes a tunnel frame, kept until acknowledged when the
+        session can be resumed.
+        """
+        session = self.session
+        if session is not None:
+            session.record(parts)
+            if session.is_full():
+                self.pause_processors('resume')
+            if session.lost_at is not None:
+                # Sent in order with the replay once resumed.
+                return
+        self.write_frame(*parts)
+
+    def copy_data(self, data):
+        self._payload_allocations.inc()
+        return bytes(data)
+
+    def get_offered_codecs(self):
+        codec = fetcher_central_compression.get_offered_codec(self.config)
+        if codec is None:
+            return None
+        return [codec]
+
+    def processor_closed(self, conn_id, error=None):
+        if (self.compression is not None
+                and self.compression.defer_close(conn_id, error)):
+            return
+        self.send_close(conn_id, error)
+
+    def send_close(self, conn_id, error=None):
+        producer = producers.CloseConnProducer(conn_id, error=error)
+        self.write_conn_frame(
+            conn_id,
+            (msgpack.packb(producer.msg2str(), use_bin_type=False),),
+            bulk=False)
 
     def processor_data_received(self, conn_id, data):
-        self.write_data(producers.TransferDataProducer(conn_id, data))
+        if (self.compression is not None
+                and protocols.can_encode_binary(conn_id)):
+            self.compression.send_data(conn_id, data)
+            return
+        self.send_data(conn_id, data)
+
+    def send_data(self, conn_id, data, compressed=False):
+        """ Sends tunnel data. A memoryview `data` is only valid during
+        the call, see BufferedLocalProcessorProtocol.
+        """
+        if self.protocol_version >= 2 and protocols.can_encode_binary(conn_id):
+            kind = (consts.BINARY_COMPRESSED_TRANS_DATA_KIND if compressed
+                    else consts.BINARY_TRANS_DATA_KIND)
+            if (self._wbuff is not None and self.session is None
+                    and not self.writing_paused and conn_id not in self._bulk):
+                self.write_trans_data_frame(conn_id, data, kind)
+                return
+            if type(data) is memoryview:
+                # Kept until sent or acknowledged.
+                data = self.copy_data(data)
+            self.write_conn_frame(conn_id, (
+                protocols.encode_binary_trans_data_header(
+                    conn_id, len(data), kind=kind),
+                data))
+            return
+        if type(data) is memoryview:
+            data = self.copy_data(data)
+        producer = producers.TransferDataProducer(conn_id, data)
+        self.write_conn_frame(
+            conn_id,
+            (msgpack.packb(producer.msg2str(), use_bin_type=False),))
+
+
+class BufferedCentralFetcherProtocol(CentralFetcherProtocol,
+                                     asyncio.BufferedProtocol):
+    """ Fetcher link reading into its frame decoder buffer and writing
+    its frames in one batch, see BUFFERED_IO.
+    """
 
+    def get_buffer(self, sizehint):
+        return self._decoder.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self.messages_received(self._decoder.buffer_updated(nbytes), nbytes)
+
+
+def get_protocol_factory(email=None, password=None, public_key=None,
+                         secret_key=None, pool=None, pool_index=None,
+                         config=None, shaper=None):
+    protocol_cls = CentralFetcherProtocol
+    if str((config or settings).BUFFERED_IO) == "True":
+        protocol_cls = BufferedCentralFetcherProtocol
 
-def get_protocol_factory(email=None, password=None, public_key=None, secret_key=None):
     def wrapper():
-        return CentralFetcherProtocol(
+        protocol = protocol_cls(
             email=email,
             password=password,
             public_key=public_key,
-            secret_key=secret_key
+            secret_key=secret_key,
+            config=config,
+            shaper=shaper
         )
+        protocol.pool = pool
+        protocol.pool_index = pool_index
+        return protocol
     return wrapper
 
 
@@ -54,15 +463,32 @@ async def start_client(
         password=None,
         public_key=None,
         secret_key=None,
-        ssl=None):
+        ssl=None,
+        pool_size=None,
+        config=None,
+        shaper=None):
 
-    return await CentralFetcherProtocol.create_conn(
-        proto_factory=get_protocol_factory(
-            email=email,
-            password=password,
-            public_key=public_key,
-            secret_key=secret_key),
-        host=settings.PROXY_FETCHER_SERVER_IP,
-        port=settings.PROXY_FETCHER_SERVER_PORT,
-        ssl=ssl
-    )
+    if config is None:
+        config = settings
+    if pool_size is None:
+        pool_size = int(config.FETCHER_POOL_SIZE)
+    pool = fetcher_central_pool.FetcherPool(pool_size)
+
+    await asyncio.gather(*[
+        CentralFetcherProtocol.create_conn(
+            proto_factory=get_protocol_factory(
+                email=email,
+                password=password,
+                public_key=public_key,
+                secret_key=secret_key,
+                pool=pool,
+                pool_index=pool_index,
+                config=config,
+                shaper=shaper),
+            host=config.PROXY_FETCHER_SERVER_IP,
+            port=config.PROXY_FETCHER_SERVER_PORT,
+            ssl=ssl,
+            config=config
+        ) for pool_index in range(pool_size)
+    ])
+    return pool
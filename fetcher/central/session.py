@@ -0,0 +1,70 @@
+import collections
+
+from hpxclient import consts
+
+
+# Messages that belong to the tunnels of a session. They are counted
+# and acknowledged on both sides, and replayed after a resume.
+SESSION_KINDS = frozenset([
+    consts.INIT_CONN_KIND.encode(),
+    consts.TRANS_DATA_KIND.encode(),
+    consts.CLOSE_CONN_KIND.encode(),
+])
+
+
+class Session(object):
+    """ Resumable state of a fetcher link session.
+
+    Outgoing tunnel frames are kept until the server acknowledges them,
+    so that they can be sent again on the new link when the session is
+    resumed. Frames are numbered by their order on the session: `sent`
+    and `received` count the frames sent and received so far, `acked`
+    the sent ones acknowledged by the server.
+    """
+
+    def __init__(self, session_id, buffer_size):
+        self.session_id = session_id
+        self.buffer_size = buffer_size
+
+        self.sent = 0
+        self.acked = 0
+        self.received = 0
+        self.received_acked = 0
+
+        # When the link carrying the session was lost.
+        self.lost_at = None
+
+        self._unacked = collections.deque()
+        self.unacked_size = 0
+
+    def record(self, parts):
+        """ Keeps the parts of a sent frame until acknowledged. """
+        size = 0
+        for part in parts:
+            size += len(part)
+        self._unacked.append((parts, size))
+        self.unacked_size += size
+        self.sent += 1
+
+    def ack(self, received):
+        """ The server got the first `received` frames of the session. """
+        count = min(received - self.acked, len(self._unacked))
+        for _ in range(count):
+            _, size = self._unacked.popleft()
+            self.unacked_size -= size
+        self.acked += max(count, 0)
+
+    def is_full(self):
+        return self.unacked_size >= self.buffer_size
+
+    def unacked_frames(self):
+        return [parts for parts, _ in self._unacked]
+
+    def get_stats(self):
+        return {
+            'sent': self.sent,
+            'acked': self.acked,
+            'received': self.received,
+            'unacked_frames': len(self._unacked),
+            'unacked_size': self.unacked_size,
+        }
@@ -1,27 +1,86 @@
-PROCESSORS = {}
+import time
+import weakref
 
+from hpxclient import metrics
 
-def get_processors():
-    from hpxclient.fetcher.central import utils
-    return utils.PROCESSORS
 
+# Registries of the live fetcher links, for the metrics.
+REGISTRIES = weakref.WeakSet()
 
-def get_processor(conn_id):
-    return get_processors().get(conn_id)
 
+class ProcessorRegistry(object):
+    """ The processors (tunnels) owned by one fetcher link, by conn_id. """
 
-def add_processor(conn_id, processor):
-    if get_processor(conn_id):
-        raise Exception('Processor already exists for connection %s' %conn_id)
+    def __init__(self):
+        self._processors = {}
+        REGISTRIES.add(self)
 
-    processors = get_processors()
-    processors[conn_id] = processor
-    return processor
+    def __len__(self):
+        return len(self._processors)
 
+    def values(self):
+        return list(self._processors.values())
 
-def remove_processor(conn_id):
-    if not get_processor(conn_id):
-        return
+    def get(self, conn_id):
+        return self._processors.get(conn_id)
 
-    processors = get_processors()
-    del processors[conn_id]
+    def add(self, conn_id, processor):
+        if conn_id in self._processors:
+            raise Exception('Processor already exists for connection %s'
+                            % conn_id)
+        self._processors[conn_id] = processor
+        return processor
+
+    def remove(self, conn_id, processor=None):
+        """ Removes the processor of conn_id, only if it is `processor`
+        when given.
+        """
+        current = self._processors.get(conn_id)
+        if current is None:
+            return None
+        if processor is not None and current is not processor:
+            return None
+        del self._processors[conn_id]
+        return current
+
+    def close(self, conn_id):
+        processor = self.remove(conn_id)
+        if processor is not None:
+            processor.close()
+        return processor
+
+    def close_all(self):
+        """ Tears down every tunnel, e.g. when the link is lost. """
+        for conn_id in list(self._processors):
+            self.close(conn_id)
+
+    def paused_count(self):
+        """ The tunnels not reading their upstream connection. """
+        return sum(1 for processor in self._processors.values()
+                   if processor.reading_paused or processor.upload_limited)
+
+    def preconnect_buffer_size(self):
+        return sum(processor.buff_size
+                   for processor in self._processors.values())
+
+    def reap_idle(self, idle_timeout, now=None):
+        """ Closes the tunnels without traffic for `idle_timeout` seconds.
+        Returns the number of tunnels closed.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        idle = [conn_id for conn_id, processor in self._processors.items()
+                if now - processor.last_activity > idle_timeout]
+        for conn_id in idle:
+            print('Closing idle connection [conn_id=%s]' % conn_id)
+            self.close(conn_id)
+        return len(idle)
+
+
+metrics.ACTIVE_TUNNELS.labels().set_function(
+    lambda: sum(len(registry) for registry in REGISTRIES))
+metrics.PAUSED_TUNNELS.labels().set_function(
+    lambda: sum(registry.paused_count() for registry in REGISTRIES))
+metrics.PRECONNECT_BUFFER_BYTES.labels().set_function(
+    lambda: sum(registry.preconnect_buffer_size() for registry in REGISTRIES))
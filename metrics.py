@@ -0,0 +1,251 @@
+""" Minimal in-process metrics, exported in the Prometheus text format.
+
+Hot paths keep a reference to the labelled child returned by
+`metric.labels(...)` and only pay for an attribute increment per event.
+"""
+import bisect
+import asyncio
+
+
+ENABLED = True
+
+REGISTRY = []
+
+
+class Value(object):
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def unset_function(self, function):
+        """ Drops `function` unless another one was set since. """
+        if self.function == function:
+            self.function = None
+
+    def get(self):
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+
+class HistogramValue(object):
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class NullValue(object):
+    """ Returned by every metric while metrics are disabled. """
+    __slots__ = ()
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def set_function(self, function):
+        pass
+
+    def unset_function(self, function):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+NULL_VALUE = NullValue()
+
+
+class Metric(object):
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        REGISTRY.append(self)
+
+    def _new_child(self):
+        return Value()
+
+    def labels(self, *labelvalues):
+        if not ENABLED:
+            return NULL_VALUE
+
+        key = tuple(str(value) for value in labelvalues)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def remove(self, *labelvalues):
+        self._children.pop(tuple(str(value) for value in labelvalues), None)
+
+    def _format_labels(self, labelvalues, extra=()):
+        pairs = list(zip(self.labelnames, labelvalues)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join(
+            '%s="%s"' % (name, value.replace('\\', '\\\\').replace('"', '\\"'))
+            for name, value in pairs)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s %s' % (self.name, self.TYPE)]
+        for labelvalues, child in sorted(self._children.items()):
+            lines.extend(self._render_child(labelvalues, child))
+        return lines
+
+    def _render_child(self, labelvalues, child):
+        return ['%s%s %s' % (self.name, self._format_labels(labelvalues),
+                             child.get())]
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                       1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=None):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets or self.DEFAULT_BUCKETS)
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def _render_child(self, labelvalues, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), child.counts):
+            cumulative += count
+            lines.append('%s_bucket%s %s' % (
+                self.name,
+                self._format_labels(labelvalues, [('le', str(bound))]),
+                cumulative))
+        labels = self._format_labels(labelvalues)
+        lines.append('%s_sum%s %s' % (self.name, labels, child.sum))
+        lines.append('%s_count%s %s' % (self.name, labels, child.count))
+        return lines
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+LINK_BYTES_IN = Counter(
+    'hpx_link_bytes_received_total', 'Bytes received on a server link.',
+    ['client', 'link'])
+LINK_BYTES_OUT = Counter(
+    'hpx_link_bytes_sent_total', 'Bytes sent on a server link.',
+    ['client', 'link'])
+LINK_QUEUE_SIZE = Gauge(
+    'hpx_link_queue_size', 'Received messages waiting to be processed.',
+    ['client', 'link'])
+LINK_RTT_SECONDS = Gauge(
+    'hpx_link_rtt_seconds', 'Smoothed ping round trip time of the link.',
+    ['client', 'link'])
+LINK_RECONNECTS = Counter(
+    'hpx_link_reconnects_total', 'Server link losses followed by a reconnect.',
+    ['client', 'link'])
+MESSAGES_RECEIVED = Counter(
+    'hpx_messages_received_total', 'Messages received, per kind.',
+    ['kind'])
+ACTIVE_TUNNELS = Gauge(
+    'hpx_active_tunnels', 'Tunnels with a registered processor.')
+PAUSED_LINKS = Gauge(
+    'hpx_paused_links',
+    'Connected server links not read, held by flow control.')
+PAUSED_TUNNELS = Gauge(
+    'hpx_paused_tunnels',
+    'Tunnels not reading their upstream connection, held by flow control '
+    'or the bandwidth limits.')
+PRECONNECT_BUFFER_BYTES = Gauge(
+    'hpx_preconnect_buffer_bytes',
+    'Tunnel data buffered while the upstream connection is made.')
+UPSTREAM_CONNECT_SECONDS = Histogram(
+    'hpx_upstream_connect_seconds', 'Duration of successful upstream connects.')
+UPSTREAM_CONNECT_FAILURES = Counter(
+    'hpx_upstream_connect_failures_total', 'Failed upstream connects.',
+    ['reason'])
+TLS_HANDSHAKE_SECONDS = Histogram(
+    'hpx_tls_handshake_seconds',
+    'Time to connect a server link and complete its TLS handshake.',
+    ['resumed'])
+TUNNEL_FIRST_BYTE_SECONDS = Histogram(
+    'hpx_tunnel_first_byte_seconds',
+    'Time from INIT_CONN to the first upstream byte.')
+BUFFER_ALLOCATIONS = Counter(
+    'hpx_buffer_allocations_total',
+    'Buffers allocated to carry tunnel data: read buffers, payload copies '
+    'and write batches.', ['kind'])
+
+
+class MetricsHTTPProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+        self.buff = b''
+
+    def data_received(self, data):
+        self.buff += data
+        if b'\r\n\r\n' not in self.buff:
+            return
+
+        request_line = self.buff.split(b'\r\n', 1)[0].split()
+        if len(request_line) < 2 or request_line[1] != b'/metrics':
+            self.respond(b'404 Not Found', b'Not found\n')
+            return
+        self.respond(b'200 OK', render().encode())
+
+    def respond(self, status, body):
+        self.transport.write(
+            b'HTTP/1.0 ' + status + b'\r\n'
+            b'Content-Type: text/plain; version=0.0.4\r\n'
+            b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+            b'\r\n' + body)
+        self.transport.close()
+
+
+async def start_http_server(host, port):
+    loop = asyncio.get_event_loop()
+    server = await loop.create_server(MetricsHTTPProtocol, host, port)
+    print('Metrics available at http://%s:%s/metrics' % (host, port))
+    return server
@@ -1,7 +1,27 @@
 from hpxclient import protocols, consts
 
 
+class AuthResponseConsumer(protocols.MessageConsumer):
+    __slots__ = ()
+    KIND = consts.AUTH_KIND
+
+    def process(self):
+        if not isinstance(self.data, dict):
+            print("[AuthResponseConsumer] Malformed response: %r"
+                  % (self.data,))
+            self.protocol.close()
+            return
+
+        error = self.data.get(b'error')
+        if error:
+            if isinstance(error, bytes):
+                error = error.decode(errors='replace')
+            print("[AuthResponseConsumer] Authentication failed: %s" % error)
+            self.protocol.close()
+
+
 class InfoBalanceConsumer(protocols.MessageConsumer):
+    __slots__ = ()
     KIND = consts.INFO_BALANCE_KIND
 
     def process(self):
@@ -10,6 +30,7 @@ class InfoBalanceConsumer(protocols.MessageConsumer):
 
 
 class InfoVersionConsumer(protocols.MessageConsumer):
+    __slots__ = ()
     KIND = consts.INFO_VERSION_KIND
 
     def process(self):
@@ -6,7 +6,9 @@ from hpxclient.mng import consumers
 
 
 class ManagerProtocol(protocols.MsgpackReconnectingProtocol):
+    LINK_NAME = 'mng'
     REGISTERED_CONSUMERS = [
+        consumers.AuthResponseConsumer,
         consumers.InfoBalanceConsumer,
         consumers.InfoVersionConsumer
     ]
@@ -14,9 +16,9 @@ class ManagerProtocol(protocols.MsgpackReconnectingProtocol):
     def __init__(self,
                  email=None, password=None,
                  public_key=None, secret_key=None,
-                 message_handler=None):
+                 message_handler=None, config=None):
 
-        super().__init__()
+        super().__init__(config=config)
 
         self.email = email
         self.password = password
@@ -42,7 +44,8 @@ def get_client_protocol_factory(
         password=None,
         public_key=None,
         secret_key=None,
-        message_handler=None):
+        message_handler=None,
+        config=None):
 
     def wrapper():
         return ManagerProtocol(
@@ -50,7 +53,8 @@ def get_client_protocol_factory(
             password=password,
             public_key=public_key,
             secret_key=secret_key,
-            message_handler=message_handler
+            message_handler=message_handler,
+            config=config
         )
     return wrapper
 
@@ -61,20 +65,26 @@ async def start_client(
         public_key=None,
         secret_key=None,
         message_handler=None,
-        ssl=None):
+        ssl=None,
+        config=None):
 
+    if config is None:
+        config = settings
     manager_factory = get_client_protocol_factory(
         email=email,
         password=password,
         public_key=public_key,
         secret_key=secret_key,
-        message_handler=message_handler
+        message_handler=message_handler,
+        config=config
     )
 
-    await ManagerProtocol.create_conn(
+    _, protocol = await ManagerProtocol.create_conn(
         manager_factory,
-        host=settings.PROXY_MNG_SERVER_IP,
-        port=settings.PROXY_MNG_SERVER_PORT,
-        ssl=ssl
+        host=config.PROXY_MNG_SERVER_IP,
+        port=config.PROXY_MNG_SERVER_PORT,
+        ssl=ssl,
+        config=config
     )
+    return protocol
 
@@ -0,0 +1,128 @@
+import asyncio
+import collections
+
+
+class DeficitRoundRobin(object):
+    """ Per-connection FIFOs served in deficit round-robin order.
+
+    Every round a connection may take up to `quantum` bytes (plus what it
+    didn't use of the previous rounds while it kept data queued), so a
+    connection with big frames doesn't starve the ones with small frames
+    and each connection's items keep their order.
+    """
+
+    def __init__(self, quantum):
+        self.quantum = quantum
+        self._queues = {}
+        self._deficits = {}
+        self._active = collections.deque()
+        self._in_turn = False
+        self._count = 0
+        self.size = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, conn_id):
+        return conn_id in self._queues
+
+    def push(self, conn_id, item, size):
+        queue = self._queues.get(conn_id)
+        if queue is None:
+            queue = self._queues[conn_id] = collections.deque()
+            self._deficits[conn_id] = 0
+            self._active.append(conn_id)
+        queue.append((item, size))
+        self._count += 1
+        self.size += size
+
+    def pop(self):
+        """ Returns the next (conn_id, item, size). """
+        active = self._active
+        queues = self._queues
+        deficits = self._deficits
+        while True:
+            conn_id = active[0]
+            if not self._in_turn:
+                deficits[conn_id] += self.quantum
+                self._in_turn = True
+
+            queue = queues[conn_id]
+            item, size = queue[0]
+            if size <= deficits[conn_id]:
+                queue.popleft()
+                self._count -= 1
+                self.size -= size
+                if queue:
+                    deficits[conn_id] -= size
+                else:
+                    del queues[conn_id]
+                    del deficits[conn_id]
+                    active.popleft()
+                    self._in_turn = False
+                return conn_id, item, size
+
+            active.rotate(-1)
+            self._in_turn = False
+
+    def clear(self):
+        self._queues.clear()
+        self._deficits.clear()
+        self._active.clear()
+        self._in_turn = False
+        self._count = 0
+        self.size = 0
+
+
+class PriorityMessageQueue(object):
+    """ Received messages waiting to be processed.
+
+    Control messages go ahead of the queued bulk ones (`bulk_kind`),
+    which are served per conn_id with DeficitRoundRobin. A control
+    message for a conn_id that has bulk messages queued waits behind
+    them, so every connection sees its messages in arrival order.
+    Implements the part of the asyncio.Queue interface the protocols use.
+    """
+
+    def __init__(self, bulk_kind, quantum):
+        self.bulk_kind = bulk_kind
+        self._control = collections.deque()
+        self._bulk = DeficitRoundRobin(quantum)
+        self._getter = None
+
+    def qsize(self):
+        return len(self._control) + len(self._bulk)
+
+    def empty(self):
+        return not self._control and not self._bulk
+
+    def put_nowait(self, message):
+        data = message[b'data']
+        if message[b'kind'] == self.bulk_kind:
+            self._bulk.push(data[b'conn_id'], message, len(data[b'data']))
+        else:
+            conn_id = data.get(b'conn_id') if isinstance(data, dict) else None
+            if conn_id is not None and conn_id in self._bulk:
+                self._bulk.push(conn_id, message, 0)
+            else:
+                self._control.append(message)
+
+        getter = self._getter
+        if getter is not None and not getter.done():
+            getter.set_result(None)
+
+    def get_nowait(self):
+        if self._control:
+            return self._control.popleft()
+        if self._bulk:
+            return self._bulk.pop()[1]
+        raise asyncio.QueueEmpty()
+
+    async def get(self):
+        while self.empty():
+            self._getter = asyncio.get_event_loop().create_future()
+            try:
+                await self._getter
+            finally:
+                self._getter = None
+        return self.get_nowait()
@@ -0,0 +1,253 @@
+import time
+import errno
+import socket
+import asyncio
+import collections
+
+from hpxclient import metrics
+
+
+REFUSED = 'refused'
+TIMEOUT = 'timeout'
+DNS = 'dns'
+UNREACHABLE = 'unreachable'
+OVERLOADED = 'overloaded'
+ERROR = 'error'
+
+_UNREACHABLE_ERRNOS = (errno.ENETUNREACH, errno.EHOSTUNREACH)
+
+
+class ConnectError(Exception):
+    def __init__(self, reason, message=''):
+        super().__init__(reason, message)
+        self.reason = reason
+        self.message = message
+
+    def __str__(self):
+        return '%s: %s' % (self.reason, self.message)
+
+
+class UpstreamConnector(object):
+    """ Opens the upstream connections of the tunnels.
+
+    Hosts are resolved through `resolver` and their addresses raced
+    RFC 8305 style: a new attempt starts every `happy_eyeballs_delay`
+    seconds, or as soon as the previous one fails, alternating address
+    families, and the first one to connect wins. The whole connect is
+    bounded by `connect_timeout`.
+
+    At most `max_connecting` connects (and `max_connecting_per_host`
+    per host) run at a time, the rest wait in a FIFO of at most
+    `max_waiting` entries; beyond that connects are rejected as
+    overloaded. A connect only waits behind those to its own host, or
+    for a slot when all `max_connecting` are taken. Failures raise
+    ConnectError with a classified reason.
+    """
+
+    def __init__(self, resolver, connect_timeout=10,
+                 happy_eyeballs_delay=0.25, max_connecting=256,
+                 max_connecting_per_host=16, max_waiting=1024):
+        self.resolver = resolver
+        self.connect_timeout = connect_timeout
+        self.happy_eyeballs_delay = happy_eyeballs_delay
+        self.max_connecting = max_connecting
+        self.max_connecting_per_host = max_connecting_per_host
+        self.max_waiting = max_waiting
+
+        self.connecting = 0
+        self._host_connecting = {}
+        self._waiters = collections.deque()
+        self._host_waiting = collections.Counter()
+
+        self.connects = 0
+        self.failures = collections.Counter()
+
+    async def connect(self, protocol_factory, host, port):
+        await self._acquire(host)
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(
+                self._connect(protocol_factory, host, port),
+                self.connect_timeout)
+        except asyncio.TimeoutError:
+            self._failed(TIMEOUT)
+            raise ConnectError(TIMEOUT, '%s:%s' % (host, port))
+        except ConnectError as e:
+            self._failed(e.reason)
+            raise
+        finally:
+            self._release(host)
+
+        metrics.UPSTREAM_CONNECT_SECONDS.labels().observe(
+            time.monotonic() - start)
+        return result
+
+    def _failed(self, reason):
+        self.failures[reason] += 1
+        metrics.UPSTREAM_CONNECT_FAILURES.labels(reason).inc()
+
+    async def _connect(self, protocol_factory, host, port):
+        loop = asyncio.get_event_loop()
+        try:
+            addresses = await self.resolver.resolve(host)
+        except (OSError, ValueError) as e:
+            # ValueError: UnicodeError of names failing the IDNA encoding.
+            raise ConnectError(DNS, str(e))
+
+        sock = await self._race(interleave_families(addresses), port)
+        try:
+            transport, protocol = await loop.create_connection(
+                protocol_factory, sock=sock)
+        except BaseException:
+            sock.close()
+            raise
+
+        self.connects += 1
+        return transport, protocol
+
+    async def _race(self, addresses, port):
+        remaining = collections.deque(addresses)
+        pending = set()
+        errors = []
+        try:
+            while remaining or pending:
+                timeout = None
+                if remaining:
+                    family, address = remaining.popleft()
+                    pending.add(asyncio.ensure_future(
+                        open_socket(family, address, port)))
+                    if remaining:
+                        timeout = self.happy_eyeballs_delay
+
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED)
+
+                socks = []
+                for task in done:
+                    if task.exception() is None:
+                        socks.append(task.result())
+                    else:
+                        errors.append(task.exception())
+                if socks:
+                    for sock in socks[1:]:
+                        sock.close()
+                    return socks[0]
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise classify_errors(errors)
+
+    def _can_start(self, host):
+        return (self.connecting < self.max_connecting
+                and self._host_connecting.get(host, 0)
+                < self.max_connecting_per_host)
+
+    def _start(self, host):
+        self.connecting += 1
+        self._host_connecting[host] = self._host_connecting.get(host, 0) + 1
+
+    async def _acquire(self, host):
+        if not self._host_waiting[host] and self._can_start(host):
+            self._start(host)
+            return
+
+        if len(self._waiters) >= self.max_waiting:
+            self._failed(OVERLOADED)
+            raise ConnectError(OVERLOADED, 'too many pending connects')
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append((host, waiter))
+        self._host_waiting[host] += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted already, give it back.
+                self._release(host)
+            else:
+                self._waiters.remove((host, waiter))
+                self._dequeued(host)
+            raise
+
+    def _dequeued(self, host):
+        self._host_waiting[host] -= 1
+        if not self._host_waiting[host]:
+            del self._host_waiting[host]
+
+    def _release(self, host):
+        self.connecting -= 1
+        self._host_connecting[host] -= 1
+        if not self._host_connecting[host]:
+            del self._host_connecting[host]
+
+        for item in list(self._waiters):
+            if self.connecting >= self.max_connecting:
+                break
+            waiter_host, waiter = item
+            if not self._can_start(waiter_host):
+                continue
+            self._waiters.remove(item)
+            self._dequeued(waiter_host)
+            self._start(waiter_host)
+            waiter.set_result(None)
+
+    def get_stats(self):
+        stats = {
+            'upstream_connecting': self.connecting,
+            'upstream_connect_waiting': len(self._waiters),
+            'upstream_connects': self.connects,
+        }
+        for reason, count in self.failures.items():
+            stats['upstream_failures_%s' % reason] = count
+        return stats
+
+
+async def open_socket(family, address, port):
+    loop = asyncio.get_event_loop()
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.setblocking(False)
+        await loop.sock_connect(sock, (address, port))
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def interleave_families(addresses):
+    by_family = collections.OrderedDict()
+    for family, address in addresses:
+        by_family.setdefault(family, collections.deque()).append(
+            (family, address))
+
+    result = []
+    queues = list(by_family.values())
+    while queues:
+        for queue in queues:
+            result.append(queue.popleft())
+        queues = [queue for queue in queues if queue]
+    return result
+
+
+def classify_error(error):
+    if isinstance(error, ConnectionRefusedError):
+        return REFUSED
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return TIMEOUT
+    if isinstance(error, OSError) and error.errno in _UNREACHABLE_ERRNOS:
+        return UNREACHABLE
+    return ERROR
+
+
+def classify_errors(errors):
+    if not errors:
+        return ConnectError(ERROR, 'no addresses')
+
+    reasons = [classify_error(error) for error in errors]
+    for reason in (REFUSED, UNREACHABLE, TIMEOUT):
+        if reason in reasons:
+            error = errors[reasons.index(reason)]
+            return ConnectError(reason, str(error))
+    return ConnectError(ERROR, str(errors[-1]))
@@ -1,50 +1,343 @@
+import time
 import asyncio
 
+from hpxclient import buffers
+from hpxclient import metrics
+from hpxclient import settings
+from hpxclient import shaping
+from hpxclient import resolver as hpxclient_resolver
+from hpxclient.processor.local import connector as processor_local_connector
+
+
+RESOLVER = None
+CONNECTOR = None
+
+
+def get_resolver_options():
+    return {
+        'ttl': float(settings.DNS_CACHE_TTL),
+        'negative_ttl': float(settings.DNS_NEGATIVE_TTL),
+        'max_size': int(settings.DNS_CACHE_SIZE),
+    }
+
+
+def get_connector_options():
+    return {
+        'connect_timeout': float(settings.UPSTREAM_CONNECT_TIMEOUT),
+        'happy_eyeballs_delay': float(settings.UPSTREAM_HAPPY_EYEBALLS_DELAY),
+        'max_connecting': int(settings.UPSTREAM_MAX_CONNECTING),
+        'max_connecting_per_host': int(
+            settings.UPSTREAM_MAX_CONNECTING_PER_HOST),
+        'max_waiting': int(settings.UPSTREAM_MAX_CONNECT_QUEUE),
+    }
+
+
+def get_resolver():
+    global RESOLVER
+    if RESOLVER is None:
+        RESOLVER = hpxclient_resolver.Resolver(**get_resolver_options())
+    return RESOLVER
+
+
+def get_connector():
+    global CONNECTOR
+    if CONNECTOR is None:
+        CONNECTOR = processor_local_connector.UpstreamConnector(
+            get_resolver(), **get_connector_options())
+    return CONNECTOR
+
+
+def reload_settings():
+    """ Applies the current settings to the resolver and the connector,
+    for the lookups and connects to come.
+    """
+    for instance, options in ((RESOLVER, get_resolver_options()),
+                              (CONNECTOR, get_connector_options())):
+        if instance is None:
+            continue
+        for name, value in options.items():
+            setattr(instance, name, value)
+
+
+class LocalProcessorProtocol(asyncio.BaseProtocol):
+    # Not an asyncio.Protocol, see ReconnectingProtocol.
 
-class LocalProcessorProtocol(asyncio.Protocol):
     def __init__(self, conn_id, fetcher_proto, loop=None):
         self.fetcher_proto = fetcher_proto
         self.conn_id = conn_id
+        config = fetcher_proto.config
 
         self.transport = None
-        self.buff = b''
+        self.connect_task = None
+
+        # Data received from the link before the upstream connection is
+        # made, flushed on connect.
+        self.buff = []
+        self.buff_size = 0
+        self.max_buff_size = int(config.PROCESSOR_PRECONNECT_BUFFER_SIZE)
+        self.buff_overflow_policy = config.PROCESSOR_PRECONNECT_OVERFLOW
+
+        self.reading_paused = False
+        self.writing_paused = False
+
+        # Bandwidth limits, see shaping. Reading the upstream stops while
+        # an upload bucket is in debt and the data for the upstream is
+        # held back while the tunnel download bucket is.
+        self.upload_buckets, self.download_buckets = (
+            fetcher_proto.shaper.tunnel_buckets())
+        self.upload_limited = False
+        self.download_limited = False
+        # Data received while the download bucket is in debt.
+        self.delayed = []
+        self.delayed_size = 0
+        self.close_delayed = False
+        self.max_delayed_size = int(config.PROCESSOR_WRITE_BUFFER_HIGH)
+        self.write_buffer_high = self.max_delayed_size
+        self.write_buffer_low = int(config.PROCESSOR_WRITE_BUFFER_LOW)
+
+        self.created_at = time.monotonic()
+        self.last_activity = self.created_at
+        self.first_byte_received = False
+        self.closed = False
+        self.close_reported = False
+
+        self._read_allocations = metrics.BUFFER_ALLOCATIONS.labels('read')
+
+    def connect(self, host, port):
+        self.connect_task = asyncio.ensure_future(self._connect(host, port))
+
+    async def _connect(self, host, port):
+        print("processing for host", host, port)
+        try:
+            await get_connector().connect(lambda: self, host, port)
+        except processor_local_connector.ConnectError as e:
+            print("Connection failed [conn_id=%s] %s" % (self.conn_id, e))
+            self.connect_task = None
+            self.reset(e.reason)
+        except Exception as e:
+            # Still report the close, not to leak the tunnel.
+            print("Connection error [conn_id=%s] %r" % (self.conn_id, e))
+            self.connect_task = None
+            self.reset(processor_local_connector.ERROR)
 
     def connection_made(self, transport):
         self.transport = transport
+        if self.closed:
+            transport.close()
+            return
+
+        transport.set_write_buffer_limits(
+            high=self.write_buffer_high, low=self.write_buffer_low)
+
+        # The fetcher link is congested already, don't read until
+        # it drains.
+        if self.fetcher_proto.processors_paused:
+            self.reading_paused = True
+        if self.reading_paused or self.upload_limited:
+            transport.pause_reading()
+
         if not self.buff:
             return
 
-        self.transport.write(self.buff)
-        self.buff = b''
+        transport.writelines(self.buff)
+        self._drop_buffer()
 
     def connection_lost(self, exc):
-        self.fetcher_proto.processor_closed(self.conn_id)
+        self.closed = True
+        if self.writing_paused:
+            self.resume_writing()
+        self.fetcher_proto.processors.remove(self.conn_id, self)
+        if not self.close_reported:
+            self.close_reported = True
+            self.fetcher_proto.processor_closed(self.conn_id)
+
+    def close(self):
+        """ Closes the tunnel, also while it is still connecting. """
+        if self.transport:
+            if self.delayed and not self.closed:
+                # Closed once the data held back is written.
+                self.close_delayed = True
+                return
+            self.transport.close()
+            return
+
+        if self.closed:
+            return
+        self.closed = True
+        if self.connect_task:
+            self.connect_task.cancel()
+        self._drop_buffer()
+
+    def reset(self, reason):
+        """ Closes a tunnel that never connected and reports it. """
+        self.close()
+        self.fetcher_proto.processors.remove(self.conn_id, self)
+        if not self.close_reported:
+            self.close_reported = True
+            self.fetcher_proto.processor_closed(self.conn_id, error=reason)
+
+    def attach(self, fetcher_proto):
+        """ Moves the tunnel to another link of the same session. """
+        self.fetcher_proto = fetcher_proto
+        if self.writing_paused:
+            fetcher_proto.pause_reading(('conn', self.conn_id))
+        if self.delayed_size > self.max_delayed_size:
+            fetcher_proto.pause_reading(('rate', self.conn_id))
+        if (self.buff_size > self.max_buff_size
+                and self.buff_overflow_policy != 'reset'):
+            fetcher_proto.pause_reading(('preconnect', self.conn_id))
+
+    def _drop_buffer(self):
+        self.buff = []
+        self.buff_size = 0
+        self.fetcher_proto.resume_reading(('preconnect', self.conn_id))
+
+    def pause_reading(self):
+        if self.reading_paused:
+            return
+        self.reading_paused = True
+        if self.transport:
+            self.transport.pause_reading()
+
+    def resume_reading(self):
+        if not self.reading_paused:
+            return
+        self.reading_paused = False
+        if self.transport and not self.upload_limited:
+            self.transport.resume_reading()
+
+    def pause_writing(self):
+        """ The upstream doesn't take data as fast as the fetcher link
+        delivers it: stop reading the link.
+        """
+        self.writing_paused = True
+        self.fetcher_proto.pause_reading(('conn', self.conn_id))
+
+    def resume_writing(self):
+        self.writing_paused = False
+        self.fetcher_proto.resume_reading(('conn', self.conn_id))
 
     def data_received(self, data):
+        self._read_allocations.inc()
+        self.data_read(data)
+
+    def eof_received(self):
+        # Let the transport close itself.
+        return None
+
+    def data_read(self, data):
+        self.last_activity = time.monotonic()
+        if not self.first_byte_received:
+            self.first_byte_received = True
+            metrics.TUNNEL_FIRST_BYTE_SECONDS.labels().observe(
+                time.monotonic() - self.created_at)
         self.fetcher_proto.processor_data_received(self.conn_id, data)
 
+        if self.upload_buckets:
+            bucket = shaping.consume(self.upload_buckets, len(data))
+            if bucket is not None and not self.upload_limited:
+                self.upload_limited = True
+                self.transport.pause_reading()
+                bucket.wait(self.upload_allowed)
+
+    def upload_allowed(self):
+        self.upload_limited = False
+        if self.transport and not self.reading_paused and not self.closed:
+            self.transport.resume_reading()
+
+    def download_allowed(self):
+        self.download_limited = False
+        delayed, self.delayed = self.delayed, []
+        self.delayed_size = 0
+        self.fetcher_proto.resume_reading(('rate', self.conn_id))
+        if self.closed:
+            return
+        for data in delayed:
+            self.write_data(data)
+        if self.close_delayed and not self.delayed:
+            self.close()
+
     def write_data(self, data):
-        if not self.transport:
-            self.buff += data
+        self.last_activity = time.monotonic()
+        if self.download_buckets:
+            if self.download_limited:
+                # Held back like by a slow upstream.
+                self.delayed.append(data)
+                self.delayed_size += len(data)
+                if self.delayed_size > self.max_delayed_size:
+                    self.fetcher_proto.pause_reading(('rate', self.conn_id))
+                return
+            bucket = shaping.consume(self.download_buckets, len(data))
+            if bucket is not None:
+                self.download_limited = True
+                bucket.wait(self.download_allowed)
+
+        if self.transport:
+            self.transport.write(data)
             return
-        self.transport.write(data)
 
+        if self.closed:
+            return
+        self.buff.append(data)
+        self.buff_size += len(data)
+        if self.buff_size > self.max_buff_size:
+            self.buffer_overflow()
 
-async def start_client(conn_id, host, port, fetcher_proto):
+    def buffer_overflow(self):
+        if self.buff_overflow_policy == 'reset':
+            print("Pre-connect buffer full [conn_id=%s]" % self.conn_id)
+            self.reset('buffer_overflow')
+            return
+
+        # Stop reading the link until the upstream connection is made.
+        self.fetcher_proto.pause_reading(('preconnect', self.conn_id))
+
+
+class BufferedLocalProcessorProtocol(LocalProcessorProtocol,
+                                     asyncio.BufferedProtocol):
+    """ Reads the upstream into buffers of the shared pool, see
+    BUFFERED_IO. The data is handed to the link as a memoryview of the
+    buffer, which goes back to the pool right after: the link frames it
+    into its write batch or copies what it has to keep.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._buffer_pool = buffers.get_pool()
+        self._read_buffer = None
+
+    def get_buffer(self, sizehint):
+        if self._read_buffer is None:
+            self._read_buffer = self._buffer_pool.acquire()
+        return self._read_buffer
+
+    def buffer_updated(self, nbytes):
+        buff, self._read_buffer = self._read_buffer, None
+        self.data_read(memoryview(buff)[:nbytes])
+        self._buffer_pool.release(buff)
+
+    def connection_lost(self, exc):
+        if self._read_buffer is not None:
+            self._buffer_pool.release(self._read_buffer)
+            self._read_buffer = None
+        super().connection_lost(exc)
+
+
+def start_client(conn_id, host, port, fetcher_proto):
     """
         Client started every time, url need to be processed.
         It connects to local transparent proxy to fetch data.
         Communication is handled by LocalProcessorProtocol.
-    """
-
-    print("processing for host", host, port)
 
-    loop = asyncio.get_event_loop()
-    processor_proto = LocalProcessorProtocol(conn_id, fetcher_proto)
+        The processor is registered and returned right away, data
+        written to it before the connection is made gets buffered.
+        Connection failures are reported to the server as CLOSE_CONN.
+    """
 
-    try:
-        return await loop.create_connection(lambda: processor_proto,
-                                            host=host,
-                                            port=port)
-    except Exception as e:
-        return None, None
+    if str(fetcher_proto.config.BUFFERED_IO) == "True":
+        processor_proto = BufferedLocalProcessorProtocol(conn_id, fetcher_proto)
+    else:
+        processor_proto = LocalProcessorProtocol(conn_id, fetcher_proto)
+    fetcher_proto.processors.add(conn_id, processor_proto)
+    processor_proto.connect(host, port)
+    return processor_proto
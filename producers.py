@@ -5,11 +5,22 @@ from hpxclient import protocols as hpxclient_protocols
 class AuthRequestProducer(hpxclient_protocols.MessageProducer):
     KIND = consts.AUTH_KIND
 
-    def __init__(self, email, password, public_key, secret_key):
+    def __init__(self, email, password, public_key, secret_key,
+                 protocol_version=None, resume=None, session_id=None,
+                 received=None, compression=None):
         self.email = email
         self.password = password
         self.public_key = public_key
         self.secret_key = secret_key
+        if protocol_version is not None:
+            self.protocol_version = protocol_version
+        if resume is not None:
+            self.resume = resume
+        if session_id is not None:
+            self.session_id = session_id
+            self.received = received
+        if compression is not None:
+            self.compression = compression
 
 
 class InitDataTransferProducer(hpxclient_protocols.MessageProducer):
@@ -30,5 +41,14 @@ class TransferDataProducer(hpxclient_protocols.MessageProducer):
 class CloseConnProducer(hpxclient_protocols.MessageProducer):
     KIND = consts.CLOSE_CONN_KIND
 
-    def __init__(self, conn_id):
+    def __init__(self, conn_id, error=None):
         self.conn_id = conn_id
+        if error is not None:
+            self.error = error
+
+
+class AckProducer(hpxclient_protocols.MessageProducer):
+    KIND = consts.ACK_KIND
+
+    def __init__(self, received):
+        self.received = received
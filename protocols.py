@@ -1,18 +1,34 @@
 import time
+import random
 import struct
 import asyncio
+import weakref
+import collections
 import msgpack
 
 from hpxclient import consts
-
-
-class ReconnectingProtocol(asyncio.Protocol):
-    MIN_SLEEP_TIME = 2
-    MAX_SLEEP_TIME = 60
-
-    def __init__(self, *args, **kwargs):
+from hpxclient import metrics
+from hpxclient import priority
+from hpxclient import servers
+from hpxclient import settings
+from hpxclient import timers
+from hpxclient import tls
+
+
+class ReconnectingProtocol(asyncio.BaseProtocol):
+    # Not an asyncio.Protocol, uvloop would call data_received() on the
+    # buffered subclasses instead of get_buffer() otherwise. Streaming
+    # subclasses define data_received() and only the buffered ones
+    # get_buffer(): uvloop reads through get_buffer() whenever there is
+    # one.
+
+    def __init__(self, *args, config=None, **kwargs):
         super().__init__()
 
+        # The settings of the client owning the connection, a
+        # config.Config or the settings module itself.
+        self.config = config if config is not None else settings
+
         self.host = None
         self.port = None
         self.ssl = None
@@ -20,174 +36,647 @@ class ReconnectingProtocol(asyncio.Protocol):
         # When last time connection was made successfully
         self.last_connection_time = None
 
+        # Delay slept before the connect that made this connection,
+        # the backoff goes on from it when the connection doesn't last.
+        self.reconnect_delay = None
+
+        # The lost protocol this one replaces, if it is a reconnect.
+        self.previous = None
+
         self.proto_factory = None
 
+        # Set by stop(), the connection is not made again once lost.
+        self.stopped = False
+        self.reconnect_task = None
+
     def connection_lost(self, exc):
         print("Lost.", self.__class__, self.port, self.host)
+        if self.stopped:
+            return
+
         def onexit(future):
             yield future.result()
 
-        task = asyncio.ensure_future(self._create_conn(
+        delay = self.reconnect_delay
+        if (self.last_connection_time is None
+                or time.monotonic() - self.last_connection_time
+                >= float(self.config.RECONNECT_STABLE_TIME)):
+            delay = None
+
+        self.previous = None
+        task = self.reconnect_task = asyncio.ensure_future(self._create_conn(
             self.proto_factory,
             self.host,
             self.port,
-            self.last_connection_time,
-            self.ssl
+            self.ssl,
+            delay=next_reconnect_delay(delay, self.config),
+            previous=self,
+            config=self.config
         ))
         task.add_done_callback(onexit)
 
+    def stop(self):
+        """ Closes the connection for good, it is not made again. """
+        self.stopped = True
+        if self.reconnect_task is not None:
+            self.reconnect_task.cancel()
+            self.reconnect_task = None
+
     @classmethod
     async def _create_conn(cls,
                            proto_factory,
                            host, port,
-                           last_connection_time=None,
-                           ssl=None):
-        loop = asyncio.get_event_loop()
-        sleep_time = cls.MIN_SLEEP_TIME
+                           ssl=None,
+                           delay=None,
+                           previous=None,
+                           config=None):
+        """ Connects, retrying with a decorrelated jittered backoff.
+        `delay` is slept before the first attempt. `host` is resolved
+        on every attempt, see servers.open_connection().
+        """
+        if config is None:
+            config = settings
+        if ssl is True:
+            ssl = tls.get_ssl_context()
+
+        def protocol_factory():
+            protocol = proto_factory()
+            protocol.previous = previous
+            return protocol
 
         while True:
-            # Allow connection once per 60s only
-            if last_connection_time and time.time() - last_connection_time < 60:
-                await asyncio.sleep(10)
-                continue
-
-            connection_params = dict(
-                protocol_factory = proto_factory,
-                host=host,
-                port=port,
-                ssl=ssl)
-            if ssl:
-                connection_params['server_hostname'] = 'hprox.com'
+            if delay:
+                await asyncio.sleep(delay)
 
             try:
-                transport, protocol = await loop.create_connection(**connection_params)
+                start = time.monotonic()
+                transport, protocol = await servers.open_connection(
+                    protocol_factory, host, port, ssl=ssl, config=config)
+                if ssl:
+                    tls.handshake_completed(transport,
+                                            time.monotonic() - start)
+                    tls.remember_session(transport)
                 protocol.host = host
                 protocol.port = port
                 protocol.proto_factory = proto_factory
                 protocol.ssl = ssl
-                protocol.last_connection_time = time.time()
+                protocol.last_connection_time = time.monotonic()
+                protocol.reconnect_delay = delay
 
                 return transport, protocol
             except OSError as e:
-                await asyncio.sleep(sleep_time)
-                sleep_time = min(sleep_time * 2, cls.MAX_SLEEP_TIME)
-                print("Disconnected. Reconnecting in %s seconds" % sleep_time)
+                delay = next_reconnect_delay(delay, config)
+                print("Disconnected. Reconnecting in %.2f seconds" % delay)
 
     @classmethod
-    async def create_conn(cls, proto_factory, host, port, ssl=None):
-        await cls._create_conn(proto_factory, host, port, ssl=ssl)
+    async def create_conn(cls, proto_factory, host, port, ssl=None,
+                          config=None):
+        """ Connects, retrying until it succeeds. Returns the
+        (transport, protocol) of the connection.
+        """
+        return await cls._create_conn(proto_factory, host, port, ssl=ssl,
+                                      config=config)
+
+
+def next_reconnect_delay(delay=None, config=settings):
+    """ Decorrelated jitter: a random delay between the minimum and three
+    times the previous one, capped at RECONNECT_MAX_DELAY.
+    """
+    min_delay = float(config.RECONNECT_MIN_DELAY)
+    max_delay = float(config.RECONNECT_MAX_DELAY)
+    if not delay:
+        delay = min_delay
+    return min(max_delay, random.uniform(min_delay, delay * 3))
+
+
+# Server links made, for the metrics.
+LINKS = weakref.WeakSet()
+
+LENGTH_STRUCT = struct.Struct("<L")
+_EMPTY_LENGTH = bytes(LENGTH_STRUCT.size)
+
+
+class FrameDecoder(object):
+    """ Incremental decoder for the length-prefixed msgpack stream.
+
+    Incoming chunks are appended to a single growable bytearray and
+    frames are unpacked straight from a memoryview over it, so every
+    byte is copied once on the way in, whatever the chunk/frame sizes.
+    Consumed bytes are dropped from the front of the buffer only once
+    per feed() call.
+
+    Buffered protocols read straight into the decoder instead, with
+    get_buffer() and buffer_updated(). That buffer is never resized, as
+    the transport holds a view of it: pending bytes are moved to its
+    front, or to a bigger one, when it runs out of room.
+    """
+    LENGTH_SIZE = LENGTH_STRUCT.size
+
+    def __init__(self, read_size=256 * 1024):
+        self._buff = bytearray()
+
+        self.read_size = read_size
+        self._rbuff = None
+        self._start = 0
+        self._end = 0
+        self._read_allocations = metrics.BUFFER_ALLOCATIONS.labels('read')
+        self._payload_allocations = metrics.BUFFER_ALLOCATIONS.labels(
+            'payload')
+
+    def __len__(self):
+        return len(self._buff) + self._end - self._start
+
+    def feed(self, data):
+        """ Adds data to the buffer and returns the list of complete
+        messages available so far.
+        """
+        buff = self._buff
+        buff += data
+
+        messages, pos = self.decode_frames(buff, 0, len(buff))
+        if pos:
+            del buff[:pos]
+        return messages
+
+    def get_buffer(self, sizehint=-1):
+        """ Returns the free part of the read buffer, with at least a
+        quarter of the buffer or the rest of the pending frame free.
+        """
+        rbuff = self._rbuff
+        start, end = self._start, self._end
+        if start == end:
+            start = end = 0
+
+        if rbuff is None or len(rbuff) - end < len(rbuff) // 4:
+            pending = end - start
+            needed = pending + self.read_size // 4
+            if pending >= self.LENGTH_SIZE:
+                content_size, = LENGTH_STRUCT.unpack_from(rbuff, start)
+                needed = max(needed, self.LENGTH_SIZE + content_size)
+
+            if rbuff is not None and needed <= len(rbuff) * 3 // 4:
+                with memoryview(rbuff) as view:
+                    view[:pending] = view[start:end]
+            else:
+                size = self.read_size if rbuff is None else len(rbuff)
+                while size < needed:
+                    size *= 2
+                self._read_allocations.inc()
+                new_rbuff = bytearray(size)
+                if pending:
+                    new_rbuff[:pending] = memoryview(rbuff)[start:end]
+                self._rbuff = rbuff = new_rbuff
+            start, end = 0, pending
+
+        self._start, self._end = start, end
+        return memoryview(rbuff)[end:]
+
+    def buffer_updated(self, nbytes):
+        """ `nbytes` were read into the buffer of get_buffer(), returns
+        the list of complete messages available so far.
+        """
+        self._end += nbytes
+        messages, self._start = self.decode_frames(
+            self._rbuff, self._start, self._end)
+        return messages
+
+    def decode_frames(self, buff, pos, end):
+        """ Decodes the complete frames of buff[pos:end], returns them
+        with the position of the first byte not decoded.
+        """
+        messages = []
+        length_size = self.LENGTH_SIZE
+        unpack_length = LENGTH_STRUCT.unpack_from
+
+        with memoryview(buff) as view:
+            while end - pos >= length_size:
+                content_size, = unpack_length(buff, pos)
+                start = pos + length_size
+                if end - start < content_size:
+                    break
+
+                pos = start + content_size
+                messages.append(self.decode(view[start:pos]))
+        return messages, pos
+
+    def decode(self, frame):
+        if frame[0] in BINARY_TRANS_DATA_KINDS:
+            self._payload_allocations.inc()
+            return decode_binary_trans_data(frame)
+        return msgpack.unpackb(frame)
 
 
 class MsgpackReconnectingProtocol(ReconnectingProtocol):
-    LENGTH_SIZE = struct.calcsize("<L")
+    LENGTH_SIZE = LENGTH_STRUCT.size
     REGISTERED_CONSUMERS = []
+    LINK_NAME = 'link'
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._buff = b''
-        self._content_size = None
+        self._decoder = FrameDecoder(int(self.config.READ_BUFFER_SIZE))
         self.last_chunk_time = None
         self.transport = None
 
-        self._queue = asyncio.Queue()
+        # Negotiated with the server on authentication.
+        self.protocol_version = 1
+
+        # Received messages, control ones go first.
+        self._queue = priority.PriorityMessageQueue(
+            _TRANS_DATA_KIND, int(self.config.PRIORITY_QUANTUM))
+
+        # Flow control. Reading is paused while any reason is set.
+        self._read_pause_reasons = set()
+        self.writing_paused = False
+        self.queue_high = None
+        self.queue_low = None
+
+        # Outgoing frames waiting to be flushed to the transport. Buffered
+        # protocols copy them into a single write batch instead, see
+        # BUFFERED_IO.
+        self._wframes = []
+        self._wbuff = (bytearray() if isinstance(self, asyncio.BufferedProtocol)
+                       else None)
+        self._wframes_size = 0
+        self._flush_handle = None
+        self.coalesce_writes = str(self.config.WRITE_COALESCE) == "True"
+        self.flush_size = int(self.config.WRITE_FLUSH_SIZE)
+        self.flush_delay = float(self.config.WRITE_FLUSH_DELAY)
+
+        # Bulk frames queued while writing is paused, see
+        # write_conn_frame().
+        self._bulk = priority.DeficitRoundRobin(
+            int(self.config.PRIORITY_QUANTUM))
+        self.bulk_high = None
+        self.bulk_low = None
+        self.bulk_full = False
+
+        # Name of the Client owning the link, set by it, labels the link
+        # metrics along with the link name.
+        self.client_name = ''
+        self._bytes_in = metrics.NULL_VALUE
+        self._bytes_out = metrics.NULL_VALUE
+        self._queue_size = metrics.NULL_VALUE
+        self._read_allocations = metrics.NULL_VALUE
+        self._write_allocations = metrics.NULL_VALUE
+
+        # Heartbeat. Send times of the pings waiting for a pong, the
+        # server answers them in order.
+        self.ping_interval = float(self.config.PING_INTERVAL)
+        self.dead_peer_timeout = float(self.config.DEAD_PEER_TIMEOUT)
+        self._heartbeat_timer = None
+        self._pings = collections.deque(maxlen=16)
+        self.srtt = None
+        self.rttvar = None
+        self._rtt = metrics.NULL_VALUE
+
+    def get_link_name(self):
+        return self.LINK_NAME
 
     def connection_made(self, transport):
         print('Connection made %s %s' % (self.__class__, id(self)))
         self.transport = transport
-        self.last_chunk_time = time.time()
+        self.last_chunk_time = time.monotonic()
+
+        LINKS.add(self)
+        labels = (self.client_name, self.get_link_name())
+        self._bytes_in = metrics.LINK_BYTES_IN.labels(*labels)
+        self._bytes_out = metrics.LINK_BYTES_OUT.labels(*labels)
+        self._rtt = metrics.LINK_RTT_SECONDS.labels(*labels)
+        self._read_allocations = metrics.BUFFER_ALLOCATIONS.labels('read')
+        self._write_allocations = metrics.BUFFER_ALLOCATIONS.labels('write')
+        self._queue_size = metrics.LINK_QUEUE_SIZE.labels(*labels)
+        self._queue_size.set_function(self._queue.qsize)
+
+        self._heartbeat_timer = get_scheduler().call_later(
+            self.ping_interval, self.heartbeat)
 
         def onexit(future):
             yield future.result()
 
-        task = asyncio.ensure_future(activate_proto_watcher(self))
-        task.add_done_callback(onexit)
-
         task = asyncio.ensure_future(activate_message_processor(self))
         task.add_done_callback(onexit)
 
     def connection_lost(self, exc):
         self.close()
+        if not self.stopped:
+            metrics.LINK_RECONNECTS.labels(
+                self.client_name, self.get_link_name()).inc()
         super().connection_lost(exc)
 
-    def process_data(self):
-        if self._content_size is None:
-            if len(self._buff) >= self.LENGTH_SIZE:
-                self._content_size = struct.unpack(
-                    "<L", self._buff[:self.LENGTH_SIZE])[0]
-                self._buff = self._buff[self.LENGTH_SIZE:]
-                return self.process_data()
+    def stop(self):
+        super().stop()
+        self.close()
 
-        if self._content_size is None:
-            return
+    @classmethod
+    def get_dispatch_table(cls):
+        """ Returns the {raw kind: consumer class} mapping for
+        LINK_CONSUMERS and REGISTERED_CONSUMERS, built once per protocol
+        class.
+        """
+        table = cls.__dict__.get('_dispatch_table')
+        if table is None:
+            table = build_dispatch_table(
+                LINK_CONSUMERS + cls.REGISTERED_CONSUMERS)
+            cls._dispatch_table = table
+        return table
 
-        if len(self._buff) >= self._content_size:
-            message = self._buff[:self._content_size]
-            self.process_msg(msgpack.unpackb(message))
+    def data_received(self, data):
+        self._read_allocations.inc()
+        self.messages_received(self._decoder.feed(data), len(data))
 
-            self._buff = self._buff[self._content_size:]
-            self._content_size = None
-            return self.process_data()
+    def eof_received(self):
+        # Let the transport close itself.
+        return None
 
-    def data_received(self, data):
-        self.last_chunk_time = time.time()
-        self._buff += data
-        self.process_data()
+    def messages_received(self, messages, size):
+        self.last_chunk_time = time.monotonic()
+        self._bytes_in.inc(size)
+        for message in messages:
+            self.process_msg(message)
 
     def process_msg(self, message):
         self._queue.put_nowait(message)
+        if self.queue_high and self._queue.qsize() >= self.queue_high:
+            self.pause_reading('queue')
+
+    def message_taken(self):
+        if (self.queue_high
+                and 'queue' in self._read_pause_reasons
+                and self._queue.qsize() <= self.queue_low):
+            self.resume_reading('queue')
+
+    @property
+    def reading_paused(self):
+        return bool(self._read_pause_reasons)
+
+    def pause_reading(self, reason):
+        if reason in self._read_pause_reasons:
+            return
+        self._read_pause_reasons.add(reason)
+        if len(self._read_pause_reasons) == 1 and self.transport:
+            self.transport.pause_reading()
+
+    def resume_reading(self, reason):
+        if reason not in self._read_pause_reasons:
+            return
+        self._read_pause_reasons.discard(reason)
+        if not self._read_pause_reasons and self.transport:
+            self.transport.resume_reading()
+
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+        self.write_bulk()
+
+    def pause_bulk_writers(self):
+        """ Called when bulk_high bytes of bulk frames are queued. """
+
+    def resume_bulk_writers(self):
+        """ Called when the bulk frames queued drop to bulk_low bytes. """
+
+    def bulk_conn_drained(self, conn_id):
+        """ Called when the last queued bulk frame of `conn_id` is sent. """
+
+    def get_flow_stats(self):
+        return {
+            'reading_paused': self.reading_paused,
+            'read_pause_reasons': len(self._read_pause_reasons),
+            'writing_paused': self.writing_paused,
+            'write_buffer_size': (self.transport.get_write_buffer_size()
+                                  if self.transport else 0),
+            'queue_size': self._queue.qsize(),
+            'bulk_queue_size': self._bulk.size,
+            'rtt': self.srtt,
+        }
+
+    def heartbeat(self):
+        """ Pings the server and closes the link once nothing has been
+        received for dead_peer_timeout seconds.
+        """
+        self._heartbeat_timer = None
+        if self.transport is None:
+            return
+
+        now = time.monotonic()
+        idle = now - self.last_chunk_time
+        if idle >= self.dead_peer_timeout:
+            print('No data for %.1fs, closing %s %s' % (
+                idle, self.__class__, id(self)))
+            self.transport.abort()
+            return
+
+        self._pings.append(now)
+        self.write_data(PingProducer())
+
+        delay = min(self.ping_interval, self.dead_peer_timeout - idle)
+        self._heartbeat_timer = get_scheduler().call_later(
+            delay, self.heartbeat)
+
+    def pong_received(self):
+        """ Updates the smoothed RTT as in RFC 6298. """
+        if not self._pings:
+            return
+        sample = time.monotonic() - self._pings.popleft()
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt = 0.875 * self.srtt + 0.125 * sample
+        self._rtt.set(self.srtt)
 
     def write_data(self, msg_producer):
+        self.write_frame(
+            msgpack.packb(msg_producer.msg2str(), use_bin_type=False))
+
+    def write_conn_frame(self, conn_id, parts, bulk=True):
+        """ Writes a frame of connection `conn_id`.
+
+        While writing is paused bulk frames are queued instead, so the
+        control frames written meanwhile go ahead of them. They are sent
+        on resume_writing() in deficit round-robin order across the
+        connections. Control frames of a connection with bulk frames
+        queued wait behind them.
+        """
+        if conn_id in self._bulk or (bulk and self.writing_paused):
+            size = 0
+            for part in parts:
+                size += len(part)
+            self._bulk.push(conn_id, parts, size)
+            if (self.bulk_high and not self.bulk_full
+                    and self._bulk.size >= self.bulk_high):
+                self.bulk_full = True
+                self.pause_bulk_writers()
+            return
+        self.send_conn_frame(parts)
+
+    def send_conn_frame(self, parts):
+        self.write_frame(*parts)
+
+    def write_bulk(self):
+        """ Sends the queued bulk frames until writing is paused. """
+        bulk = self._bulk
+        while bulk and not self.writing_paused and self.transport:
+            conn_id, parts, _ = bulk.pop()
+            self.send_conn_frame(parts)
+            if conn_id not in bulk:
+                self.bulk_conn_drained(conn_id)
+
+        if self.bulk_full and bulk.size <= (self.bulk_low or 0):
+            self.bulk_full = False
+            self.resume_bulk_writers()
+
+    def process_queued_messages(self):
+        """ Processes the received messages still queued right away. """
+        dispatch_table = self.get_dispatch_table()
+        while not self._queue.empty():
+            data = self._queue.get_nowait()
+            consumer_cls = dispatch_table.get(data[b'kind'])
+            if consumer_cls is not None:
+                dispatch(self, consumer_cls, data[b'data'])
+
+    def write_frame(self, *parts):
+        """ Queues a frame made of the given encoded parts. Frames written
+        during the same loop iteration (or within flush_delay) are sent
+        with a single writelines() call, or write() of the batch, unless
+        flush_size bytes are queued first.
+        """
+        if not self.transport or self.transport.is_closing():
+            return
+
+        size = 0
+        for part in parts:
+            size += len(part)
+        wbuff = self._wbuff
+        if wbuff is not None:
+            wbuff += LENGTH_STRUCT.pack(size)
+            for part in parts:
+                wbuff += part
+        else:
+            self._wframes.append(LENGTH_STRUCT.pack(size))
+            self._wframes.extend(parts)
+        self._wframes_size += self.LENGTH_SIZE + size
+        self.frame_written()
+
+    def write_trans_data_frame(self, conn_id, data, kind):
+        """ Frames tunnel data straight into the write batch, without
+        keeping `data`. Buffered protocols only.
+        """
+        if not self.transport or self.transport.is_closing():
+            return
+
+        wbuff = self._wbuff
+        pos = len(wbuff)
+        wbuff += _EMPTY_LENGTH
+        append_binary_trans_data_header(wbuff, conn_id, len(data), kind)
+        wbuff += data
+        size = len(wbuff) - pos
+        LENGTH_STRUCT.pack_into(wbuff, pos, size - self.LENGTH_SIZE)
+        self._wframes_size += size
+        self.frame_written()
+
+    def frame_written(self):
+        if (not self.coalesce_writes
+                or self._wframes_size >= self.flush_size):
+            self.flush()
+            return
+
+        if self._flush_handle is None:
+            loop = asyncio.get_event_loop()
+            if self.flush_delay > 0:
+                self._flush_handle = loop.call_later(self.flush_delay,
+                                                     self.flush)
+            else:
+                self._flush_handle = loop.call_soon(self.flush)
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if not self._wframes_size:
+            return
+
+        size = self._wframes_size
+        self._wframes_size = 0
+        wbuff = self._wbuff
+        if wbuff is not None:
+            # The transport may keep the batch, start a new one.
+            self._wbuff = bytearray()
+        else:
+            frames = self._wframes
+            self._wframes = []
         if self.transport and not self.transport.is_closing():
-            self.transport.write(encode_msg(msg_producer.msg2str()))
+            self._bytes_out.inc(size)
+            self._write_allocations.inc()
+            if wbuff is not None:
+                self.transport.write(wbuff)
+            else:
+                self.transport.writelines(frames)
 
     def close(self):
         print('Connection closed %s %s' % (self.__class__, id(self)))
+        self.flush()
         if self.transport:
+            tls.remember_session(self.transport)
             self.transport.close()
             self.transport = None
             self.last_chunk_time = None
+        self._bulk.clear()
+        self.bulk_full = False
+        self.writing_paused = False
+        if self._heartbeat_timer is not None:
+            self._heartbeat_timer.cancel()
+            self._heartbeat_timer = None
+        self._pings.clear()
+        # The gauge would keep the protocol alive. The link connected
+        # again under the same labels may have set its own function.
+        self._queue_size.unset_function(self._queue.qsize)
+        self._queue_size = metrics.NULL_VALUE
+
+
+def build_dispatch_table(consumer_list):
+    return {consumer_cls.KIND.encode(): consumer_cls
+            for consumer_cls in consumer_list}
+
+
+def dispatch(proto, consumer_cls, msg_data):
+    """ Runs the consumer of a message. An error is logged, it doesn't
+    stop the processing of the following messages.
+    """
+    try:
+        consumer_cls(proto, msg_data).process()
+    except Exception as e:
+        print('Consumer error [kind=%s]: %r' % (consumer_cls.KIND, e))
 
 
 async def activate_message_processor(proto):
-    consumer_list = proto.REGISTERED_CONSUMERS
+    dispatch_table = proto.get_dispatch_table()
+    queue = proto._queue
+    kind_counters = {kind: metrics.MESSAGES_RECEIVED.labels(kind.decode())
+                     for kind in dispatch_table}
 
     while proto.transport is not None:
-        data = await proto._queue.get()
-
-        consumer_kind = data[b'kind'].decode()
-
-        consumer_cls = None
-        for cls in consumer_list:
-            if consumer_kind != cls.KIND:
-                continue
-            consumer_cls = cls
+        data = await queue.get()
+        if proto.transport is None:
             break
+        proto.message_taken()
 
+        consumer_cls = dispatch_table.get(data[b'kind'])
         if consumer_cls is None:
-            print('Consumer not found [kind=%s]' %consumer_kind)
+            metrics.MESSAGES_RECEIVED.labels('unknown').inc()
+            print('Consumer not found [kind=%s]' % data[b'kind'].decode())
             continue
+        kind_counters[data[b'kind']].inc()
 
-        consumer = consumer_cls(proto, data[b'data'])
-        if asyncio.iscoroutinefunction(getattr(consumer, 'process')):
-            await consumer.process()
-            continue
+        dispatch(proto, consumer_cls, data[b'data'])
 
-        consumer.process()
 
-
-async def activate_proto_watcher(proto, sleep_time=30):
-    while proto.transport is not None:
-        # For 60 seconds no chunks. Connection is dead.
-        if time.time() - proto.last_chunk_time > 60:
-            proto.close()
-            return
-
-        # For 30 seconds no chunks. Ping server.
-        if time.time() - proto.last_chunk_time > 30:
-            print('Sending ping %s %s' % (proto.__class__, id(proto)))
-            proto.write_data(PingProducer())
-
-        await asyncio.sleep(sleep_time)
+def get_scheduler():
+    return timers.get_scheduler(
+        resolution=float(settings.TIMER_RESOLUTION))
 
 
 class MessageProducer(object):
@@ -210,7 +699,17 @@ class PingProducer(MessageProducer):
         return None
 
 
+class PongProducer(MessageProducer):
+    KIND = consts.PONG_KIND
+
+    def get_data(self):
+        return None
+
+
 class MessageConsumer(object):
+    __slots__ = ('protocol', 'data')
+    KIND = None
+
     def __init__(self, protocol, data):
         self.data = data
         self.protocol = protocol
@@ -219,6 +718,98 @@ class MessageConsumer(object):
         raise NotImplementedError()
 
 
+class PingConsumer(MessageConsumer):
+    __slots__ = ()
+    KIND = consts.PING_KIND
+
+    def process(self):
+        self.protocol.write_data(PongProducer())
+
+
+class PongConsumer(MessageConsumer):
+    __slots__ = ()
+    KIND = consts.PONG_KIND
+
+    def process(self):
+        self.protocol.pong_received()
+
+
+# Consumers every link registers on top of its REGISTERED_CONSUMERS.
+LINK_CONSUMERS = [PingConsumer, PongConsumer]
+
+
+metrics.PAUSED_LINKS.labels().set_function(
+    lambda: sum(1 for link in list(LINKS)
+                if link.transport is not None and link.reading_paused))
+
+
+def append_varint(buff, value):
+    while value > 0x7f:
+        buff.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buff.append(value)
+
+
+def encode_varint(value):
+    out = bytearray()
+    append_varint(out, value)
+    return bytes(out)
+
+
+def decode_varint(buff, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buff[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def can_encode_binary(conn_id):
+    return type(conn_id) is int and conn_id >= 0
+
+
+def encode_binary_trans_data_header(conn_id, data_size,
+                                    kind=consts.BINARY_TRANS_DATA_KIND):
+    """ Header of a v2 TRANS_DATA frame: kind byte, conn_id and payload
+    size as varints. The raw payload follows it.
+    """
+    header = bytearray()
+    append_binary_trans_data_header(header, conn_id, data_size, kind)
+    return bytes(header)
+
+
+def append_binary_trans_data_header(buff, conn_id, data_size,
+                                    kind=consts.BINARY_TRANS_DATA_KIND):
+    buff.append(kind)
+    append_varint(buff, conn_id)
+    append_varint(buff, data_size)
+
+
+_TRANS_DATA_KIND = consts.TRANS_DATA_KIND.encode()
+
+BINARY_TRANS_DATA_KINDS = frozenset([
+    consts.BINARY_TRANS_DATA_KIND,
+    consts.BINARY_COMPRESSED_TRANS_DATA_KIND,
+])
+
+
+def decode_binary_trans_data(frame):
+    conn_id, pos = decode_varint(frame, 1)
+    data_size, pos = decode_varint(frame, pos)
+    if len(frame) - pos != data_size:
+        raise ValueError('Invalid binary frame size')
+
+    data = {b'conn_id': conn_id, b'data': bytes(frame[pos:])}
+    if frame[0] == consts.BINARY_COMPRESSED_TRANS_DATA_KIND:
+        # Left to the link to decompress, see fetcher.central.compression.
+        data[b'compressed'] = True
+    return {b'kind': _TRANS_DATA_KIND, b'data': data}
+
+
 def encode_msg(msg):
     data = msgpack.packb(msg, use_bin_type=False)
-    return struct.pack("<L", len(data)) + data
+    return LENGTH_STRUCT.pack(len(data)) + data
@@ -0,0 +1,145 @@
+import time
+import socket
+import asyncio
+import ipaddress
+import collections
+
+
+class Resolver(object):
+    """ Caching asynchronous resolver.
+
+    Resolved hosts are kept for `ttl` seconds and failed lookups for
+    `negative_ttl` seconds, in an LRU of at most `max_size` hosts.
+    Concurrent lookups of the same host share a single getaddrinfo call.
+    """
+
+    def __init__(self, ttl=300, negative_ttl=30, max_size=1024):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+
+        # host -> (expiration time, addresses, error)
+        self._cache = collections.OrderedDict()
+        self._inflight = {}
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def resolve(self, host):
+        """ Returns the list of (family, ip) addresses of the host. """
+        if is_ip_address(host):
+            return [(socket.AF_INET6 if ':' in host else socket.AF_INET,
+                     host)]
+
+        entry = self._cache.get(host)
+        if entry is not None:
+            expiration, addresses, error = entry
+            if expiration > time.monotonic():
+                self._cache.move_to_end(host)
+                if error is not None:
+                    self.negative_hits += 1
+                    raise make_error(error)
+                self.hits += 1
+                return addresses
+            del self._cache[host]
+
+        task = self._inflight.get(host)
+        if task is None:
+            self.misses += 1
+            task = self._inflight[host] = asyncio.ensure_future(
+                self._lookup(host))
+        else:
+            self.coalesced += 1
+        # A caller cancelled must not cancel the lookup the others wait
+        # for.
+        addresses, error = await asyncio.shield(task)
+        if error is not None:
+            raise make_error(error)
+        return addresses
+
+    async def _lookup(self, host):
+        """ Returns the addresses and None, or None and the error of the
+        lookup as (exception class, args), which is cached. Invalid names
+        fail with a socket.gaierror.
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            infos = await loop.getaddrinfo(host, None,
+                                           type=socket.SOCK_STREAM)
+        except (OSError, ValueError) as e:
+            if isinstance(e, OSError):
+                error = (type(e), e.args)
+            else:
+                # Names failing the IDNA encoding, like 'a..b'. Callers
+                # get a gaierror for them too.
+                error = (socket.gaierror,
+                         (socket.EAI_NONAME, 'Invalid host name: %s' % e))
+            self._store(host, None, error, self.negative_ttl)
+            return None, error
+        else:
+            addresses = unique_addresses(infos)
+            self._store(host, addresses, None, self.ttl)
+            return addresses, None
+        finally:
+            del self._inflight[host]
+
+    def _store(self, host, addresses, error, ttl):
+        self._cache[host] = (time.monotonic() + ttl, addresses, error)
+        self._cache.move_to_end(host)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def prewarm(self, hosts):
+        await asyncio.gather(*[self.resolve(host) for host in hosts],
+                             return_exceptions=True)
+
+    def get_stats(self):
+        return {
+            'dns_cache_size': len(self._cache),
+            'dns_hits': self.hits,
+            'dns_negative_hits': self.negative_hits,
+            'dns_misses': self.misses,
+            'dns_coalesced': self.coalesced,
+        }
+
+
+def make_error(error):
+    """ A new exception for every caller, raising the same one again
+    would grow its traceback.
+    """
+    error_class, args = error
+    return error_class(*args)
+
+
+def is_ip_address(host):
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+def unique_addresses(infos):
+    addresses = []
+    for family, _, _, _, sockaddr in infos:
+        address = (family, sockaddr[0])
+        if address not in addresses:
+            addresses.append(address)
+    return addresses
+
+
+def parse_hosts(hosts):
+    """ Hosts to pre-warm: a comma separated list or the path of a file
+    with one host per line.
+    """
+    if not hosts:
+        return []
+    try:
+        with open(hosts) as f:
+            lines = f.read().split()
+    except OSError:
+        lines = hosts.split(',')
+    return [line.strip() for line in lines
+            if line.strip() and not line.startswith('#')]
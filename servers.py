@@ -0,0 +1,141 @@
+import os
+import json
+import asyncio
+
+from hpxclient import settings
+from hpxclient import resolver as hpxclient_resolver
+
+
+RESOLVER = None
+ADDRESS_CACHE = None
+
+# Background lookups of the hosts first connected from the address cache.
+_refreshes = {}
+
+
+class AddressCache(object):
+    """ Last known good addresses of the server hosts, the ones a link
+    was connected to, kept in a JSON file so that a restart connects
+    without waiting for DNS. The file is read on first use and written
+    when an address changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._addresses = None
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                addresses = json.load(f)
+        except (OSError, ValueError):
+            addresses = {}
+        if not isinstance(addresses, dict):
+            addresses = {}
+        self._addresses = addresses
+
+    def get(self, host):
+        if self._addresses is None:
+            self._load()
+        return self._addresses.get(host)
+
+    def set(self, host, address):
+        if self.get(host) == address:
+            return
+        self._addresses[host] = address
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'w') as f:
+                json.dump(self._addresses, f)
+        except OSError as e:
+            print("Server address cache not saved: %s" % e)
+
+
+def get_resolver():
+    global RESOLVER
+    if RESOLVER is None:
+        RESOLVER = hpxclient_resolver.Resolver(
+            ttl=float(settings.DNS_CACHE_TTL),
+            negative_ttl=float(settings.DNS_NEGATIVE_TTL))
+    return RESOLVER
+
+
+def get_address_cache():
+    global ADDRESS_CACHE
+    if ADDRESS_CACHE is None:
+        ADDRESS_CACHE = AddressCache(os.path.join(
+            settings.HPROX_DIR, settings.SERVER_ADDRESS_CACHE_NAME))
+    return ADDRESS_CACHE
+
+
+def get_server_name(host, config=settings):
+    """ The name of server host `host`, None meaning DOMAIN. """
+    if host is None or hpxclient_resolver.is_ip_address(host):
+        return config.DOMAIN
+    return host
+
+
+async def resolve_server(host, config=settings):
+    """ Returns the addresses to connect to for server host `host`, in
+    order.
+
+    None stands for DOMAIN, or DOMAIN_IP when it is set. The first
+    connect to a host goes to its cached address, if any, while it is
+    resolved in the background. Later ones use the lookup, or the
+    cached address when it fails. Raises OSError without either.
+    """
+    if host is None:
+        if config.DOMAIN_IP:
+            return [config.DOMAIN_IP]
+        host = config.DOMAIN
+    if hpxclient_resolver.is_ip_address(host):
+        return [host]
+
+    cached = get_address_cache().get(host)
+    refresh = _refreshes.get(host)
+    if cached is not None and (refresh is None or not refresh.done()):
+        if refresh is None:
+            refresh = _refreshes[host] = asyncio.ensure_future(
+                get_resolver().resolve(host))
+            refresh.add_done_callback(_refresh_done)
+        return [cached]
+
+    try:
+        addresses = await get_resolver().resolve(host)
+    except OSError as e:
+        if cached is None:
+            raise
+        print("Resolving %s failed (%s), using %s" % (host, e, cached))
+        return [cached]
+    return [address for _, address in addresses]
+
+
+def _refresh_done(future):
+    if not future.cancelled():
+        # Failures are retried on the next connect.
+        future.exception()
+
+
+async def open_connection(protocol_factory, host, port, ssl=None,
+                          config=settings):
+    """ Connects to the first address of server host `host` that takes
+    the connection and keeps it as the last known good one.
+    """
+    loop = asyncio.get_event_loop()
+    server_hostname = get_server_name(host, config) if ssl else None
+
+    error = None
+    for address in await resolve_server(host, config):
+        try:
+            connection = await loop.create_connection(
+                protocol_factory, address, int(port), ssl=ssl,
+                server_hostname=server_hostname)
+        except OSError as e:
+            error = e
+            continue
+        if host is None:
+            host = config.DOMAIN
+        if host != address:
+            get_address_cache().set(host, address)
+        return connection
+    raise error
@@ -1,6 +1,5 @@
 import os
 import pathlib
-import socket
 
 
 USER_DIR = str(pathlib.Path.home())
@@ -8,30 +7,193 @@ HPROX_DIR_NAME = '.hprox'
 HPROX_CONFIG_NAME = 'hprox.cfg'
 HPROX_DIR = os.path.join(USER_DIR, HPROX_DIR_NAME)
 
-if not os.path.exists(HPROX_DIR):
-    os.mkdir(HPROX_DIR)
+# Last known good addresses of the servers, in HPROX_DIR. Used to
+# connect on start without waiting for DNS, see hpxclient.servers.
+SERVER_ADDRESS_CACHE_NAME = 'servers.json'
 
 
 PROCESSOR_LOCAL_PORT = 8090
 
 PROXY_LISTENER_LOCAL_PORT = 8080
 DOMAIN = 'hprox.com'
-DOMAIN_IP = socket.gethostbyname(DOMAIN)
+# Address of DOMAIN, resolved when connecting when unset. The server
+# addresses (PROXY_*_SERVER_IP) below stand for DOMAIN when None.
+DOMAIN_IP = None
 
 # The listener server which handle local connection and proxies them.
-PROXY_LISTENER_SERVER_IP, PROXY_LISTENER_SERVER_PORT = DOMAIN_IP, 10014
+PROXY_LISTENER_SERVER_IP, PROXY_LISTENER_SERVER_PORT = None, 10014
 
 # The port where proxy listening incoming connection for fetching
 # and return to proxy engine.
 PROXY_FETCHER_LOCAL_PORT = 8090
 
 # The server with job to fetching (connected by domestic proxies).
-PROXY_FETCHER_SERVER_IP, PROXY_FETCHER_SERVER_PORT = DOMAIN_IP, 10012
+PROXY_FETCHER_SERVER_IP, PROXY_FETCHER_SERVER_PORT = None, 10012
+
+# Number of parallel links kept with the fetcher server.
+FETCHER_POOL_SIZE = 1
 
 PROXY_SSL_ENABLED = True
 
+# TLS of the server links, one context is shared by all the links of a
+# process. TLS_CA_FILE adds trusted CA certificates, TLS_CIPHERS is an
+# OpenSSL cipher list and TLS_ALPN_PROTOCOLS a comma separated list, both
+# unset keep the defaults. Sessions are resumed on reconnect unless
+# TLS_SESSION_RESUMPTION is False.
+TLS_CA_FILE = None
+TLS_CIPHERS = None
+TLS_ALPN_PROTOCOLS = None
+TLS_SESSION_RESUMPTION = True
+
 # The proxy engine management server.
-PROXY_MNG_SERVER_IP, PROXY_MNG_SERVER_PORT = DOMAIN_IP, 10010
+PROXY_MNG_SERVER_IP, PROXY_MNG_SERVER_PORT = None, 10010
+
+# Event loop implementation: asyncio or uvloop (when installed).
+EVENT_LOOP = 'asyncio'
+
+# Number of worker processes. More than one runs the client under a
+# supervisor process, every worker with its own links and event loop.
+WORKERS = 1
+WORKER_STATS_INTERVAL = 10
+
+# On SIGTERM (and Ctrl-C) the client stops taking new tunnels and gives
+# the open ones up to SHUTDOWN_DRAIN_TIMEOUT seconds to finish before it
+# closes its links. A second signal stops it right away. SIGHUP reloads
+# the configuration file: the global rate limits change at once, the
+# other settings apply to the tunnels and links made after the reload.
+SHUTDOWN_DRAIN_TIMEOUT = 30
+
+# Upstream DNS cache. Lookups are cached for DNS_CACHE_TTL seconds and
+# failures for DNS_NEGATIVE_TTL seconds. DNS_PREWARM_HOSTS is a comma
+# separated list of hosts, or a file with one per line, resolved on start.
+DNS_CACHE_TTL = 300
+DNS_NEGATIVE_TTL = 30
+DNS_CACHE_SIZE = 1024
+DNS_PREWARM_HOSTS = None
+
+# Upstream connects. Connects longer than UPSTREAM_CONNECT_TIMEOUT
+# seconds fail as timed out. Addresses of a host are raced, a new one
+# every UPSTREAM_HAPPY_EYEBALLS_DELAY seconds. At most
+# UPSTREAM_MAX_CONNECTING connects (UPSTREAM_MAX_CONNECTING_PER_HOST per
+# host) run at once and up to UPSTREAM_MAX_CONNECT_QUEUE wait for a slot.
+UPSTREAM_CONNECT_TIMEOUT = 10
+UPSTREAM_HAPPY_EYEBALLS_DELAY = 0.25
+UPSTREAM_MAX_CONNECTING = 256
+UPSTREAM_MAX_CONNECTING_PER_HOST = 16
+UPSTREAM_MAX_CONNECT_QUEUE = 1024
+
+# Metrics, served in the Prometheus text format on
+# http://METRICS_HOST:METRICS_PORT/metrics when METRICS_PORT is set.
+# Workers of the multi-process mode use METRICS_PORT + worker index.
+METRICS_ENABLED = True
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = None
+
+# Tunnel data received while the upstream connection is being made is
+# buffered up to PROCESSOR_PRECONNECT_BUFFER_SIZE bytes. Beyond it the
+# fetcher link stops reading until the connection is made ('pause') or
+# the tunnel is closed ('reset').
+PROCESSOR_PRECONNECT_BUFFER_SIZE = 1024 * 1024
+PROCESSOR_PRECONNECT_OVERFLOW = 'pause'
+
+# Tunnels without traffic for this many seconds are closed, 0 disables.
+PROCESSOR_IDLE_TIMEOUT = 600
+
+# Server links are pinged every PING_INTERVAL seconds (the replies give
+# the link round trip time) and closed when nothing has been received
+# for DEAD_PEER_TIMEOUT seconds.
+PING_INTERVAL = 10
+DEAD_PEER_TIMEOUT = 30
+
+# Lost server links are reconnected with a decorrelated jittered
+# backoff between RECONNECT_MIN_DELAY and RECONNECT_MAX_DELAY seconds.
+# It starts over from the minimum once a connection lasted
+# RECONNECT_STABLE_TIME seconds.
+RECONNECT_MIN_DELAY = 0.2
+RECONNECT_MAX_DELAY = 30
+RECONNECT_STABLE_TIME = 10
+
+# Session resume, used when the fetcher server supports it. Tunnels
+# survive a link drop for RESUME_TIMEOUT seconds. Data sent to the
+# server is kept until acknowledged, up to RESUME_BUFFER_SIZE bytes per
+# link, tunnels stop reading when it is full. Received tunnel messages
+# are acknowledged every RESUME_ACK_FRAMES messages and on every ping.
+SESSION_RESUME = True
+RESUME_TIMEOUT = 30
+RESUME_BUFFER_SIZE = 4 * 1024 * 1024
+RESUME_ACK_FRAMES = 64
+
+# Granularity (seconds) of the shared heartbeat and timeout timers,
+# timers due within it of each other fire together.
+TIMER_RESOLUTION = 0.1
+
+# Flow control watermarks (bytes). When an upstream connection has more
+# than PROCESSOR_WRITE_BUFFER_HIGH bytes waiting to be sent the fetcher
+# link stops reading until it drains below PROCESSOR_WRITE_BUFFER_LOW.
+PROCESSOR_WRITE_BUFFER_HIGH = 256 * 1024
+PROCESSOR_WRITE_BUFFER_LOW = 64 * 1024
+
+# When the fetcher link transport has more than FETCHER_WRITE_BUFFER_HIGH
+# bytes waiting to be sent tunnel data is queued by the link instead,
+# behind the control messages. All the upstream connections stop
+# reading when FETCHER_BULK_QUEUE_HIGH bytes are queued.
+FETCHER_WRITE_BUFFER_HIGH = 256 * 1024
+FETCHER_WRITE_BUFFER_LOW = 64 * 1024
+FETCHER_BULK_QUEUE_HIGH = 1024 * 1024
+FETCHER_BULK_QUEUE_LOW = 256 * 1024
+
+# Bytes of tunnel data each connection gets per deficit round-robin
+# round, when the data queued by a link is shared between connections.
+PRIORITY_QUANTUM = 64 * 1024
+
+# Bandwidth limits of the proxied traffic, in bytes per second, unset
+# for no limit. RATE_LIMIT covers both directions, RATE_LIMIT_UPLOAD the
+# data sent to the fetcher server and RATE_LIMIT_DOWNLOAD the data
+# received from it. RATE_LIMIT_TUNNEL applies to every tunnel in each
+# direction. Bursts of up to RATE_LIMIT_BURST seconds worth of the rate
+# go through unshaped. The limits are per worker process.
+RATE_LIMIT = None
+RATE_LIMIT_UPLOAD = None
+RATE_LIMIT_DOWNLOAD = None
+RATE_LIMIT_TUNNEL = None
+RATE_LIMIT_BURST = 0.1
+
+# Compression of the tunnel data, used when the fetcher server supports
+# it. COMPRESSION is the codec offered to the server, "zlib", unset to
+# send the data as is. Every tunnel compresses its data as one stream at
+# COMPRESSION_LEVEL. Chunks under COMPRESSION_MIN_SIZE bytes are sent as
+# is. A chunk that doesn't shrink below COMPRESSION_MIN_RATIO of its
+# size, e.g. TLS or images, makes its tunnel send the next
+# COMPRESSION_SKIP_SIZE bytes as is. Chunks of COMPRESSION_THREAD_SIZE
+# bytes or more are compressed in a worker thread, off the event loop.
+COMPRESSION = None
+COMPRESSION_LEVEL = 1
+COMPRESSION_MIN_SIZE = 256
+COMPRESSION_MIN_RATIO = 0.9
+COMPRESSION_SKIP_SIZE = 1024 * 1024
+COMPRESSION_THREAD_SIZE = 64 * 1024
+
+# Buffered I/O. With BUFFERED_IO the upstream connections and the
+# fetcher links read into preallocated buffers (asyncio BufferedProtocol)
+# instead of getting a new bytes object per read, and the tunnel data is
+# framed straight from them into the write batch of the link. Upstream
+# reads use READ_BUFFER_SIZE byte buffers from a pool keeping up to
+# READ_BUFFER_POOL_SIZE free ones, per worker process.
+BUFFERED_IO = False
+READ_BUFFER_SIZE = 256 * 1024
+READ_BUFFER_POOL_SIZE = 16
+
+# Number of received messages waiting to be processed at which the
+# fetcher link stops reading.
+FETCHER_QUEUE_HIGH = 1024
+FETCHER_QUEUE_LOW = 256
+
+# Write coalescing on the server links. Messages written during one loop
+# iteration, or within WRITE_FLUSH_DELAY seconds when it is set, are
+# sent together unless WRITE_FLUSH_SIZE bytes are queued first.
+WRITE_COALESCE = True
+WRITE_FLUSH_SIZE = 64 * 1024
+WRITE_FLUSH_DELAY = 0
 
 # These variables will be filled with env-vars values or conf files:
 PUBLIC_KEY = None
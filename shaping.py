@@ -0,0 +1,244 @@
+import time
+import asyncio
+
+from hpxclient import settings
+
+
+SHAPER = None
+
+
+class TokenBucket(object):
+    """ Rate limit of `rate` bytes per second with bursts of `burst` bytes.
+
+    The data is counted after it is read, so the bucket can go into
+    debt. While in debt the readers stop reading and wait() for it to
+    be paid back. They resume with half a burst of tokens available,
+    which keeps the pause/resume cycles few at high rates.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+        self._waiters = []
+        self._handle = None
+
+        self.throttled_time = 0.0
+        self._throttled_since = None
+
+        # Measured rate, over windows of about a second.
+        self._window_start = self.updated
+        self._window_bytes = 0
+        self._measured_rate = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, size, now):
+        """ Counts `size` bytes, returns whether the bucket is in debt. """
+        self._refill(now)
+        self.tokens -= size
+
+        self._window_bytes += size
+        if now - self._window_start >= 1:
+            self._measured_rate = (self._window_bytes
+                                   / (now - self._window_start))
+            self._window_start = now
+            self._window_bytes = 0
+
+        if self.tokens < 0:
+            if self._throttled_since is None:
+                self._throttled_since = now
+            return True
+        return False
+
+    def wait(self, callback):
+        """ Calls `callback` once the bucket is out of debt. """
+        self._waiters.append(callback)
+        if self._handle is None:
+            self._schedule()
+
+    def set_rate(self, rate, burst):
+        """ Changes the limit, keeping the debt of the bucket. """
+        self._refill(time.monotonic())
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.tokens = min(self.tokens, self.burst)
+        if self._handle is not None:
+            self._handle.cancel()
+            self._schedule()
+
+    def release(self):
+        """ Wakes the waiters up, for a limit that is removed. """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self.tokens = self.burst
+        self._wake()
+
+    def _schedule(self):
+        delay = (self.burst / 2 - self.tokens) / self.rate
+        self._handle = asyncio.get_event_loop().call_later(
+            max(delay, 0), self._wake)
+
+    def _wake(self):
+        self._handle = None
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens < 0:
+            self._schedule()
+            return
+
+        if self._throttled_since is not None:
+            self.throttled_time += now - self._throttled_since
+            self._throttled_since = None
+        waiters, self._waiters = self._waiters, []
+        for callback in waiters:
+            callback()
+
+    def get_rate(self):
+        now = time.monotonic()
+        if now - self._window_start >= 2:
+            # Nothing counted for a while.
+            return 0.0
+        return self._measured_rate
+
+    def get_throttled_time(self):
+        if self._throttled_since is None:
+            return self.throttled_time
+        return self.throttled_time + time.monotonic() - self._throttled_since
+
+
+def consume(buckets, size):
+    """ Counts `size` bytes in every bucket. Returns the bucket in debt
+    to wait for, the one with the longest wait, or None.
+    """
+    now = time.monotonic()
+    debtor = None
+    for bucket in buckets:
+        if (bucket.consume(size, now)
+                and (debtor is None
+                     or -bucket.tokens / bucket.rate
+                     > -debtor.tokens / debtor.rate)):
+            debtor = bucket
+    return debtor
+
+
+def make_bucket(rate, burst_time):
+    if not rate or not float(rate):
+        return None
+    return TokenBucket(float(rate), float(rate) * burst_time)
+
+
+def update_bucket(bucket, rate, burst_time):
+    """ Returns the bucket of the new `rate`, `bucket` itself updated if
+    there is one, None if the rate is unset.
+    """
+    if not rate or not float(rate):
+        if bucket is not None:
+            bucket.release()
+        return None
+    if bucket is None:
+        return make_bucket(rate, burst_time)
+    bucket.set_rate(float(rate), float(rate) * burst_time)
+    return bucket
+
+
+class Shaper(object):
+    """ Bandwidth limits of the proxied traffic of a process.
+
+    Upload is the data sent to the fetcher server, read from the
+    upstream connections, download the data received from it. The
+    `total` limit covers both directions, `tunnel_rate` applies to every
+    tunnel in each direction. Unset limits have no bucket.
+    """
+
+    def __init__(self, rate=None, upload_rate=None, download_rate=None,
+                 tunnel_rate=None, burst_time=0.1):
+        self.burst_time = float(burst_time)
+        self.total = make_bucket(rate, self.burst_time)
+        self.upload = make_bucket(upload_rate, self.burst_time)
+        self.download = make_bucket(download_rate, self.burst_time)
+        self.tunnel_rate = tunnel_rate
+
+        self.upload_buckets = [bucket for bucket in (self.total, self.upload)
+                               if bucket is not None]
+        self.download_buckets = [bucket
+                                 for bucket in (self.total, self.download)
+                                 if bucket is not None]
+
+    def update(self, rate=None, upload_rate=None, download_rate=None,
+               tunnel_rate=None, burst_time=0.1):
+        """ Applies new limits. The total, upload and download ones apply
+        to the open tunnels too, the per tunnel one to the tunnels opened
+        from now on. Tunnels with a per tunnel limit keep the buckets
+        they started with otherwise: a limit added is not applied to
+        them and one removed keeps its last rate for them.
+        """
+        self.burst_time = float(burst_time)
+        self.total = update_bucket(self.total, rate, self.burst_time)
+        self.upload = update_bucket(self.upload, upload_rate,
+                                    self.burst_time)
+        self.download = update_bucket(self.download, download_rate,
+                                      self.burst_time)
+        self.tunnel_rate = tunnel_rate
+
+        # Updated in place, the links and tunnels hold these lists.
+        self.upload_buckets[:] = [
+            bucket for bucket in (self.total, self.upload)
+            if bucket is not None]
+        self.download_buckets[:] = [
+            bucket for bucket in (self.total, self.download)
+            if bucket is not None]
+
+    def tunnel_buckets(self):
+        """ Returns the (upload, download) bucket lists of a new tunnel. """
+        upload = self.upload_buckets
+        download = []
+        tunnel_upload = make_bucket(self.tunnel_rate, self.burst_time)
+        if tunnel_upload is not None:
+            upload = upload + [tunnel_upload]
+            download.append(
+                make_bucket(self.tunnel_rate, self.burst_time))
+        return upload, download
+
+    def get_stats(self):
+        stats = {}
+        for name in ('total', 'upload', 'download'):
+            bucket = getattr(self, name)
+            if bucket is None:
+                continue
+            stats['rate_%s' % name] = bucket.get_rate()
+            stats['rate_%s_throttled_seconds' % name] = (
+                bucket.get_throttled_time())
+        return stats
+
+
+def create_shaper(config=settings):
+    return Shaper(
+        rate=config.RATE_LIMIT,
+        upload_rate=config.RATE_LIMIT_UPLOAD,
+        download_rate=config.RATE_LIMIT_DOWNLOAD,
+        tunnel_rate=config.RATE_LIMIT_TUNNEL,
+        burst_time=config.RATE_LIMIT_BURST)
+
+
+def update_shaper(shaper, config=settings):
+    shaper.update(
+        rate=config.RATE_LIMIT,
+        upload_rate=config.RATE_LIMIT_UPLOAD,
+        download_rate=config.RATE_LIMIT_DOWNLOAD,
+        tunnel_rate=config.RATE_LIMIT_TUNNEL,
+        burst_time=config.RATE_LIMIT_BURST)
+
+
+def get_shaper():
+    """ The Shaper of the links that have none of their own. """
+    global SHAPER
+    if SHAPER is None:
+        SHAPER = create_shaper()
+    return SHAPER
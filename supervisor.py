@@ -0,0 +1,135 @@
+import os
+import time
+import queue
+import signal
+import multiprocessing
+
+
+class Supervisor(object):
+    """ Runs the client in `worker_count` forked processes.
+
+    Every worker runs `worker_func(worker_index, stats_queue)` with its
+    own event loop and server links. Dead workers are restarted with an
+    exponential backoff, SIGTERM/SIGHUP are forwarded to the workers,
+    SIGINT as SIGTERM so that they drain their tunnels, and the stats
+    they push to `stats_queue` are aggregated.
+    """
+    MIN_RESTART_DELAY = 1
+    MAX_RESTART_DELAY = 60
+    STATS_INTERVAL = 30
+
+    def __init__(self, worker_count, worker_func):
+        self.worker_count = worker_count
+        self.worker_func = worker_func
+
+        self._context = multiprocessing.get_context('fork')
+        self.stats_queue = self._context.Queue()
+
+        self.workers = {}
+        self.restart_delays = {}
+        self.restart_at = {}
+        self.started_at = {}
+        self.worker_stats = {}
+        self.restarts = 0
+        self.stopping = False
+
+    def start_worker(self, worker_index):
+        process = self._context.Process(
+            target=self._run_worker,
+            args=(worker_index, self.stats_queue),
+            name='hpxclient-worker-%s' % worker_index)
+        process.start()
+        print('Worker %s started [pid=%s]' % (worker_index, process.pid))
+
+        self.workers[worker_index] = process
+        self.started_at[worker_index] = time.time()
+        self.restart_at.pop(worker_index, None)
+
+    def _run_worker(self, worker_index, stats_queue):
+        # Forked workers must not inherit the supervisor handlers. They
+        # handle SIGTERM and SIGHUP once their event loop runs, Ctrl-C
+        # reaches them through the supervisor only.
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.worker_func(worker_index, stats_queue)
+
+    def forward_signal(self, signum, frame):
+        if signum in (signal.SIGTERM, signal.SIGINT):
+            self.stopping = True
+            signum = signal.SIGTERM
+
+        for process in self.workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    def check_workers(self):
+        if self.stopping:
+            return
+
+        now = time.time()
+        for worker_index, process in list(self.workers.items()):
+            if process.is_alive():
+                continue
+
+            if worker_index not in self.restart_at:
+                delay = self.restart_delays.get(worker_index,
+                                                self.MIN_RESTART_DELAY)
+                # Reset the backoff for workers that ran for a while.
+                if now - self.started_at[worker_index] > self.MAX_RESTART_DELAY:
+                    delay = self.MIN_RESTART_DELAY
+
+                print('Worker %s exited [code=%s]. Restarting in %s seconds'
+                      % (worker_index, process.exitcode, delay))
+                self.restart_at[worker_index] = now + delay
+                self.restart_delays[worker_index] = min(
+                    delay * 2, self.MAX_RESTART_DELAY)
+                self.worker_stats.pop(worker_index, None)
+                continue
+
+            if now >= self.restart_at[worker_index]:
+                self.restarts += 1
+                self.start_worker(worker_index)
+
+    def collect_stats(self):
+        while True:
+            try:
+                stats = self.stats_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.worker_stats[stats['worker']] = stats
+
+    def get_stats(self):
+        aggregated = {
+            'workers': self.worker_count,
+            'workers_alive': sum(1 for process in self.workers.values()
+                                 if process.is_alive()),
+            'restarts': self.restarts,
+        }
+        for stats in self.worker_stats.values():
+            for name, value in stats.items():
+                if name in ('worker', 'pid'):
+                    continue
+                aggregated[name] = aggregated.get(name, 0) + value
+        return aggregated
+
+    def run(self):
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, self.forward_signal)
+
+        for worker_index in range(self.worker_count):
+            self.start_worker(worker_index)
+
+        last_report = time.time()
+        while not self.stopping:
+            time.sleep(1)
+            self.collect_stats()
+            self.check_workers()
+
+            if time.time() - last_report >= self.STATS_INTERVAL:
+                last_report = time.time()
+                print('[Supervisor] %s' % self.get_stats())
+
+        for process in self.workers.values():
+            process.join()
+        print('\nClient stopped\n')
@@ -0,0 +1,127 @@
+import heapq
+import asyncio
+import weakref
+
+
+class Timer(object):
+    __slots__ = ('when', 'callback', 'args', 'cancelled', 'scheduler')
+
+    def __init__(self, when, callback, args, scheduler):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.scheduler = scheduler
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        self.callback = None
+        self.args = None
+        if self.scheduler is not None:
+            self.scheduler._timer_cancelled()
+
+
+class TimerScheduler(object):
+    """ Heap of coarse timers sharing a single event loop handle.
+
+    Used for the periodic link and tunnel housekeeping (pings, dead
+    peers, idle tunnels) of every connection. Timers due within
+    `resolution` seconds of each other fire together. Times come from
+    the loop clock, which is monotonic.
+    """
+
+    def __init__(self, loop, resolution=0.1):
+        self.loop = loop
+        self.resolution = resolution
+        self._heap = []
+        self._cancelled = 0
+        self._handle = None
+        self._handle_when = None
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled
+
+    def time(self):
+        return self.loop.time()
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.loop.time() + delay, callback, *args)
+
+    def call_at(self, when, callback, *args):
+        timer = Timer(when, callback, args, self)
+        heapq.heappush(self._heap, timer)
+        if (self._handle_when is None
+                or when < self._handle_when - self.resolution):
+            self._arm(when)
+        return timer
+
+    def _arm(self, when):
+        if self._handle is not None:
+            self._handle.cancel()
+        self._handle_when = when
+        self._handle = self.loop.call_at(when, self._run)
+
+    def _timer_cancelled(self):
+        self._cancelled += 1
+        # Don't let cancelled timers pile up in the heap.
+        if self._cancelled > 64 and self._cancelled > len(self._heap) // 2:
+            self._heap[:] = [timer for timer in self._heap
+                             if not timer.cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+
+    def _run(self):
+        self._handle = None
+        self._handle_when = None
+
+        # Timers added by the callbacks wait for the next run, even when
+        # they are due already.
+        heap = self._heap
+        deadline = self.loop.time() + self.resolution
+        due = []
+        while heap and heap[0].when <= deadline:
+            timer = heapq.heappop(heap)
+            if timer.cancelled:
+                self._cancelled -= 1
+                continue
+            timer.scheduler = None
+            due.append(timer)
+
+        for timer in due:
+            if timer.cancelled:
+                continue
+            callback, args = timer.callback, timer.args
+            timer.cancelled = True
+            timer.callback = None
+            timer.args = None
+            try:
+                callback(*args)
+            except Exception as e:
+                print('Timer callback error %r: %r' % (callback, e))
+
+        while heap and heap[0].cancelled:
+            heapq.heappop(heap)
+            self._cancelled -= 1
+        # The callbacks may have armed the handle for a timer of their
+        # own, later than the ones left in the heap.
+        if heap and (self._handle_when is None
+                     or heap[0].when < self._handle_when):
+            self._arm(heap[0].when)
+
+
+_SCHEDULERS = weakref.WeakKeyDictionary()
+
+
+def get_scheduler(loop=None, resolution=0.1):
+    """ Returns the scheduler shared by everything running on `loop`. """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    scheduler = _SCHEDULERS.get(loop)
+    if scheduler is None:
+        scheduler = _SCHEDULERS[loop] = TimerScheduler(loop, resolution)
+    return scheduler
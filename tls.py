@@ -0,0 +1,102 @@
+import ssl
+
+from hpxclient import metrics
+from hpxclient import settings
+
+
+SSL_CONTEXT = None
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """ Client context resuming the last TLS session of each server name.
+
+    asyncio doesn't let create_connection() pass a session, so it is
+    injected when the loop wraps the connection, see wrap_bio().
+    Sessions are stored by remember_session() once a link is up.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.sessions = {}
+        self.session_resumption = True
+
+    def wrap_bio(self, incoming, outgoing, server_side=False,
+                 server_hostname=None, session=None):
+        if session is None and not server_side and self.session_resumption:
+            session = self.sessions.get(server_hostname)
+        return super().wrap_bio(incoming, outgoing, server_side=server_side,
+                                server_hostname=server_hostname,
+                                session=session)
+
+    def remember_session(self, ssl_object):
+        session = ssl_object.session
+        if session is None or not self.session_resumption:
+            return
+        if ssl_object.server_hostname is not None:
+            self.sessions[ssl_object.server_hostname] = session
+
+
+def parse_list(value):
+    if not value:
+        return []
+    return [item.strip() for item in str(value).split(',') if item.strip()]
+
+
+def create_ssl_context():
+    context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+    if settings.TLS_CA_FILE:
+        context.load_verify_locations(cafile=settings.TLS_CA_FILE)
+    if settings.TLS_CIPHERS:
+        context.set_ciphers(settings.TLS_CIPHERS)
+    alpn_protocols = parse_list(settings.TLS_ALPN_PROTOCOLS)
+    if alpn_protocols:
+        context.set_alpn_protocols(alpn_protocols)
+    context.session_resumption = (
+        str(settings.TLS_SESSION_RESUMPTION) == "True")
+    return context
+
+
+def get_ssl_context():
+    """ Returns the context shared by all the server links. """
+    global SSL_CONTEXT
+    if SSL_CONTEXT is None:
+        SSL_CONTEXT = create_ssl_context()
+    return SSL_CONTEXT
+
+
+def reset_ssl_context():
+    """ Makes the links connected from now on use a new context, with the
+    current TLS settings. Their sessions aren't resumed.
+    """
+    global SSL_CONTEXT
+    SSL_CONTEXT = None
+
+
+def get_ssl_object(transport):
+    if transport is None:
+        return None
+    return transport.get_extra_info('ssl_object')
+
+
+def remember_session(transport):
+    """ Stores the TLS session of the link for the next connects. TLS 1.3
+    servers send the session tickets after the handshake, so this is
+    called again when the link closes.
+    """
+    ssl_object = get_ssl_object(transport)
+    if ssl_object is None:
+        return
+    context = ssl_object.context
+    if isinstance(context, ResumingSSLContext):
+        context.remember_session(ssl_object)
+
+
+def handshake_completed(transport, seconds):
+    ssl_object = get_ssl_object(transport)
+    if ssl_object is None:
+        return
+    resumed = 'true' if ssl_object.session_reused else 'false'
+    metrics.TLS_HANDSHAKE_SECONDS.labels(resumed).observe(seconds)
+    print('TLS %s handshake in %.3fs [resumed=%s]' % (
+        ssl_object.version(), seconds, resumed))